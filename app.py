@@ -1,16 +1,39 @@
 import os
 import json
 import requests
+from urllib3.exceptions import NewConnectionError
 from datetime import datetime
-from requests_oauthlib import OAuth1Session
 from collections import defaultdict
 import redis
-from openai import OpenAI
+import archive
+import events
+import feeds
+import http_clients
+import leader
+import metrics
+import outbox
+import renames
+import scheduler
+import screening
+from snapshot import CompactSnapshot, changed_fields, iter_names
+import threading
 import ssl
 import time
+import re
+import hashlib
+import sys
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from feeds import FINGERPRINT_FIELDS, iter_file_chunks
 
-# URL of the consolidated list
-CONSOLIDATED_LIST_URL = "https://data.trade.gov/downloadable_consolidated_screening_list/v1/consolidated.json"
+# The lists being tracked (see feeds.py). The consolidated list is the default feed
+CONSOLIDATED_LIST_URL = feeds.FEEDS[feeds.DEFAULT_FEED].url
+DEFAULT_FEED = feeds.DEFAULT_FEED
+
+# Redis keys for the unchanged-list fast path, per feed (see feed_key)
+LIST_ETAG_KEY = 'csl_etag'
+LIST_LAST_MODIFIED_KEY = 'csl_last_modified'
+LIST_DIGEST_KEY = 'csl_digest'
 
 # Redis setup
 redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
@@ -37,92 +60,608 @@ ACCESS_TOKEN_SECRET = os.environ.get("ACCESS_TOKEN_SECRET")
 KIMI_API_KEY = os.environ.get("KIMI_API_KEY")
 KIMI_BASE_URL = "https://api.moonshot.ai/v1"
 
+# Redis cache of Kimi answers per normalized entity name and source
+KIMI_CACHE_PREFIX = 'kimi_cache:'
+KIMI_CACHE_LRU_KEY = 'kimi_cache_lru'  # Sorted set of cache keys by expiry time
+KIMI_CACHE_STATS_KEY = 'kimi_cache_stats'  # Hash of lookup/hit counters
+KIMI_CACHE_TTL = int(os.getenv('KIMI_CACHE_TTL', 30 * 24 * 60 * 60))  # Seconds to keep found context after its last hit
+KIMI_CACHE_NEGATIVE_TTL = int(os.getenv('KIMI_CACHE_NEGATIVE_TTL', 24 * 60 * 60))  # Seconds to keep NO_INFO
+KIMI_CACHE_MAX_ENTRIES = int(os.getenv('KIMI_CACHE_MAX_ENTRIES', 10000))
+KIMI_NO_INFO = 'NO_INFO'
+
+# Batched enrichment: several entities per Kimi request when many are added at once
+KIMI_BATCH_ENABLED = os.getenv('KIMI_BATCH_ENABLED', 'true').lower() == 'true'
+KIMI_BATCH_TOKEN_BUDGET = int(os.getenv('KIMI_BATCH_TOKEN_BUDGET', 4000))  # Prompt plus expected answer tokens
+KIMI_MAX_BATCH_SIZE = int(os.getenv('KIMI_MAX_BATCH_SIZE', 20))
+KIMI_ANSWER_TOKENS = 80  # Roughly one 240-character summary
+
 # Production safeguards
 MAX_FOLLOW_UPS_PER_RUN = 5  # Prevent spam if batch sanctions drop
-RATE_LIMIT_DELAY = 2  # Seconds between tweets to avoid rate limits
+# Thread packing
+TWEET_MAX_LENGTH = 280  # Twitter-weighted characters per tweet
+NUMBER_THREAD_PARTS = os.getenv('NUMBER_THREAD_PARTS', 'false').lower() == 'true'  # Append "1/7" to each tweet
+TWEET_URL_LENGTH = 23  # Every URL counts as a t.co link
+URL_PATTERN = re.compile(r'https?://\S+')
+# Code point ranges that weigh 1; everything else (CJK, emoji...) weighs 2
+LIGHT_CHARACTER_RANGES = ((0x0000, 0x10FF), (0x2000, 0x200D), (0x2010, 0x201F), (0x2032, 0x2037))
+NAME_SEPARATOR = ", and "
+SECTION_SEPARATOR = " | "
 
-def test_redis_connection():
-    try:
-        redis_client.ping()
-        print("Successfully connected to Redis!")
-    except Exception as e:
-        print(f"Redis connection error: {e}")
+# 'outbox' leaves posting to the publisher process ('python app.py publish');
+# 'inline' drains the outbox at the end of each detection run
+PUBLISH_MODE = os.getenv('PUBLISH_MODE', 'outbox')
+DAEMON_PUBLISHER = os.getenv('DAEMON_PUBLISHER', 'true').lower() == 'true'  # Run the publisher inside the daemon
+SHUTDOWN_GRACE = float(os.getenv('SHUTDOWN_GRACE', 20))  # Seconds to flush queued tweets on SIGTERM
+
+# Local name screening over the tracked list (see screening.py). The daemon serves it
+# when SCREENING_PORT is set and keeps it current from each run's changes.
+SCREENING_HOST = os.getenv('SCREENING_HOST', '127.0.0.1')
+SCREENING_PORT = os.getenv('SCREENING_PORT')
+screening_index = None
+ENRICHMENT_CONCURRENCY = int(os.getenv('ENRICHMENT_CONCURRENCY', 5))  # Parallel Kimi lookups
+ENRICHMENT_TIMEOUT = float(os.getenv('ENRICHMENT_TIMEOUT', 60))  # Seconds allowed per Kimi lookup
+
+# State storage: 'blob' keeps the whole list as one JSON string, 'sets' keeps
+# one Redis set of names per source and diffs them server-side. Each feed has its
+# own copy of these keys (see feed_key); the version is shared by all feeds
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'blob')
+STATE_BLOB_KEY = 'previous_state'
+STATE_SOURCES_KEY = 'state:sources'
+STATE_SOURCE_KEY_PREFIX = 'state:source:'
+STAGED_SOURCES_KEY = 'state:next:sources'
+STAGED_SOURCE_KEY_PREFIX = 'state:next:source:'
+STATE_BATCH_SIZE = 1000  # Members per SADD, and commands per pipeline flush
+STATE_VERSION_KEY = 'state_version'  # Incremented with every saved snapshot
+
+# In-process copy of each feed's last saved snapshot and list validators. Only the daemon
+# turns this on; one-shot runs always read state from Redis.
+memory_state = {'enabled': False, 'version': None, 'snapshots': {}, 'validators': {}, 'diffed_in_memory': set()}
+
+# State writes are compare-and-set: they only go through if the state version is still
+# the one this process last read or wrote, and no holder of a newer detector lease
+# (higher fencing token) has written since
+STATE_FENCE_KEY = 'state_fence'  # Fencing token of the last writer
+state_guard = {'read': False, 'version': None, 'token': None}
+
+# Only the replica holding the detector lease runs detection; the others stand by (see leader.py)
+LEADER_ELECTION = os.getenv('LEADER_ELECTION', 'true').lower() == 'true'
+DETECTOR_LEASE = 'detector'
+
+# Post entries whose details changed (programs, addresses, aliases...) as "updated"
+POST_MODIFICATIONS = os.getenv('POST_MODIFICATIONS', 'true').lower() == 'true'
+
+# Post an entry whose name changed under the same id, or a removal and an addition that look
+# like one entry respelled, as "renamed" (see renames.py)
+RENAME_DETECTION = os.getenv('RENAME_DETECTION', 'true').lower() == 'true'
+
+# Keep a compressed history of snapshots and per-run deltas (see archive.py)
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'true').lower() == 'true'
+
+# Publish each changed entry to a Redis Stream for downstream services (see events.py)
+EVENTS_ENABLED = os.getenv('EVENTS_ENABLED', 'true').lower() == 'true'
+
+def use_redis(client):
+    """
+    Points the pipeline at another Redis client, e.g. fakes.FakeRedis(), and forgets what
+    was read from the previous one. The HTTP, Twitter and Kimi clients are swapped with
+    http_clients.use_client.
+    """
+    global redis_client
+    redis_client = client
+    state_guard.update(read=False, version=None, token=None)
+    memory_state.update(version=None, snapshots={}, validators={}, diffed_in_memory=set())
+    return client
+
+def stream_current_list():
+    """Downloads the consolidated list in chunks and yields projected records as they arrive."""
+    feed = feeds.FEEDS[DEFAULT_FEED]
+    with http_clients.get_csl_session().get(feed.url, stream=True) as response:
+        response.raise_for_status()
+        yield from feed.iter_records(response.iter_content(chunk_size=feeds.STREAM_CHUNK_SIZE),
+                                     feeds.reusing_projector((feed.format, feed.source)))
 
 def get_current_list():
-    response = requests.get(CONSOLIDATED_LIST_URL)
-    full_data = response.json()
-    # Extract only sources and names
-    simplified_data = [{'source': item['source'], 'name': item['name']} for item in full_data['results']]
-    return simplified_data
+    # Extract only sources and names, parsing the body as it streams in
+    return list(stream_current_list())
 
-def load_previous_state():
-    state = redis_client.get('previous_state')
-    if state:
-        return json.loads(state)
-    return None
+def rehydrate_records(feed, path, records):
+    """Re-reads a downloaded feed body and returns the full record for each given record, keyed by identity."""
+    wanted = {record_identity(record) for record in records}
+    found = {}
+    with open(path, 'rb') as body:
+        for item in feed.iter_records(iter_file_chunks(body), project=lambda item: item):
+            key = record_identity(item)
+            if key in wanted:
+                found[key] = item
+    return found
 
-def save_current_state(current_state):
-    redis_client.set('previous_state', json.dumps(current_state))
+def feed_key(feed, key):
+    # The default feed keeps the original key names, so state saved before feeds existed carries over
+    return key if feed == DEFAULT_FEED else f"feed:{feed}:{key}"
+
+def known_validators(feed_list):
+    """
+    Per feed, the download() arguments for a conditional fetch: the stored ETag,
+    Last-Modified and digest, and whether a snapshot has been saved. Feeds are read
+    in one round trip, or from memory in the daemon.
+    """
+    known = {}
+    unknown = []
+    for feed in feed_list:
+        cached = memory_state['validators'].get(feed.name) if memory_state['enabled'] else None
+        if cached is None:
+            unknown.append(feed.name)
+            continue
+        # The daemon remembers what it saved, so a steady-state tick needs no Redis round trip
+        known[feed.name] = {
+            'etag': cached.get('etag'),
+            'last_modified': cached.get('last_modified'),
+            'digest': cached.get('digest'),
+            'has_state': memory_state['snapshots'].get(feed.name) is not None,
+        }
+
+    if unknown:
+        with metrics.stage('redis_read'):
+            pipe = redis_client.pipeline()
+            for name in unknown:
+                pipe.mget(feed_key(name, LIST_ETAG_KEY), feed_key(name, LIST_LAST_MODIFIED_KEY), feed_key(name, LIST_DIGEST_KEY))
+                pipe.exists(state_key(name))
+            results = pipe.execute()
+        for i, name in enumerate(unknown):
+            etag, last_modified, digest = (value and value.decode() for value in results[2 * i])
+            known[name] = {'etag': etag, 'last_modified': last_modified, 'digest': digest, 'has_state': bool(results[2 * i + 1])}
+    return known
+
+def save_list_validators(validators, feed=DEFAULT_FEED):
+    pipe = redis_client.pipeline()
+    for key, field in ((LIST_ETAG_KEY, 'etag'), (LIST_LAST_MODIFIED_KEY, 'last_modified'), (LIST_DIGEST_KEY, 'digest')):
+        if validators.get(field):
+            pipe.set(feed_key(feed, key), validators[field])
+        else:
+            pipe.delete(feed_key(feed, key))
+    pipe.execute()
+    if memory_state['enabled']:
+        memory_state['validators'][feed] = dict(validators)
+
+def state_key(feed=DEFAULT_FEED):
+    # Key whose existence means a previous snapshot has been saved
+    return feed_key(feed, STATE_SOURCES_KEY if STATE_BACKEND == 'sets' else STATE_BLOB_KEY)
+
+def load_previous_state(feed=DEFAULT_FEED):
+    with metrics.stage('state_load') as timer:
+        # The version is read first, so a write in between shows up as a conflict when saving
+        if STATE_BACKEND == 'sets':
+            note_state_version(redis_client.get(STATE_VERSION_KEY))
+            state = load_state_sets(feed_key(feed, STATE_SOURCES_KEY), feed_key(feed, STATE_SOURCE_KEY_PREFIX))
+            timer.add(records=len(state or ()))
+            return CompactSnapshot.from_records(state) if state else None
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(STATE_VERSION_KEY)
+        pipe.get(feed_key(feed, STATE_BLOB_KEY))
+        version, state = pipe.execute()
+        note_state_version(version)
+        if state:
+            timer.add(bytes=len(state))
+            state = CompactSnapshot.from_records(json.loads(state))
+            timer.add(records=len(state))
+            return state
+        return None
+
+def save_current_state(current_state, feed=DEFAULT_FEED):
+    """Saves the snapshot and returns the new state version."""
+    if STATE_BACKEND == 'sets':
+        stage_state_sets(current_state, feed)
+        return commit_staged_state_sets(feed)
+    key = feed_key(feed, STATE_BLOB_KEY)
+    payload = json.dumps(list(current_state))
+    metrics.count('redis_bytes_written', len(payload), key=key)
+    return write_state(lambda pipe: pipe.set(key, payload))
+
+class StateConflict(Exception):
+    """The saved state changed since this process read it, or a newer lease holder wrote it."""
+
+def note_state_version(version):
+    state_guard['read'] = True
+    state_guard['version'] = int(version) if version is not None else None
+
+def write_state(queue_writes):
+    """
+    Calls queue_writes(pipe) inside MULTI and bumps the state version, but only if the
+    version is still the one last read and our fencing token (state_guard['token'], set
+    while holding the detector lease) is not older than the last writer's. Returns the
+    new version; raises StateConflict instead of writing otherwise.
+    """
+    token = state_guard['token']
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(STATE_VERSION_KEY, STATE_FENCE_KEY)
+            version, fence = pipe.mget(STATE_VERSION_KEY, STATE_FENCE_KEY)
+            version = int(version) if version is not None else None
+            if state_guard['read'] and version != state_guard['version']:
+                raise StateConflict(f"state is at version {version}, this run read version {state_guard['version']}")
+            if token is not None and fence is not None and int(fence) > token:
+                raise StateConflict(f"fencing token {token} is older than the last writer's ({int(fence)})")
+            pipe.multi()
+            queue_writes(pipe)
+            if token is not None:
+                pipe.set(STATE_FENCE_KEY, token)
+            pipe.incr(STATE_VERSION_KEY)
+            new_version = pipe.execute()[-1]
+        except redis.WatchError:
+            raise StateConflict("state was written by another process while saving")
+    note_state_version(new_version)
+    return new_version
+
+def cached_snapshot(feed=DEFAULT_FEED):
+    """The daemon's in-memory snapshot of a feed, if nothing else has saved state since."""
+    if not memory_state['enabled'] or memory_state['snapshots'].get(feed) is None:
+        return None
+    version = redis_client.get(STATE_VERSION_KEY)
+    if version is None or int(version) != memory_state['version']:
+        return None
+    note_state_version(version)
+    return memory_state['snapshots'][feed]
+
+def diff_with_previous_state(current_list, feed=DEFAULT_FEED):
+    """
+    Compares the current list with the feed's saved snapshot and returns the diff_records
+    result, or None if no snapshot has been saved yet. With the 'sets' backend the current list
+    is staged in Redis and diffed server-side, so only the delta comes back; call
+    commit_current_state afterwards to make the staged list the new snapshot.
+    In daemon mode the in-memory snapshot is diffed locally instead.
+    """
+    previous_list = cached_snapshot(feed)
+    if previous_list is not None:
+        memory_state['diffed_in_memory'].add(feed)
+        return diff_records(previous_list, current_list)
+    memory_state['diffed_in_memory'].discard(feed)
+
+    if STATE_BACKEND == 'sets':
+        stage_state_sets(current_list, feed)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(STATE_VERSION_KEY)
+        pipe.exists(feed_key(feed, STATE_SOURCES_KEY))
+        version, has_state = pipe.execute()
+        note_state_version(version)
+        if not has_state:
+            return None
+        return diff_state_sets(feed)
+    previous_list = load_previous_state(feed)
+    if previous_list is None:
+        return None
+    return diff_records(previous_list, current_list)
+
+def commit_current_state(current_list, feed=DEFAULT_FEED):
+    """Saves the current list as the feed's new snapshot. Raises StateConflict if the state moved on since it was read."""
+    try:
+        with metrics.stage('state_save') as timer:
+            timer.add(records=len(current_list))
+            if STATE_BACKEND == 'sets' and feed in memory_state['diffed_in_memory']:
+                version = apply_state_delta_sets(memory_state['snapshots'][feed], current_list, feed)
+            elif STATE_BACKEND == 'sets':
+                version = commit_staged_state_sets(feed)
+            else:
+                version = save_current_state(current_list, feed)
+    finally:
+        memory_state['diffed_in_memory'].discard(feed)
+    if memory_state['enabled']:
+        memory_state['version'] = version
+        memory_state['snapshots'][feed] = current_list
+
+# Set members carry the fingerprint so a modified record shows up in SDIFF;
+# members written before fingerprints existed are a bare name
+MEMBER_SEPARATOR = '\x1f'
+
+def encode_member(item):
+    if not item.get('fp'):
+        return item['name']
+    return MEMBER_SEPARATOR.join((item['name'], item.get('id') or '', item['fp'], item['fh']))
+
+def decode_member(source, member):
+    name, _, rest = member.decode().partition(MEMBER_SEPARATOR)
+    if not rest:
+        return {'source': source, 'name': name}
+    record_id, fp, fh = rest.split(MEMBER_SEPARATOR)
+    return {'source': source, 'name': name, 'id': record_id or None, 'fp': fp, 'fh': fh}
+
+def load_state_sets(sources_key, source_key_prefix):
+    sources = sorted(member.decode() for member in redis_client.smembers(sources_key))
+    if not sources:
+        return None
+    pipe = redis_client.pipeline(transaction=False)
+    for source in sources:
+        pipe.smembers(source_key_prefix + source)
+    state = []
+    for source, members in zip(sources, pipe.execute()):
+        state.extend(decode_member(source, member) for member in members)
+    return state
+
+def stage_state_sets(current_state, feed=DEFAULT_FEED):
+    with metrics.stage('state_stage') as timer:
+        timer.add(records=len(current_state))
+        _stage_state_sets(current_state, feed)
+
+def _stage_state_sets(current_state, feed):
+    staged_sources_key = feed_key(feed, STAGED_SOURCES_KEY)
+    staged_prefix = feed_key(feed, STAGED_SOURCE_KEY_PREFIX)
+    names_by_source = defaultdict(list)
+    for item in current_state:
+        names_by_source[item['source']].append(encode_member(item))
+
+    # Drop whatever an earlier, uncommitted run left behind
+    stale_sources = redis_client.smembers(staged_sources_key)
+    pipe = redis_client.pipeline(transaction=False)
+    for source in stale_sources:
+        pipe.delete(staged_prefix + source.decode())
+    pipe.delete(staged_sources_key)
+
+    pending = len(pipe)
+    for source, names in names_by_source.items():
+        pipe.sadd(staged_sources_key, source)
+        for i in range(0, len(names), STATE_BATCH_SIZE):
+            pipe.sadd(staged_prefix + source, *names[i:i + STATE_BATCH_SIZE])
+            pending += 1
+            if pending >= STATE_BATCH_SIZE:
+                pipe.execute()
+                pending = 0
+    pipe.execute()
+
+def diff_state_sets(feed=DEFAULT_FEED):
+    state_prefix = feed_key(feed, STATE_SOURCE_KEY_PREFIX)
+    staged_prefix = feed_key(feed, STAGED_SOURCE_KEY_PREFIX)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.smembers(feed_key(feed, STATE_SOURCES_KEY))
+    pipe.smembers(feed_key(feed, STAGED_SOURCES_KEY))
+    previous_sources, current_sources = pipe.execute()
+    sources = sorted(source.decode() for source in previous_sources | current_sources)
+
+    for source in sources:
+        pipe.sdiff(staged_prefix + source, state_prefix + source)
+        pipe.sdiff(state_prefix + source, staged_prefix + source)
+    results = pipe.execute()
+
+    # Only the differing members came back; pair them up like a regular diff
+    previous_delta = []
+    current_delta = []
+    for i, source in enumerate(sources):
+        current_delta.extend(decode_member(source, member) for member in sorted(results[2 * i]))
+        previous_delta.extend(decode_member(source, member) for member in sorted(results[2 * i + 1]))
+    return diff_records(previous_delta, current_delta)
+
+def commit_staged_state_sets(feed=DEFAULT_FEED):
+    sources_key = feed_key(feed, STATE_SOURCES_KEY)
+    staged_sources_key = feed_key(feed, STAGED_SOURCES_KEY)
+    state_prefix = feed_key(feed, STATE_SOURCE_KEY_PREFIX)
+    staged_prefix = feed_key(feed, STAGED_SOURCE_KEY_PREFIX)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.smembers(sources_key)
+    pipe.smembers(staged_sources_key)
+    previous_sources, current_sources = pipe.execute()
+
+    # Swap the staged sets in atomically
+    def swap(pipe):
+        for source in previous_sources - current_sources:
+            pipe.delete(state_prefix + source.decode())
+        for source in current_sources:
+            pipe.rename(staged_prefix + source.decode(), state_prefix + source.decode())
+        if current_sources:
+            pipe.rename(staged_sources_key, sources_key)
+        else:
+            pipe.delete(sources_key)
+    return write_state(swap)
+
+def apply_state_delta_sets(previous_list, current_list, feed=DEFAULT_FEED):
+    """Writes only the members that changed between two snapshots, for when the diff was done in memory."""
+    sources_key = feed_key(feed, STATE_SOURCES_KEY)
+    state_prefix = feed_key(feed, STATE_SOURCE_KEY_PREFIX)
+    previous_members = defaultdict(set)
+    current_members = defaultdict(set)
+    for item in previous_list:
+        previous_members[item['source']].add(encode_member(item))
+    for item in current_list:
+        current_members[item['source']].add(encode_member(item))
+
+    def apply(pipe):
+        for source in previous_members.keys() | current_members.keys():
+            key = state_prefix + source
+            added = list(current_members[source] - previous_members[source])
+            removed = list(previous_members[source] - current_members[source])
+            for i in range(0, len(added), STATE_BATCH_SIZE):
+                pipe.sadd(key, *added[i:i + STATE_BATCH_SIZE])
+            for i in range(0, len(removed), STATE_BATCH_SIZE):
+                pipe.srem(key, *removed[i:i + STATE_BATCH_SIZE])
+            if current_members[source]:
+                pipe.sadd(sources_key, source)
+            else:
+                pipe.srem(sources_key, source)
+    return write_state(apply)
+
+def migrate_state(backend='sets'):
+    """One-time copy of each enabled feed's saved snapshot into the given backend ('sets' or 'blob')."""
+    global STATE_BACKEND
+    if backend not in ('sets', 'blob'):
+        raise ValueError(f"Unknown state backend: {backend}")
+    source_backend = 'blob' if backend == 'sets' else 'sets'
+
+    configured_backend = STATE_BACKEND
+    try:
+        for feed in feeds.enabled_feeds():
+            STATE_BACKEND = source_backend
+            state = load_previous_state(feed.name)
+            if state is None:
+                print(f"No {source_backend} state found for the {feed.name} feed, nothing to migrate.")
+                continue
+            STATE_BACKEND = backend
+            save_current_state(state, feed.name)
+            print(f"Migrated {len(state)} {feed.name} records from the {source_backend} backend to the {backend} backend.")
+    finally:
+        STATE_BACKEND = configured_backend
+    print(f"Set STATE_BACKEND={backend} to use the migrated state.")
+
+def record_identity(item):
+    # The CSL id survives renames; fall back to source plus name for records without one
+    if item.get('id'):
+        return item['id']
+    return (item['source'], item['name'])
+
+def diff_records(previous, current):
+    """
+    Single-pass diff keyed on record identity. Returns a dict with 'added' and
+    'removed' ({source: [names]}) and 'modified' ({source: [{'name', 'id', 'fields'}]}),
+    where a record is modified when its content fingerprint changed, plus 'added_ids'
+    and 'removed_ids' ({(source, name): id}) for the added and removed records that
+    carry an id, so renames.reconcile can keep distinct entries apart. Records saved
+    before fingerprints existed are only ever added or removed. When either side is a
+    CompactSnapshot the diff runs on its columns instead.
+    """
+    if isinstance(previous, CompactSnapshot) or isinstance(current, CompactSnapshot):
+        previous, current = (
+            records if isinstance(records, CompactSnapshot) else CompactSnapshot.from_records(records)
+            for records in (previous, current)
+        )
+        if previous.keyed_by_id != current.keyed_by_id:
+            previous, current = previous.keyed_by_name(), current.keyed_by_name()
+        if previous.has_unique_identities() and current.has_unique_identities():
+            return previous.diff(current, FINGERPRINT_FIELDS)
+        # Duplicate identities: the record-by-record diff below decides which copy counts
+    # Identify by id only when every record has one, so state saved without ids still lines up
+    use_ids = all(item.get('id') for item in previous) and all(item.get('id') for item in current)
+    identity = record_identity if use_ids else (lambda item: (item['source'], item['name']))
+
+    previous_index = {identity(item): item for item in previous}
 
-def compare_lists(previous, current):
-    previous_items = {item['name']: item['source'] for item in previous}
-    current_items = {item['name']: item['source'] for item in current}
-    
     added = defaultdict(list)
     removed = defaultdict(list)
-    
-    for name, source in current_items.items():
-        if name not in previous_items:
-            added[source].append(name)
-    
-    for name, source in previous_items.items():
-        if name not in current_items:
-            removed[source].append(name)
-    
+    modified = defaultdict(list)
+    added_ids, removed_ids = {}, {}
+
+    for item in current:
+        old = previous_index.pop(identity(item), None)
+        if old is None:
+            added[item['source']].append(item['name'])
+            if item.get('id'):
+                added_ids[(item['source'], item['name'])] = item['id']
+        elif old.get('fp') and item.get('fp') and old['fp'] != item['fp']:
+            entry = {'name': item['name'], 'id': item.get('id'), 'fields': changed_fields(old['fh'], item['fh'], FINGERPRINT_FIELDS)}
+            if (old['source'], old['name']) != (item['source'], item['name']):
+                entry['previous_source'] = old['source']
+                entry['previous_name'] = old['name']
+            modified[item['source']].append(entry)
+
+    for item in previous_index.values():
+        removed[item['source']].append(item['name'])
+        if item.get('id'):
+            removed_ids[(item['source'], item['name'])] = item['id']
+
+    return {'added': added, 'removed': removed, 'modified': modified, 'added_ids': added_ids, 'removed_ids': removed_ids}
+
+def archive_delta(changes):
+    # The archive tracks names per source, so modified records that moved count as remove plus add
+    added = {source: list(names) for source, names in changes['added'].items()}
+    removed = {source: list(names) for source, names in changes['removed'].items()}
+    for source, entries in changes['modified'].items():
+        for entry in entries:
+            if 'previous_name' in entry:
+                added.setdefault(source, []).append(entry['name'])
+                removed.setdefault(entry['previous_source'], []).append(entry['previous_name'])
     return added, removed
 
-def send_tweet(message, in_reply_to_id=None):
+def compare_lists(previous, current):
+    changes = diff_records(previous, current)
+    return changes['added'], changes['removed']
+
+def request_never_sent(error):
+    """
+    Whether a requests ConnectionError happened before the request went out: a connect
+    timeout or a connection that was never established. requests raises ConnectionError
+    for a connection dropped after sending too, when the request may have been handled.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+def post_tweet(message, in_reply_to_id=None):
+    """Posts a tweet and returns (tweet_id, response headers). Raises outbox.TweetError if it was not created."""
     payload = {"text": message}
     if in_reply_to_id:
         payload["reply"] = {"in_reply_to_tweet_id": in_reply_to_id}
     
-    oauth = OAuth1Session(
-        CONSUMER_KEY,
-        client_secret=CONSUMER_SECRET,
-        resource_owner_key=ACCESS_TOKEN,
-        resource_owner_secret=ACCESS_TOKEN_SECRET,
-    )
+    oauth = http_clients.get_twitter_session(CONSUMER_KEY, CONSUMER_SECRET, ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
     
-    response = oauth.post(
-        "https://api.twitter.com/2/tweets",
-        json=payload,
-    )
+    try:
+        with metrics.stage('twitter_request'):
+            response = oauth.post(
+                "https://api.twitter.com/2/tweets",
+                json=payload,
+            )
+    except requests.exceptions.ConnectionError as e:
+        if not request_never_sent(e):
+            # Twitter may have taken the tweet before the connection dropped; not safe to retry
+            metrics.count('tweets', status='uncertain')
+            raise
+        metrics.count('tweets', status='unreachable')
+        raise outbox.TweetError(f"Could not reach Twitter: {e}")
+    metrics.count('tweets', status=response.status_code)
     
     if response.status_code != 201:
-        raise Exception(
-            f"Request returned an error: {response.status_code} {response.text}"
+        raise outbox.TweetError(
+            f"Request returned an error: {response.status_code} {response.text}",
+            status_code=response.status_code,
+            headers=response.headers,
         )
     
     print(f"Tweet sent successfully: {message}")
     json_response = response.json()
-    return json_response['data']['id']
+    return json_response['data']['id'], response.headers
+
+def publish_outbox(block=False, stop=None):
+    """
+    Posts queued tweets under the token-bucket limiter, while holding the publisher lease,
+    so one replica publishes at a time. Without block, returns straight away if another
+    replica holds it. block=True keeps running until `stop` is set, polling for the lease
+    every STANDBY_POLL_INTERVAL seconds while another replica has it.
+    """
+    stop = stop or threading.Event()
+    lease = leader.Lease(redis_client, outbox.PUBLISHER_LEASE)
+    limiter = outbox.TokenBucket(redis_client=redis_client)
+    posted = 0
+    try:
+        while True:
+            if lease.ensure():
+                posted += outbox.drain(redis_client, post_tweet, limiter, lease, block=block, stop=stop)
+            elif not block:
+                print(f"Tweets are being published by {lease.holder()}, leaving the queue to it.")
+            if not block or stop.wait(leader.STANDBY_POLL_INTERVAL):
+                break
+    finally:
+        lease.release()
+    print(f"Published {posted} queued tweets.")
+    return posted
+
+def run_publisher():
+    try:
+        publish_outbox(block=True)
+    except KeyboardInterrupt:
+        print("Publisher stopped.")
+
+def kimi_client():
+    # One attempt per request, so a lookup never outlives its timeout; enrich_entities
+    # retries what a batch left unanswered as requests of their own
+    return http_clients.get_kimi_client(KIMI_API_KEY, KIMI_BASE_URL).with_options(max_retries=0)
 
-def get_sanctions_context_with_kimi(name, source):
+def query_kimi_context(name, source, timeout=None):
     """
     Uses Kimi API with web search to get structured context about a sanctioned party.
     Kimi researches the entity using authoritative sources and provides structured context.
-    Returns None only if Kimi cannot find any verified information.
+    Returns None if Kimi cannot find any verified information; API errors are raised.
     """
-    try:
-        client = OpenAI(
-            api_key=KIMI_API_KEY,
-            base_url=KIMI_BASE_URL
-        )
-        
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a sanctions research specialist. Use web search to find official information from OFAC, Treasury.gov, BIS, and government sources.
+    client = kimi_client()
+    
+    messages = [
+        {
+            "role": "system",
+            "content": """You are a sanctions research specialist. Use web search to find official information from OFAC, Treasury.gov, BIS, and government sources.
 
 CRITICAL RULES:
 1. Output ONLY the final answer. Never output search queries, thinking process, or phrases like "I'll search" or "Let me find"
@@ -131,18 +670,20 @@ CRITICAL RULES:
 "Arctic LNG 2: Russian LNG project operator. Based in St. Petersburg. Sanctioned under Russia-related authorities. Involved in Arctic LNG 2 project circumventing sanctions. Designated November 2024."
 4. Include: Entity name, type, location, sanctions program, reason for sanctions, designation date
 5. Maximum 240 characters. No markdown, no bullet points, no thinking aloud."""
-            },
-            {
-                "role": "user",
-                "content": f"Provide factual context for '{name}' on the {source} sanctions list. Search official sources and output only the structured summary starting with the entity name, or NO_INFO."
-            }
-        ]
-        
-        # Make the API call with web search tool
+        },
+        {
+            "role": "user",
+            "content": f"Provide factual context for '{name}' on the {source} sanctions list. Search official sources and output only the structured summary starting with the entity name, or NO_INFO."
+        }
+    ]
+    
+    # Make the API call with web search tool
+    with metrics.stage('kimi_request'):
         response = client.chat.completions.create(
             model="kimi-k2.5",
             messages=messages,
             temperature=1,
+            timeout=timeout or ENRICHMENT_TIMEOUT,
             tools=[
                 {
                     "type": "builtin_function",
@@ -150,46 +691,312 @@ CRITICAL RULES:
                 }
             ]
         )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Remove any thinking/search artifacts that might have slipped through
-        content = content.replace("I'll search", "").replace("Let me search", "")
-        content = content.replace("**Search queries:**", "").replace("Search queries:", "")
-        content = content.replace("I'll look up", "").replace("Let me find", "")
-        
-        # Check if Kimi found no information
-        if "NO_INFO" in content:
-            print(f"Kimi could not find verified information for '{name}', skipping follow-up")
-            return None
-        
-        # Clean up any remaining artifacts
-        lines = content.split('\n')
-        # Filter out lines that look like search queries or thinking
-        clean_lines = []
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('"') and not line.startswith('1.') and not line.startswith('2.') and not line.startswith('3.'):
-                if 'site:' not in line and 'http' not in line:
-                    clean_lines.append(line)
-        
-        if clean_lines:
-            content = ' '.join(clean_lines)
+    
+    return clean_kimi_content(response.choices[0].message.content)
+
+def clean_kimi_content(content):
+    """Strips search/thinking artifacts from a Kimi answer. Returns None for NO_INFO answers."""
+    content = (content or '').strip()
+    
+    # Remove any thinking/search artifacts that might have slipped through
+    content = content.replace("I'll search", "").replace("Let me search", "")
+    content = content.replace("**Search queries:**", "").replace("Search queries:", "")
+    content = content.replace("I'll look up", "").replace("Let me find", "")
+    
+    # Check if Kimi found no information
+    if "NO_INFO" in content:
+        return None
+    
+    # Clean up any remaining artifacts
+    lines = content.split('\n')
+    # Filter out lines that look like search queries or thinking
+    clean_lines = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('"') and not line.startswith('1.') and not line.startswith('2.') and not line.startswith('3.'):
+            if 'site:' not in line and 'http' not in line:
+                clean_lines.append(line)
+    
+    if clean_lines:
+        content = ' '.join(clean_lines)
+    else:
+        content = content.replace('\n', ' ')
+    
+    content = content.strip()
+    
+    # Ensure it's under 280 chars for Twitter (no "Context: " prefix now)
+    if len(content) > 280:
+        content = content[:277] + "..."
+    return content
+
+def normalize_entity_name(name):
+    return ' '.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+def kimi_cache_key(name, source):
+    entity = f"{normalize_entity_name(name)}|{normalize_entity_name(source)}"
+    return KIMI_CACHE_PREFIX + hashlib.sha1(entity.encode()).hexdigest()
+
+def get_cached_context(name, source):
+    """Returns (hit, context) from the enrichment cache; context is None for cached NO_INFO results."""
+    key = kimi_cache_key(name, source)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.hincrby(KIMI_CACHE_STATS_KEY, 'lookups', 1)
+    value, _ = pipe.execute()
+    if value is None:
+        # Expired or evicted; don't let it count towards the cache's bound
+        redis_client.zrem(KIMI_CACHE_LRU_KEY, key)
+        return False, None
+
+    value = value.decode()
+    if value != KIMI_NO_INFO:
+        # Push back the key and its index entry together; NO_INFO keeps its expiry so it still gets retried
+        pipe.expire(key, KIMI_CACHE_TTL)
+        pipe.zadd(KIMI_CACHE_LRU_KEY, {key: time.time() + KIMI_CACHE_TTL})
+    pipe.hincrby(KIMI_CACHE_STATS_KEY, 'hits', 1)
+    pipe.execute()
+    return True, None if value == KIMI_NO_INFO else value
+
+def expire_cache_lru(pipe):
+    # Members are scored by when their key expires, so anything scored in the past is already gone
+    pipe.zremrangebyscore(KIMI_CACHE_LRU_KEY, '-inf', time.time())
+
+def cache_context(name, source, context):
+    key = kimi_cache_key(name, source)
+    pipe = redis_client.pipeline(transaction=False)
+    ttl = KIMI_CACHE_TTL if context else KIMI_CACHE_NEGATIVE_TTL
+    pipe.set(key, context or KIMI_NO_INFO, ex=ttl)
+    expire_cache_lru(pipe)
+    pipe.zadd(KIMI_CACHE_LRU_KEY, {key: time.time() + ttl})
+    pipe.zcard(KIMI_CACHE_LRU_KEY)
+    size = pipe.execute()[-1]
+
+    # Evict the entries closest to expiring once the cache is over its bound; for found
+    # context that is the least recently used
+    if size > KIMI_CACHE_MAX_ENTRIES:
+        evicted = redis_client.zpopmin(KIMI_CACHE_LRU_KEY, size - KIMI_CACHE_MAX_ENTRIES)
+        if evicted:
+            redis_client.delete(*[entry for entry, _ in evicted])
+
+def kimi_cache_stats():
+    pipe = redis_client.pipeline(transaction=False)
+    expire_cache_lru(pipe)
+    pipe.hgetall(KIMI_CACHE_STATS_KEY)
+    pipe.zcard(KIMI_CACHE_LRU_KEY)
+    _, counters, entries = pipe.execute()
+    lookups = int(counters.get(b'lookups', 0))
+    hits = int(counters.get(b'hits', 0))
+    stats = {
+        'entries': entries,
+        'lookups': lookups,
+        'hits': hits,
+        'misses': lookups - hits,
+        'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+    }
+    print(json.dumps(stats))
+    return stats
+
+def lookup_cached_context(name, source):
+    try:
+        hit, context = get_cached_context(name, source)
+    except Exception as e:
+        print(f"Enrichment cache unavailable for '{name}': {e}")
+        metrics.count('kimi_cache', result='error')
+        return False, None
+    metrics.count('kimi_cache', result='hit' if hit else 'miss')
+    return hit, context
+
+def store_context(name, source, context):
+    try:
+        cache_context(name, source, context)
+    except Exception as e:
+        print(f"Could not cache context for '{name}': {e}")
+
+KIMI_BATCH_SYSTEM_PROMPT = """You are a sanctions research specialist. Use web search to find official information from OFAC, Treasury.gov, BIS, and government sources.
+
+You will receive a numbered list of sanctioned parties. Research each one separately.
+
+CRITICAL RULES:
+1. Output ONLY a JSON array, one object per party: [{"id": 1, "context": "..."}, ...]. No prose, no markdown, no search queries or thinking.
+2. If you cannot find verified information for a party, set its context to exactly: NO_INFO
+3. Each context starts with the entity name, then structure like this example:
+"Arctic LNG 2: Russian LNG project operator. Based in St. Petersburg. Sanctioned under Russia-related authorities. Involved in Arctic LNG 2 project circumventing sanctions. Designated November 2024."
+4. Include: Entity name, type, location, sanctions program, reason for sanctions, designation date
+5. Maximum 240 characters per context. No bullet points."""
+
+def estimate_tokens(text):
+    # About four characters per token for English prompts; only used to size batches
+    return len(text) // 4 + 1
+
+def format_batch_line(number, name, source):
+    return f"{number}. '{name}' on the {source} sanctions list"
+
+def plan_kimi_batches(entities, budget=KIMI_BATCH_TOKEN_BUDGET, max_size=KIMI_MAX_BATCH_SIZE):
+    """Groups entity indices into batches that fit the prompt token budget."""
+    base = estimate_tokens(KIMI_BATCH_SYSTEM_PROMPT) + 50
+    batches = []
+    current = []
+    used = base
+    for i, (name, source) in enumerate(entities):
+        cost = estimate_tokens(format_batch_line(len(current) + 1, name, source)) + KIMI_ANSWER_TOKENS
+        if current and (used + cost > budget or len(current) >= max_size):
+            batches.append(current)
+            current = []
+            used = base
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_response(content, count):
+    """
+    Extracts per-entity answers from a batched Kimi response. Tolerates code fences,
+    prose around the JSON and a wrapping object. Returns {index: context or None}
+    (0-based) for the entities that were answered.
+    """
+    content = (content or '').strip()
+    start = min((i for i in (content.find('['), content.find('{')) if i >= 0), default=-1)
+    if start < 0:
+        return {}
+    try:
+        parsed, _ = json.JSONDecoder().raw_decode(content, start)
+    except json.JSONDecodeError:
+        return {}
+
+    if isinstance(parsed, dict):
+        parsed = next((value for value in parsed.values() if isinstance(value, list)), [parsed])
+
+    answers = {}
+    for position, entry in enumerate(parsed):
+        if not isinstance(entry, dict) or not isinstance(entry.get('context'), str):
+            continue
+        try:
+            index = int(entry.get('id', position + 1)) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and index not in answers:
+            answers[index] = clean_kimi_content(entry['context'])
+    return answers
+
+def query_kimi_batch(entities, timeout=None):
+    """Asks Kimi about several (name, source) pairs in one request. Returns parse_batch_response output."""
+    client = kimi_client()
+    parties = "\n".join(format_batch_line(i + 1, name, source) for i, (name, source) in enumerate(entities))
+    messages = [
+        {"role": "system", "content": KIMI_BATCH_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"Provide factual context for each of these parties. Search official sources and output only the JSON array.\n{parties}"
+        }
+    ]
+    with metrics.stage('kimi_batch_request') as timer:
+        timer.add(records=len(entities))
+        response = client.chat.completions.create(
+            model="kimi-k2.5",
+            messages=messages,
+            temperature=1,
+            timeout=timeout or ENRICHMENT_TIMEOUT,
+            tools=[
+                {
+                    "type": "builtin_function",
+                    "function": {"name": "$web_search"}
+                }
+            ]
+        )
+    return parse_batch_response(response.choices[0].message.content, len(entities))
+
+def lookup_kimi_contexts(entities, timeout=None):
+    """
+    Queries Kimi for (name, source) pairs in one request, batched when there are several,
+    without reading the cache, and caches the answers. Returns {index in entities: context}
+    for the entities it answered; a failed request answers none.
+    """
+    try:
+        if len(entities) > 1:
+            answered = query_kimi_batch(entities, timeout)
         else:
-            content = content.replace('\n', ' ')
-        
-        content = content.strip()
-        
-        # Ensure it's under 280 chars for Twitter (no "Context: " prefix now)
-        if len(content) > 280:
-            content = content[:277] + "..."
-            
-        print(f"Generated context for '{name}': {content}")
-        return content
-        
+            answered = {0: query_kimi_context(*entities[0], timeout)}
     except Exception as e:
-        print(f"Error getting context from Kimi for '{name}': {e}")
-        return None
+        if len(entities) > 1:
+            print(f"Batched Kimi request for {len(entities)} entities failed: {e}")
+        else:
+            print(f"Error getting context from Kimi for '{entities[0][0]}': {e}")
+        return {}
+    for i, context in answered.items():
+        store_context(*entities[i], context)
+    return answered
+
+def describe_modification(entry):
+    name = entry['name']
+    if 'previous_name' in entry and entry['previous_name'] != name:
+        name = f"{entry['previous_name']} → {name}"
+    return f"{name} ({', '.join(entry['fields'])})"
+
+def enrich_entities(entities, max_workers=None, timeout=None):
+    """
+    Looks up Kimi context for a list of (name, source) pairs concurrently, with at most
+    max_workers requests in flight (default ENRICHMENT_CONCURRENCY) and a per-request
+    timeout (default ENRICHMENT_TIMEOUT). Returns the contexts in the same order as
+    `entities`, with None where nothing was found, the lookup failed or it ran past the deadline.
+    """
+    if not entities:
+        return []
+    max_workers = max_workers or ENRICHMENT_CONCURRENCY
+    timeout = timeout or ENRICHMENT_TIMEOUT
+
+    contexts = [None] * len(entities)
+    misses = []
+    for i, (name, source) in enumerate(entities):
+        hit, context = lookup_cached_context(name, source)
+        if hit:
+            print(f"Using cached context for '{name}'")
+            contexts[i] = context
+        else:
+            misses.append(i)
+    if not misses:
+        return contexts
+
+    # With batching on, each request carries as many entities as the token budget allows
+    if KIMI_BATCH_ENABLED:
+        groups = [[misses[j] for j in batch] for batch in plan_kimi_batches([entities[i] for i in misses])]
+    else:
+        groups = [[i] for i in misses]
+
+    workers = max(1, min(max_workers, len(groups)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kimi')
+    pending = {
+        executor.submit(lookup_kimi_contexts, [entities[i] for i in group], timeout): group
+        for group in groups
+    }
+    # Every request gives up after `timeout` and batches' unanswered entities are retried as
+    # requests of their own, so at worst `calls` requests share the workers, and a retry
+    # waits for its batch: they all finish within calls / workers + 2 timeouts. The deadline
+    # only guards against hung workers.
+    calls = len(groups) + sum(len(group) for group in groups if len(group) > 1)
+    deadline = time.monotonic() + timeout * (calls / workers + 2) + 5
+    while pending:
+        done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            group = pending.pop(future)
+            answered = future.result()
+            for j, i in enumerate(group):
+                if j in answered:
+                    contexts[i] = answered[j]
+            if len(group) > 1 and len(answered) < len(group):
+                print(f"Batched Kimi request answered {len(answered)} of {len(group)} entities, retrying the rest individually")
+                for j, i in enumerate(group):
+                    if j not in answered:
+                        pending[executor.submit(lookup_kimi_contexts, [entities[i]], timeout)] = [i]
+    for future, group in pending.items():
+        future.cancel()
+        for i in group:
+            print(f"Kimi lookup for '{entities[i][0]}' timed out, skipping follow-up")
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    return contexts
 
 def format_changes(changes, action):
     messages = []
@@ -201,103 +1008,553 @@ def format_changes(changes, action):
             messages.append(f"{source} {action}: {names_str}")
     return messages
 
-def split_message(message, max_length=280):
-    words = message.split()
+def _character_weight(char):
+    code = ord(char)
+    for low, high in LIGHT_CHARACTER_RANGES:
+        if low <= code <= high:
+            return 1
+    return 2
+
+def _plain_length(text):
+    if text.isascii():
+        return len(text)
+    return sum(_character_weight(char) for char in text)
+
+def twitter_length(text):
+    """Length of text as Twitter counts it: NFC code points weighted 1 or 2, URLs always 23."""
+    if text.isascii() and '://' not in text:
+        # Already NFC, every character weighs 1 and there is no URL to count as 23
+        return len(text)
+    text = unicodedata.normalize('NFC', text)
+    length = 0
+    position = 0
+    for match in URL_PATTERN.finditer(text):
+        length += _plain_length(text[position:match.start()]) + TWEET_URL_LENGTH
+        position = match.end()
+    return length + _plain_length(text[position:])
+
+def _hard_split(text, max_length):
+    # Last resort for a single item longer than a whole tweet
+    pieces = []
+    current = ''
+    current_length = 0
+    for char in text:
+        weight = _plain_length(char)
+        if current and current_length + weight > max_length:
+            pieces.append(current)
+            current, current_length = '', 0
+        current += char
+        current_length += weight
+    if current:
+        pieces.append(current)
+    return pieces
+
+def _pack_sections(sections, max_length):
+    chunks = []
+    parts = []
+    used = 0
+    for prefix, items in sections:
+        header = f"{prefix}: "
+        header_length = twitter_length(header)
+        section_open = False
+        for item in items:
+            item_length = twitter_length(item)
+
+            if header_length + item_length > max_length:
+                # Only an item that cannot fit in an empty tweet is ever split
+                if parts:
+                    chunks.append(''.join(parts))
+                pieces = _hard_split(item, max_length - header_length)
+                chunks.extend(header + piece for piece in pieces[:-1])
+                parts = [header, pieces[-1]]
+                used = header_length + _plain_length(pieces[-1])
+                section_open = True
+                continue
+
+            if section_open:
+                cost = len(NAME_SEPARATOR) + item_length
+            else:
+                cost = (len(SECTION_SEPARATOR) if parts else 0) + header_length + item_length
+            if parts and used + cost > max_length:
+                chunks.append(''.join(parts))
+                # Continuation chunks repeat the section prefix so every tweet stands on its own
+                parts, used = [], 0
+                section_open = False
+                cost = header_length + item_length
+
+            if section_open:
+                parts.append(NAME_SEPARATOR)
+            else:
+                if parts:
+                    parts.append(SECTION_SEPARATOR)
+                parts.append(header)
+                section_open = True
+            parts.append(item)
+            used += cost
+    if parts:
+        chunks.append(''.join(parts))
+    return chunks
+
+def pack_thread(sections, max_length=TWEET_MAX_LENGTH, numbered=NUMBER_THREAD_PARTS):
+    """
+    Packs (prefix, items) sections, e.g. ("OFAC added", [names]), into tweets in a single
+    linear pass using Twitter-weighted lengths. Items are never split across tweets
+    (unless one alone exceeds a tweet), sections are joined with " | ", and a section
+    continued in the next tweet repeats its prefix. With numbered=True each tweet ends
+    in " i/n"; the suffix width is reserved up front and re-packed only if n gains a digit.
+    """
+    if not numbered:
+        return _pack_sections(sections, max_length)
+
+    digits = 1
+    while True:
+        reserve = len(f" {'9' * digits}/{'9' * digits}")
+        chunks = _pack_sections(sections, max_length - reserve)
+        if len(str(len(chunks))) <= digits:
+            break
+        digits = len(str(len(chunks)))
+    total = len(chunks)
+    return [f"{chunk} {i}/{total}" for i, chunk in enumerate(chunks, 1)]
+
+def change_sections(changes, action):
+    return [(f"{source} {action}", names) for source, names in changes.items() if names]
+
+def describe_rename(entry):
+    return f"{entry['previous_name']} → {entry['name']} ({entry['confidence']:.0%})"
+
+def split_message(message, max_length=TWEET_MAX_LENGTH):
+    """
+    Splits free text into tweets on word boundaries, measuring each word once with
+    Twitter's weighted lengths, so CJK, emoji and URLs no longer overflow a tweet.
+    """
     chunks = []
     current_chunk = []
+    current_length = 0
 
-    for word in words:
-        if len(" ".join(current_chunk + [word])) <= max_length:
-            current_chunk.append(word)
-        else:
+    for word in message.split():
+        word_length = twitter_length(word)
+        added_length = word_length + (1 if current_chunk else 0)
+        if current_chunk and current_length + added_length > max_length:
             chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
+            current_chunk = []
+            current_length = 0
+            added_length = word_length
+        current_chunk.append(word)
+        current_length += added_length
 
     if current_chunk:
         chunks.append(" ".join(current_chunk))
 
     return chunks
 
-def check_for_updates():
+def check_for_updates(profile=None):
+    """
+    Runs one detection cycle. Returns True if changes were found and queued for posting.
+    `profile` ('cprofile' or 'tracemalloc') profiles this run; see metrics.py.
+    """
+    with metrics.run('check', profile) as run:
+        run['changed'] = run_check(run)
+        return run['changed']
+
+def commit_or_report_conflict(current_list, feed=DEFAULT_FEED):
+    try:
+        commit_current_state(current_list, feed)
+        return True
+    except StateConflict as e:
+        # Another run saved state first; the next run diffs against what it saved
+        metrics.count('state_conflicts')
+        print(f"Not saving state: {e}")
+        return False
+
+def run_check(run):
     print(f"Checking for updates at {datetime.now()}")
     
-    current_list = get_current_list()
-    previous_list = load_previous_state()
-    
-    if previous_list is None:
-        save_current_state(current_list)
-        print("Initial state saved. No comparison made.")
-        return
+    feed_list = feeds.enabled_feeds()
+    results = feeds.fetch_feeds(feed_list, http_clients.get_csl_session(), known_validators(feed_list))
+    try:
+        return check_feeds(run, results)
+    finally:
+        for result in results:
+            if result['path']:
+                os.unlink(result['path'])
+
+def diff_feeds(run, results):
+    """
+    Diffs each downloaded feed against its own snapshot. A feed without a snapshot is
+    saved straight away. Returns (result, changes) pairs for the feeds that were diffed.
+    """
+    diffed = []
+    for result in results:
+        feed, current_list = result['feed'], result['records']
+        run['records'] = run.get('records', 0) + len(current_list)
+        with metrics.stage('diff'):
+            changes = diff_with_previous_state(current_list, feed.name)
+        if changes is not None:
+            diffed.append((result, changes))
+            continue
+
+        if not commit_or_report_conflict(current_list, feed.name):
+            continue
+        save_list_validators(result['validators'], feed.name)
+        if ARCHIVE_ENABLED:
+            with metrics.stage('archive'):
+                archive.archive_run(redis_client, current_list, namespace=feed_key(feed.name, ''))
+        if screening_index is not None:
+            screening_index.apply_changes(archive.group_by_source(current_list), {})
+        print(f"Initial state saved for the {feed.name} feed. No comparison made.")
+    return diffed
+
+def check_feeds(run, results):
+    fetched = []
+    for result in results:
+        name = result['feed'].name
+        if result['error'] is not None:
+            metrics.count('feed_errors', feed=name)
+            print(f"Could not fetch the {name} feed: {result['error']}")
+        elif result['short_circuit']:
+            if result['validators']:
+                # Same content under new validators, remember them for the next conditional request
+                save_list_validators(result['validators'], name)
+            print(f"No changes in the {name} feed (short-circuited at {result['short_circuit']} check).")
+        else:
+            fetched.append(result)
+    if all(result['error'] is not None for result in results):
+        # One unreachable feed shouldn't hold up the others, but a run where none could be fetched failed
+        raise results[0]['error']
+    if not fetched:
+        run['short_circuit'] = ','.join(sorted({result['short_circuit'] for result in results if result['short_circuit']}))
+        return False
     
-    added, removed = compare_lists(previous_list, current_list)
+    # Feeds label their records with distinct sources, so the change sets merge by source
+    added, removed, modified, renamed = defaultdict(list), defaultdict(list), defaultdict(list), defaultdict(list)
+    added_ids, removed_ids = {}, {}
+    changed_feeds = []
+    diffed = diff_feeds(run, fetched)
+    for result, changes in diffed:
+        feed_modified, feed_renamed = changes['modified'], {}
+        if RENAME_DETECTION:
+            # Records keep their id when renamed, so most renames arrive as modified records
+            feed_modified, feed_renamed = renames.split_renamed(feed_modified)
+        if not POST_MODIFICATIONS:
+            feed_modified = {}
+        if not (changes['added'] or changes['removed'] or feed_modified or feed_renamed):
+            continue
+        changed_feeds.append((result, changes))
+        for merged, by_source in ((added, changes['added']), (removed, changes['removed']),
+                                  (modified, feed_modified), (renamed, feed_renamed)):
+            for source, entries in by_source.items():
+                merged[source].extend(entries)
+        added_ids.update(changes['added_ids'])
+        removed_ids.update(changes['removed_ids'])
+        
+        # Only modified records are re-read in full, to log what changed
+        modified_records = [dict(entry, source=source) for source, entries in feed_modified.items() for entry in entries]
+        if modified_records:
+            with metrics.stage('rehydrate') as timer:
+                full_records = rehydrate_records(result['feed'], result['path'], modified_records)
+                timer.add(records=len(modified_records))
+            for entry in modified_records:
+                record = full_records.get(record_identity(entry), {})
+                details = ", ".join(f"{field}={record.get(field)!r}" for field in entry['fields'] if field in record)
+                print(f"Modified {entry['source']} entry {entry['name']}: {details or ', '.join(entry['fields'])}")
     
-    # Count total added entities
-    total_added = sum(len(names) for names in added.values())
+    if RENAME_DETECTION and added and removed:
+        # Archive and screening still apply each feed's own added/removed sets
+        with metrics.stage('reconcile') as timer:
+            timer.add(records=sum(map(len, added.values())) + sum(map(len, removed.values())))
+            added, removed, paired = renames.reconcile(added, removed, added_ids=added_ids, removed_ids=removed_ids)
+        for source, entries in paired.items():
+            renamed[source].extend(entries)
+    for source, entries in renamed.items():
+        for entry in entries:
+            print(f"Renamed {source} entry {describe_rename(entry)}")
     
-    if added or removed:
-        messages = format_changes(added, "added")
-        messages.extend(format_changes(removed, "removed"))
+    changed = bool(changed_feeds)
+    for kind, by_source in (('added', added), ('removed', removed), ('modified', modified), ('renamed', renamed)):
+        run[kind] = sum(len(entries) for entries in by_source.values())
+    if changed:
+        with metrics.stage('format') as timer:
+            sections = change_sections(added, "added")
+            sections.extend(change_sections(removed, "removed"))
+            sections.extend(change_sections(
+                {source: [describe_rename(entry) for entry in entries] for source, entries in renamed.items()},
+                "renamed",
+            ))
+            sections.extend(change_sections(
+                {source: [describe_modification(entry) for entry in entries] for source, entries in modified.items()},
+                "updated",
+            ))
+            message_chunks = pack_thread(sections)
+            timer.add(records=len(message_chunks))
         
-        full_message = " | ".join(messages)
-        message_chunks = split_message(full_message)
+        # A retried run re-queues nothing: the key is the digest of what changed
+        if len(changed_feeds) == 1:
+            run_key = changed_feeds[0][0]['validators']['digest']
+        else:
+            digests = ','.join(f"{result['feed'].name}:{result['validators']['digest']}" for result, _ in changed_feeds)
+            run_key = hashlib.sha256(digests.encode()).hexdigest()
         
-        # Collect all tweet IDs for follow-ups (keyed by entity name)
-        main_tweet_ids = {}
+        try:
+            # Queue the main thread; every chunk replies to the one before it
+            with metrics.stage('enqueue'):
+                thread_ids = outbox.enqueue_posts(
+                    redis_client,
+                    [{'text': chunk, 'reply_to': i - 1 if i else None} for i, chunk in enumerate(message_chunks)],
+                    run_key=run_key,
+                )
+        except Exception as e:
+            # Like events below: without the saved state the next run detects the change again,
+            # and the run key keeps whatever did get queued from being queued twice
+            print(f"Error queueing messages, not saving state: {str(e)}")
+            return False
+        print(f"Queued {len(thread_ids)} tweets for the main thread")
         
         try:
-            # Post to Twitter - main thread
-            previous_tweet_id = None
-            for i, chunk in enumerate(message_chunks):
-                if i == 0:
-                    tweet_id = send_tweet(chunk)
-                    # Store the first tweet ID for each added entity for follow-ups
-                    for source, names in added.items():
-                        for name in names:
-                            main_tweet_ids[name] = tweet_id
-                else:
-                    tweet_id = send_tweet(chunk, in_reply_to_id=previous_tweet_id)
-                previous_tweet_id = tweet_id
-            
-            # Generate and send follow-up tweets for ADDED entities with safeguards
+            # Generate and queue follow-up tweets for ADDED entities with safeguards;
+            # renamed entries were already on the list and get none
             follow_up_count = 0
-            skipped_count = 0
+            candidates = [(name, source) for source, names in added.items() for name in names]
+            position = 0
             
-            for source, names in added.items():
-                for name in names:
-                    # Check if we've hit the max follow-ups limit
-                    if follow_up_count >= MAX_FOLLOW_UPS_PER_RUN:
-                        skipped_count += 1
-                        continue
-                    
-                    # Get context from Kimi
-                    context = get_sanctions_context_with_kimi(name, source)
-                    
+            # Look up only as many entities as there are follow-up slots left, all at once,
+            # and queue the replies in list order
+            while position < len(candidates) and follow_up_count < MAX_FOLLOW_UPS_PER_RUN:
+                wave = candidates[position:position + MAX_FOLLOW_UPS_PER_RUN - follow_up_count]
+                position += len(wave)
+                
+                with metrics.stage('enrich') as timer:
+                    timer.add(records=len(wave))
+                    contexts = enrich_entities(wave)
+                for (name, source), context in zip(wave, contexts):
                     if context:
-                        # Send follow-up tweet as reply to the main tweet
-                        try:
-                            followup_id = send_tweet(context, in_reply_to_id=main_tweet_ids.get(name, previous_tweet_id))
-                            print(f"Sent follow-up tweet for {name}")
-                            follow_up_count += 1
-                            
-                            # Rate limit protection - sleep between tweets
-                            if follow_up_count < MAX_FOLLOW_UPS_PER_RUN:
-                                time.sleep(RATE_LIMIT_DELAY)
-                                
-                        except Exception as e:
-                            print(f"Error sending follow-up tweet for {name}: {e}")
+                        # Follow-ups reply to the first tweet of the thread
+                        outbox.enqueue_posts(
+                            redis_client,
+                            [{'text': context, 'reply_to': thread_ids[0], 'key': f"follow-up:{source}:{name}"}],
+                        )
+                        print(f"Queued follow-up tweet for {name}")
+                        follow_up_count += 1
                     else:
                         print(f"No follow-up tweet sent for {name} (no verified information found)")
             
             # Report if any were skipped due to limit
+            skipped_count = len(candidates) - position
             if skipped_count > 0:
                 print(f"Skipped {skipped_count} entities due to MAX_FOLLOW_UPS_PER_RUN limit ({MAX_FOLLOW_UPS_PER_RUN})")
             
         except Exception as e:
-            print(f"Error posting messages: {str(e)}")
+            print(f"Error queueing follow-up tweets: {str(e)}")
+        
+        if EVENTS_ENABLED:
+            # Published before the new state is saved, so a failure here leaves the change to be
+            # detected and published again by the next run, with the same run id
+            try:
+                with metrics.stage('events') as timer:
+                    change_events = events.change_events(
+                        {'added': added, 'removed': removed, 'modified': modified, 'renamed': renamed}, run_key,
+                    )
+                    timer.add(records=len(change_events))
+                    events.publish(redis_client, change_events)
+                print(f"Published {len(change_events)} change events")
+            except Exception as e:
+                print(f"Error publishing change events, not saving state: {str(e)}")
+                return False
         
-        save_current_state(current_list)
+        for result, changes in changed_feeds:
+            name = result['feed'].name
+            if not commit_or_report_conflict(result['records'], name):
+                return False
+            if ARCHIVE_ENABLED:
+                with metrics.stage('archive'):
+                    archive.archive_run(redis_client, result['records'], *archive_delta(changes), namespace=feed_key(name, ''))
+            if screening_index is not None:
+                screening_index.apply_changes(*archive_delta(changes))
     else:
         print("No changes detected.")
+    for result, _ in diffed:
+        save_list_validators(result['validators'], result['feed'].name)
+    if PUBLISH_MODE == 'inline':
+        publish_outbox()
+    http_clients.report_connection_stats()
+    for host, counts in http_clients.connection_stats().items():
+        metrics.gauge('http_requests', counts['requests'], host=host)
+        metrics.gauge('http_new_connections', counts['new_connections'], host=host)
+    return changed
+
+def check_once(profile=None):
+    """One-shot check for cron-style runs: skipped if another replica holds the detector lease."""
+    if not LEADER_ELECTION:
+        return check_for_updates(profile)
+    lease = leader.Lease(redis_client, DETECTOR_LEASE)
+    if lease.acquire() is None:
+        print(f"Detection is running on {lease.holder()}, skipping this run.")
+        return False
+    lease.keep_alive()
+    state_guard['token'] = lease.token
+    try:
+        return check_for_updates(profile)
+    finally:
+        state_guard['token'] = None
+        lease.release()
+
+def refresh_standby():
+    """Keeps a standby's in-memory snapshots (and screening index) current, so a takeover starts warm."""
+    version = redis_client.get(STATE_VERSION_KEY)
+    if version is None or int(version) == memory_state['version']:
+        return
+    for feed in feeds.enabled_feeds():
+        previous = memory_state['snapshots'].get(feed.name)
+        snapshot = load_previous_state(feed.name)
+        memory_state['snapshots'][feed.name] = snapshot
+        if screening_index is not None and snapshot is not None:
+            if previous is None:
+                screening_index.apply_changes(archive.group_by_source(snapshot), {})
+            else:
+                screening_index.apply_changes(*archive_delta(diff_records(previous, snapshot)))
+    memory_state['version'] = state_guard['version']
+    # Validators are only trusted from memory when this process saved them itself
+    memory_state['validators'] = {}
+    print(f"Standby refreshed to state version {memory_state['version']}")
+
+def run_daemon():
+    """
+    Resident worker: runs check_for_updates on an adaptive schedule, keeps the last
+    snapshot and list validators in memory between ticks, and publishes queued tweets
+    on a background thread while it holds the publisher lease. With LEADER_ELECTION, only the replica holding the detector
+    lease runs checks; the others poll for the lease every STANDBY_POLL_INTERVAL seconds
+    and keep their snapshot current. On SIGTERM it finishes the current tick, gives
+    queued tweets up to SHUTDOWN_GRACE seconds to go out, releases the lease and exits.
+    """
+    global PUBLISH_MODE
+    memory_state['enabled'] = True
+    stop = threading.Event()
+    scheduler.install_signal_handlers(stop)
+
+    publisher = None
+    publisher_stop = threading.Event()
+    if DAEMON_PUBLISHER:
+        # The publisher thread is the only drainer, so ticks must not drain inline
+        PUBLISH_MODE = 'outbox'
+        publisher = threading.Thread(
+            target=publish_outbox, kwargs={'block': True, 'stop': publisher_stop}, name='publisher', daemon=True
+        )
+        publisher.start()
+
+    if SCREENING_PORT:
+        start_screening_server(int(SCREENING_PORT))
+    if metrics.METRICS_PORT:
+        metrics.serve(metrics.METRICS_PORT)
+
+    lease = leader.Lease(redis_client, DETECTOR_LEASE) if LEADER_ELECTION else None
+
+    def tick():
+        if lease is not None and not lease.ensure():
+            refresh_standby()
+            return False
+        state_guard['token'] = lease.token if lease is not None else None
+        return check_for_updates()
+
+    def interval(last_change_at):
+        if lease is not None and not lease.held:
+            return leader.STANDBY_POLL_INTERVAL
+        return scheduler.poll_interval(last_change_at)
+
+    print("Daemon started.")
+    scheduler.run_forever(tick, stop, interval)
+    if lease is not None:
+        lease.release()
+
+    if publisher is not None:
+        deadline = time.monotonic() + SHUTDOWN_GRACE
+        while time.monotonic() < deadline and outbox.pending_count(redis_client):
+            time.sleep(0.5)
+        publisher_stop.set()
+        publisher.join(timeout=5)
+    print("Daemon stopped.")
+
+def build_screening_index():
+    start = time.perf_counter()
+    index = screening.ScreeningIndex.from_names(
+        pair for feed in feeds.enabled_feeds()
+        for pair in iter_names(cached_snapshot(feed.name) or load_previous_state(feed.name) or [])
+    )
+    print(f"Built screening index over {len(index)} entries in {time.perf_counter() - start:.2f}s")
+    return index
+
+def start_screening_server(port):
+    global screening_index
+    screening_index = build_screening_index()
+    return screening.serve(screening_index, SCREENING_HOST, port, background=True)
+
+def screen_name(*query):
+    """Screens a name against the saved list and prints ranked matches as JSON."""
+    index = screening_index or build_screening_index()
+    start = time.perf_counter()
+    matches = index.search(' '.join(query))
+    print(json.dumps({'matches': matches, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)}, indent=2))
+    return matches
+
+def run_screening_server(port=None):
+    # Serves the list as saved now; the daemon's server also follows later changes
+    screening.serve(build_screening_index(), SCREENING_HOST, int(port or SCREENING_PORT or 8080))
+
+def events_info():
+    info = events.stream_info(redis_client)
+    print(json.dumps(info, indent=2))
+    return info
+
+def read_events(group, consumer, count=100):
+    """
+    Prints a consumer group's unread change events as JSON lines and acknowledges them,
+    creating the group (from the oldest retained event) if needed. Events this consumer
+    was given earlier and never acknowledged come first.
+    """
+    events.ensure_group(redis_client, group)
+    batch = events.read(redis_client, group, consumer, int(count), pending=True)
+    batch += events.read(redis_client, group, consumer, int(count) - len(batch)) if len(batch) < int(count) else []
+    for event in batch:
+        print(json.dumps(event, ensure_ascii=False))
+    events.ack(redis_client, group, *[event['event_id'] for event in batch])
+    return batch
+
+def replay_events(start='-', end='+', count=None):
+    """Prints retained change events between two event ids as JSON lines, without touching any group."""
+    batch = events.replay(redis_client, start, end, int(count) if count else None)
+    for event in batch:
+        print(json.dumps(event, ensure_ascii=False))
+    return batch
+
+def seek_events(group, offset):
+    """Rewinds or fast-forwards a consumer group to just after `offset` ('0' for the start, '$' for the end)."""
+    events.ensure_group(redis_client, group, offset)
+    events.seek(redis_client, group, offset)
+    print(f"Group {group} now reads after {offset}")
+
+def reconstruct_list(at=None, feed=DEFAULT_FEED):
+    """Prints a feed's archived list as of `at` (ISO date/time or epoch milliseconds, default now) as JSON."""
+    if at and not at.isdigit():
+        at = int(datetime.fromisoformat(at).timestamp() * 1000)
+    snapshot = archive.reconstruct(redis_client, int(at) if at else None, namespace=feed_key(feed, ''))
+    if snapshot is None:
+        print("No archived snapshot covers that time.")
+        return
+    print(json.dumps(snapshot, indent=2))
+
+COMMANDS = {
+    'check': check_once,
+    'migrate-state': migrate_state,
+    'reconstruct': reconstruct_list,
+    'kimi-cache-stats': kimi_cache_stats,
+    'publish': run_publisher,
+    'daemon': run_daemon,
+    'screen': screen_name,
+    'screen-server': run_screening_server,
+    'events-info': events_info,
+    'events-read': read_events,
+    'events-replay': replay_events,
+    'events-seek': seek_events,
+}
 
 if __name__ == "__main__":
-    check_for_updates()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    COMMANDS[command](*sys.argv[2:])
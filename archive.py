@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import zlib
+from collections import defaultdict
+
+from snapshot import iter_names
+
+# Snapshot archive layout in Redis:
+#   archive:index            sorted set of entry names scored by run timestamp (ms)
+#   archive:full:<ts>        zlib-compressed full snapshot (keyframe)
+#   archive:delta:<ts>       zlib-compressed added/removed delta for one run
+# Each tracked feed other than the default one has its own archive under a key namespace
+# (e.g. feed:uk:archive:index), passed as `namespace`.
+ARCHIVE_INDEX_KEY = 'archive:index'
+ARCHIVE_KEY_PREFIX = 'archive:'
+ARCHIVE_KEYFRAME_COUNTER_KEY = 'archive:deltas_since_keyframe'
+
+KEYFRAME_INTERVAL = int(os.getenv('ARCHIVE_KEYFRAME_INTERVAL', 48))  # Deltas between full snapshots
+RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', 365))
+COMPRESSION_LEVEL = 9
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+def _encode(payload):
+    return zlib.compress(json.dumps(payload, separators=(',', ':'), sort_keys=True).encode(), COMPRESSION_LEVEL)
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+def group_by_source(snapshot):
+    # Grouping by source stores each source label once and sorts names so zlib finds shared prefixes
+    grouped = defaultdict(list)
+    for source, name in iter_names(snapshot):
+        grouped[source].append(name)
+    return {source: sorted(names) for source, names in grouped.items()}
+
+def archive_run(redis_client, snapshot, added=None, removed=None, timestamp=None, namespace=''):
+    """
+    Records one run in the archive. Every KEYFRAME_INTERVAL deltas (or when the archive is
+    empty) a compressed full snapshot is written; otherwise only the run's added/removed
+    delta is stored, and runs without changes store nothing. Returns the entry name written.
+    """
+    timestamp = timestamp or _now_ms()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(namespace + ARCHIVE_KEYFRAME_COUNTER_KEY)
+    pipe.zcard(namespace + ARCHIVE_INDEX_KEY)
+    deltas_since_keyframe, entries = pipe.execute()
+    deltas_since_keyframe = int(deltas_since_keyframe or 0)
+
+    if entries and deltas_since_keyframe < KEYFRAME_INTERVAL:
+        if not added and not removed:
+            return None
+        entry = f'delta:{timestamp}'
+        blob = _encode({'added': added or {}, 'removed': removed or {}})
+        pipe.incr(namespace + ARCHIVE_KEYFRAME_COUNTER_KEY)
+    else:
+        entry = f'full:{timestamp}'
+        blob = _encode(group_by_source(snapshot))
+        pipe.set(namespace + ARCHIVE_KEYFRAME_COUNTER_KEY, 0)
+
+    pipe.set(namespace + ARCHIVE_KEY_PREFIX + entry, blob)
+    pipe.zadd(namespace + ARCHIVE_INDEX_KEY, {entry: timestamp})
+    pipe.execute()
+    prune_archive(redis_client, now=timestamp, namespace=namespace)
+    return entry
+
+def prune_archive(redis_client, now=None, namespace=''):
+    """
+    Drops entries older than RETENTION_DAYS. The newest keyframe at or before the cutoff is
+    kept, along with its deltas, so any time inside the retention window stays reconstructable.
+    """
+    cutoff = (now or _now_ms()) - RETENTION_DAYS * 24 * 60 * 60 * 1000
+    old_entries = redis_client.zrevrangebyscore(namespace + ARCHIVE_INDEX_KEY, cutoff, '-inf')
+    for i, entry in enumerate(old_entries):
+        if entry.decode().startswith('full:'):
+            expired = old_entries[i + 1:]
+            break
+    else:
+        return 0
+
+    if expired:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.delete(*[namespace + ARCHIVE_KEY_PREFIX + entry.decode() for entry in expired])
+        pipe.zrem(namespace + ARCHIVE_INDEX_KEY, *expired)
+        pipe.execute()
+    return len(expired)
+
+def reconstruct(redis_client, at=None, namespace=''):
+    """
+    Rebuilds the list as it was at the given timestamp (epoch milliseconds) by loading the
+    nearest keyframe at or before it and replaying the deltas up to that point. Work is
+    bounded by KEYFRAME_INTERVAL. Returns None if the archive has nothing that old.
+    """
+    at = at or _now_ms()
+    # The nearest keyframe is at most KEYFRAME_INTERVAL entries back
+    candidates = redis_client.zrevrangebyscore(namespace + ARCHIVE_INDEX_KEY, at, '-inf', start=0, num=KEYFRAME_INTERVAL + 1)
+    replay = []
+    for entry in candidates:
+        replay.append(entry.decode())
+        if replay[-1].startswith('full:'):
+            break
+    else:
+        # No keyframe in reach, e.g. the counter was reset; fall back to a full scan
+        replay = [entry.decode() for entry in redis_client.zrevrangebyscore(namespace + ARCHIVE_INDEX_KEY, at, '-inf')]
+        while replay and not replay[-1].startswith('full:'):
+            replay.pop()
+        if not replay:
+            return None
+
+    replay.reverse()
+    blobs = redis_client.mget([namespace + ARCHIVE_KEY_PREFIX + entry for entry in replay])
+    state = {source: set(names) for source, names in _decode(blobs[0]).items()}
+    for blob in blobs[1:]:
+        delta = _decode(blob)
+        for source, names in delta['removed'].items():
+            state.get(source, set()).difference_update(names)
+        for source, names in delta['added'].items():
+            state.setdefault(source, set()).update(names)
+
+    return [{'source': source, 'name': name} for source in sorted(state) for name in sorted(state[source])]
+
+def archive_stats(redis_client, namespace=''):
+    entries = [entry.decode() for entry in redis_client.zrange(namespace + ARCHIVE_INDEX_KEY, 0, -1)]
+    pipe = redis_client.pipeline(transaction=False)
+    for entry in entries:
+        pipe.strlen(namespace + ARCHIVE_KEY_PREFIX + entry)
+    sizes = pipe.execute() if entries else []
+    return {
+        'keyframes': sum(1 for entry in entries if entry.startswith('full:')),
+        'deltas': sum(1 for entry in entries if entry.startswith('delta:')),
+        'bytes': sum(sizes),
+    }
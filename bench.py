@@ -0,0 +1,690 @@
+import io
+import os
+import sys
+import json
+import time
+import glob
+import random
+import argparse
+import platform
+import contextlib
+import subprocess
+import pickle
+import tracemalloc
+from datetime import datetime, timezone
+
+import app
+import feeds
+import fakes
+import leader
+import outbox
+import renames
+import screening
+import http_clients
+from snapshot import CompactSnapshot
+
+# Offline benchmarks for each stage of the pipeline, run against a synthetic
+# consolidated.json and the in-process stand-ins in fakes.py.
+#
+#   python bench.py                          # every stage, 20k records, 2% churn
+#   python bench.py --records 1000000 parse diff state_sets_save
+#   python bench.py --write-payloads data/   # just write generated lists to disk
+
+RESULTS_DIR = 'bench_results'
+REGRESSION_THRESHOLD = 1.25  # Flag a stage that got this much slower or hungrier than the baseline
+REGRESSION_MIN_SECONDS = 0.01  # ...unless it moved by less than this, which is noise
+REGRESSION_MIN_MB = 1.0
+
+# Share of each source in the real list, roughly
+SOURCE_MIX = {
+    "Specially Designated Nationals (SDN) - Treasury Department": 0.62,
+    "Entity List (EL) - Bureau of Industry and Security": 0.17,
+    "Sectoral Sanctions Identifications List (SSI) - Treasury Department": 0.05,
+    "Non-SDN Menu-Based Sanctions List (NS-MBS List) - Treasury Department": 0.04,
+    "Military End User (MEU) List - Bureau of Industry and Security": 0.03,
+    "Denied Persons List (DPL) - Bureau of Industry and Security": 0.03,
+    "Unverified List (UVL) - Bureau of Industry and Security": 0.02,
+    "ITAR Debarred (DTC) - State Department": 0.02,
+    "Nonproliferation Sanctions (ISN) - State Department": 0.02,
+}
+# Words per name; the long tail is vessel and front-company names
+NAME_WORDS = {1: 0.05, 2: 0.30, 3: 0.30, 4: 0.18, 5: 0.10, 6: 0.05, 12: 0.02}
+NON_LATIN_FRACTION = 0.03  # Names written in Cyrillic
+SYLLABLES = ['al', 'an', 'ar', 'ba', 'da', 'de', 'el', 'fa', 'ha', 'ib', 'ka', 'ko', 'la', 'li', 'ma', 'mo',
+             'na', 'ni', 'ov', 'ra', 'ro', 'sa', 'sh', 'ta', 'to', 'ur', 'va', 'yu', 'za', 'zh']
+CYRILLIC = 'абвгдежзиклмнопрстуфхцчшыэюя'
+LEGAL_FORMS = ['LLC', 'Ltd', 'JSC', 'OOO', 'Co., Ltd.', 'GmbH', 'FZE', 'PJSC', 'Limited']
+PROGRAMS = ['RUSSIA-EO14024', 'IRAN', 'SDGT', 'CYBER2', 'DPRK3', 'SYRIA', 'VENEZUELA-EO13850', 'GLOMAG', 'ILLICIT-DRUGS-EO14059', 'UKRAINE-EO13662']
+COUNTRIES = ['RU', 'IR', 'CN', 'AE', 'KP', 'SY', 'VE', 'TR', 'BY', 'HK']
+
+KIMI_LATENCY = 0.2  # Seconds per simulated Kimi request
+KIMI_LATENCY_SIGMA = 0.3
+ENRICH_ENTITIES = 50  # Added entities looked up by the enrich stage
+RESPELLED_FRACTION = 0.5  # Removed names the reconcile stage re-adds with a vowel changed
+SCREEN_QUERIES = 500  # Names the screen stage looks up, as listed and respelled
+
+def _table(weights):
+    population = list(weights)
+    cumulative = []
+    total = 0.0
+    for value in weights.values():
+        total += value
+        cumulative.append(total)
+    return population, cumulative
+
+def _word(rng, non_latin):
+    if non_latin:
+        return ''.join(rng.choice(CYRILLIC) for _ in range(rng.randint(3, 9))).capitalize()
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))).capitalize()
+
+def _modified_in(seed, index, generation, rate):
+    return random.Random(seed * 1_000_003 + index * 7919 + generation).random() < rate
+
+def synthetic_record(index, seed=0, version=0, sources=None, names=None):
+    """
+    Builds one CSL record shaped like the real API's. The same (index, seed) always gives
+    the same entity; a higher `version` changes one of its programs, addresses, aliases or remarks.
+    """
+    rng = random.Random(seed * 1_000_003 + index)
+    source = rng.choices(*(sources or _table(SOURCE_MIX)))[0]
+    words = rng.choices(*(names or _table(NAME_WORDS)))[0]
+    non_latin = rng.random() < NON_LATIN_FRACTION
+    individual = rng.random() < 0.4
+    name = ' '.join(_word(rng, non_latin) for _ in range(words))
+    if not individual and rng.random() < 0.5:
+        name = f"{name} {rng.choice(LEGAL_FORMS)}"
+    country = rng.choice(COUNTRIES)
+
+    record = {
+        'id': f"{rng.getrandbits(160):040x}",
+        'source': source,
+        'entity_number': str(10000 + index),
+        'type': 'Individual' if individual else 'Entity',
+        'programs': sorted(rng.sample(PROGRAMS, rng.randint(1, 3))),
+        'name': name,
+        'title': None,
+        'addresses': [
+            {'address': f"{rng.randint(1, 200)} {_word(rng, False)} Street", 'city': _word(rng, False),
+             'state': None, 'postal_code': str(rng.randint(10000, 99999)), 'country': country}
+            for _ in range(rng.randint(0, 2))
+        ],
+        'federal_register_notice': f"{rng.randint(70, 89)} FR {rng.randint(1000, 99999)}",
+        'start_date': f"20{rng.randint(10, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'end_date': None,
+        'standard_order': None,
+        'license_requirement': None if source.startswith('Specially') else 'For all items subject to the EAR.',
+        'license_policy': None,
+        'call_sign': None,
+        'vessel_type': None,
+        'gross_tonnage': None,
+        'gross_registered_tonnage': None,
+        'vessel_flag': None,
+        'vessel_owner': None,
+        'remarks': None,
+        'source_list_url': 'https://sanctionssearch.ofac.treas.gov/',
+        'alt_names': [' '.join(_word(rng, False) for _ in range(words)) for _ in range(rng.randint(0, 3))],
+        'citizenships': [country] if individual else [],
+        'dates_of_birth': [f"19{rng.randint(40, 99)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"] if individual else [],
+        'nationalities': [country] if individual else [],
+        'places_of_birth': [],
+        'source_information_url': 'https://home.treasury.gov/policy-issues/office-of-foreign-assets-control-sanctions-programs-and-information',
+        'ids': [
+            {'type': rng.choice(['Passport', 'Registration ID', 'Tax ID No.']), 'number': str(rng.getrandbits(40)),
+             'country': country, 'issue_date': None, 'expiration_date': None}
+            for _ in range(rng.randint(0, 2))
+        ],
+    }
+
+    if version:
+        change = random.Random(seed * 1_000_003 + index + version * 104_729)
+        field = change.choice(['programs', 'addresses', 'alt_names', 'remarks'])
+        if field == 'programs':
+            record['programs'] = sorted(set(record['programs']) | {change.choice(PROGRAMS)}) + [f"AMENDED-{version}"]
+        elif field == 'addresses':
+            record['addresses'].append({'address': None, 'city': _word(change, False), 'state': None, 'postal_code': None, 'country': country})
+        elif field == 'alt_names':
+            record['alt_names'].append(f"{name} {version}")
+        else:
+            record['remarks'] = f"Amended designation, revision {version}."
+    return record
+
+def iter_synthetic_records(count, seed=0, generation=0, churn=0.0, source_mix=None, name_words=None):
+    """
+    Yields one generation of a synthetic list of `count` records. Each generation drops
+    the oldest count*churn/2 records, adds as many new ones and modifies about another
+    count*churn/2, so consecutive generations differ by roughly `churn` of the list.
+    """
+    sources = _table(source_mix or SOURCE_MIX)
+    names = _table(name_words or NAME_WORDS)
+    step = int(count * churn / 2)
+    rate = churn / 2
+    start = generation * step
+    for index in range(start, start + count):
+        version = sum(1 for g in range(1, generation + 1) if _modified_in(seed, index, g, rate)) if rate else 0
+        yield synthetic_record(index, seed, version, sources, names)
+
+def synthetic_payload(count, seed=0, generation=0, churn=0.0, source_mix=None, name_words=None):
+    """Serializes one generation as a consolidated.json body, returned as bytes."""
+    header = {'total': count, 'sources_used': [{'source': source} for source in source_mix or SOURCE_MIX]}
+    out = io.BytesIO()
+    out.write(json.dumps(header)[:-1].encode())
+    out.write(b', "results": [')
+    for i, record in enumerate(iter_synthetic_records(count, seed, generation, churn, source_mix, name_words)):
+        if i:
+            out.write(b',\n')
+        out.write(json.dumps(record).encode())
+    out.write(b']}')
+    return out.getvalue()
+
+def parse_weights(text, key=str):
+    """Parses 'a=0.5,b=0.5' into {a: 0.5, b: 0.5}."""
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.rpartition('=')
+        weights[key(name.strip())] = float(weight)
+    return weights
+
+# Timing
+
+@contextlib.contextmanager
+def _quiet():
+    # The pipeline logs per record and per tweet; keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def measure(function, repeat=3, setup=None, memory=True):
+    """
+    Calls setup() and then times function() `repeat` times, and once more under tracemalloc
+    for the peak memory it allocated. Setup is excluded from both. Returns (timings, result).
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with _quiet():
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+
+    timings = {'best_s': min(times), 'mean_s': sum(times) / len(times)}
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            with _quiet():
+                function()
+            timings['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return timings, result
+
+def _chunks(body):
+    return (body[i:i + feeds.STREAM_CHUNK_SIZE] for i in range(0, len(body), feeds.STREAM_CHUNK_SIZE))
+
+def _fresh_redis():
+    return app.use_redis(fakes.FakeRedis())
+
+@contextlib.contextmanager
+def _backend(name):
+    previous = app.STATE_BACKEND
+    app.STATE_BACKEND = name
+    try:
+        yield
+    finally:
+        app.STATE_BACKEND = previous
+
+@contextlib.contextmanager
+def _csl_feed(url):
+    # Only the consolidated list is tracked, served locally
+    feed = feeds.FEEDS[feeds.DEFAULT_FEED]
+    previous = feed.url, feeds.ENABLED_FEEDS[:]
+    feed.url = url
+    feeds.ENABLED_FEEDS[:] = [feed.name]
+    try:
+        yield feed
+    finally:
+        feed.url, feeds.ENABLED_FEEDS[:] = previous
+
+# Stages. Each takes the prepared data and returns (items processed, bytes processed, timings).
+
+def stage_parse(data, repeat, memory):
+    body = data['current_body']
+    timings, _ = measure(lambda: list(feeds.iter_list_records(_chunks(body))), repeat, memory=memory)
+    return data['records'], len(body), timings
+
+def stage_fetch(data, repeat, memory):
+    body = data['current_body']
+    with fakes.FakeCSLServer(body) as server, _csl_feed(server.url):
+        timings, _ = measure(app.get_current_list, repeat, memory=memory)
+    return data['records'], len(body), timings
+
+def stage_fetch_unchanged(data, repeat, memory):
+    # A tick where the list has not changed: conditional request answered with 304
+    with fakes.FakeCSLServer(data['current_body']) as server, _csl_feed(server.url) as feed:
+        redis_client = _fresh_redis()
+        redis_client.set(app.LIST_ETAG_KEY, server.etag)
+        redis_client.set(app.state_key(), '[]')
+        session = http_clients.get_csl_session()
+        timings, result = measure(
+            lambda: feeds.download(feed, session, **app.known_validators([feed])[feed.name]), repeat, memory=memory
+        )
+    assert result[2] == 'http-304', result
+    return 1, 0, timings
+
+def stage_diff(data, repeat, memory):
+    timings, _ = measure(lambda: app.diff_records(data['previous'], data['current']), repeat, memory=memory)
+    return data['records'], 0, timings
+
+def _retained_mb(build):
+    # Memory still held by what build() returns
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0] / 1e6
+    finally:
+        tracemalloc.stop()
+
+def stage_snapshot(data, repeat, memory):
+    # Column-wise snapshot vs the list of record dicts it replaces: build time, size, pickling
+    timings, _ = measure(lambda: CompactSnapshot.from_records(data['current']), repeat, memory=memory)
+    body = data['current_body']
+    records, timings['dicts_mb'] = _retained_mb(lambda: list(feeds.iter_list_records(_chunks(body))))
+    compact, timings['compact_mb'] = _retained_mb(lambda: CompactSnapshot.from_records(feeds.iter_list_records(_chunks(body))))
+    for label, value in (('dicts', records), ('compact', compact)):
+        started = time.perf_counter()
+        pickle.loads(pickle.dumps(value))
+        timings[f"{label}_pickle_s"] = time.perf_counter() - started
+    timings['note'] = (f"{timings['compact_mb']:.1f} MB vs {timings['dicts_mb']:.1f} MB as dicts; "
+                       f"pickled in {timings['compact_pickle_s'] * 1000:.1f} vs {timings['dicts_pickle_s'] * 1000:.1f} ms")
+    return data['records'], 0, timings
+
+def stage_diff_compact(data, repeat, memory):
+    previous, current = CompactSnapshot.from_records(data['previous']), CompactSnapshot.from_records(data['current'])
+    timings, changes = measure(lambda: app.diff_records(previous, current), repeat, memory=memory)
+    assert _canonical(changes) == _canonical(data['changes']), "column diff disagrees with diff_records"
+    timings['unchanged_s'] = measure(lambda: app.diff_records(current, current), repeat, memory=False)[0]['best_s']
+    timings['note'] = f"unchanged list in {timings['unchanged_s'] * 1000:.2f} ms"
+    return data['records'], 0, timings
+
+def _respell(name, rng):
+    vowels = [i for i, char in enumerate(name) if char in 'aeiouAEIOU']
+    if not vowels:
+        return name + 'a'
+    i = rng.choice(vowels)
+    return name[:i] + rng.choice([vowel for vowel in 'aeiou' if vowel != name[i].lower()]) + name[i + 1:]
+
+def stage_reconcile(data, repeat, memory):
+    # The churn's changes with the diff's ids, as the live check sees them. Some removed names
+    # come back respelled: half under their old id, which the diff reports as a modified
+    # record with a previous name, and half as new records with new ids, which are other
+    # entries however alike the names and must not be paired
+    rng = random.Random(0)
+    changes = data['changes']
+    added = {source: list(names) for source, names in changes['added'].items()}
+    removed = {source: list(names) for source, names in changes['removed'].items()}
+    modified = {source: list(entries) for source, entries in changes['modified'].items()}
+    added_ids = dict(changes['added_ids'])
+    respelled = {}
+    for source, names in changes['removed'].items():
+        for n, name in enumerate(rng.sample(names, int(len(names) * RESPELLED_FRACTION))):
+            new_name = _respell(name, rng)
+            record_id = changes['removed_ids'].get((source, name))
+            if n % 2:
+                added.setdefault(source, []).append(new_name)
+                added_ids[(source, new_name)] = f"{record_id}-respelled"
+                continue
+            respelled[name] = new_name
+            removed[source].remove(name)
+            modified.setdefault(source, []).append(
+                {'name': new_name, 'id': record_id, 'fields': ['name'], 'previous_source': source, 'previous_name': name})
+
+    def run():
+        _, renamed = renames.split_renamed(modified)
+        _, _, paired = renames.reconcile(added, removed, added_ids=added_ids, removed_ids=changes['removed_ids'])
+        return renamed, paired
+    timings, (renamed, paired) = measure(run, repeat, memory=memory)
+    timings['found'] = sum(1 for entries in renamed.values() for entry in entries
+                           if respelled.get(entry['previous_name']) == entry['name'])
+    timings['wrong'] = sum(map(len, paired.values()))
+    timings['note'] = (f"{timings['found']} of {len(respelled)} same-id respellings renamed, "
+                       f"{timings['wrong']} pairs across different ids")
+    return sum(map(len, added.values())) + sum(map(len, removed.values())) + sum(map(len, modified.values())), 0, timings
+
+def stage_screen(data, repeat, memory):
+    # Synthetic names are made of a few dozen syllables, so nearly every gram is common:
+    # the case where a candidate cut-off loses exact names
+    index = screening.ScreeningIndex.from_records(data['current'])
+    rng = random.Random(0)
+    sample = rng.sample(data['current'], min(SCREEN_QUERIES, len(data['current'])))
+    queries = [item['name'] for item in sample] + [_respell(item['name'], rng) for item in sample]
+    timings, results = measure(lambda: [index.search(query) for query in queries], repeat, memory=memory)
+    found = [any(match['source'] == item['source'] and match['name'] == item['name'] for match in matches)
+             for item, matches in zip(sample + sample, results)]
+    exact, respelled = sum(found[:len(sample)]), sum(found[len(sample):])
+    assert exact == len(sample), f"only {exact} of {len(sample)} listed names found themselves"
+    timings['ms_per_query'] = timings['best_s'] / len(queries) * 1000
+    timings['respelled_found'] = respelled
+    timings['note'] = f"{timings['ms_per_query']:.3f} ms per query, {respelled} of {len(sample)} respelled names found"
+    return len(queries), 0, timings
+
+def _state_save(backend):
+    def stage(data, repeat, memory):
+        with _backend(backend):
+            redis_client = _fresh_redis()
+            timings, _ = measure(lambda: app.save_current_state(data['current']), repeat, setup=redis_client.reset_stats, memory=memory)
+            timings['redis_round_trips'] = redis_client.stats['round_trips']
+        return data['records'], redis_client.stats['bytes_sent'], timings
+    return stage
+
+def _state_load(backend):
+    def stage(data, repeat, memory):
+        with _backend(backend):
+            redis_client = _fresh_redis()
+            with _quiet():
+                app.save_current_state(data['current'])
+            timings, _ = measure(app.load_previous_state, repeat, setup=redis_client.reset_stats, memory=memory)
+            timings['redis_round_trips'] = redis_client.stats['round_trips']
+        return data['records'], redis_client.stats['bytes_received'], timings
+    return stage
+
+def stage_state_sets_diff(data, repeat, memory):
+    # Stage the new list next to the saved one and diff them inside "Redis"
+    with _backend('sets'):
+        redis_client = _fresh_redis()
+        app.save_current_state(data['previous'])
+
+        def run():
+            app.stage_state_sets(data['current'])
+            return app.diff_state_sets()
+        timings, changes = measure(run, repeat, setup=redis_client.reset_stats, memory=memory)
+        timings['redis_round_trips'] = redis_client.stats['round_trips']
+    assert _canonical(changes) == _canonical(data['changes']), "server-side diff disagrees with diff_records"
+    return data['records'], redis_client.stats['bytes_received'], timings
+
+def _canonical(changes):
+    return {kind: by_source if kind.endswith('_ids') else {source: sorted(map(json.dumps, entries)) for source, entries in by_source.items()}
+            for kind, by_source in changes.items()}
+
+def _sections(changes):
+    sections = app.change_sections(changes['added'], "added")
+    sections.extend(app.change_sections(changes['removed'], "removed"))
+    sections.extend(app.change_sections(
+        {source: [app.describe_modification(entry) for entry in entries] for source, entries in changes['modified'].items()},
+        "updated",
+    ))
+    return sections
+
+def _message(changes):
+    # The whole change report as one string, the way it was built before pack_thread
+    messages = app.format_changes(changes['added'], "added") + app.format_changes(changes['removed'], "removed")
+    messages += app.format_changes(
+        {source: [app.describe_modification(entry) for entry in entries] for source, entries in changes['modified'].items()},
+        "updated",
+    )
+    return " | ".join(messages)
+
+def _changed_count(changes):
+    return sum(len(names) for kind in ('added', 'removed', 'modified') for names in changes[kind].values())
+
+def stage_format(data, repeat, memory):
+    timings, message = measure(lambda: _message(data['changes']), repeat, memory=memory)
+    return _changed_count(data['changes']), len(message), timings
+
+def stage_pack(data, repeat, memory):
+    sections = _sections(data['changes'])
+    timings, chunks = measure(lambda: app.pack_thread(sections), repeat, memory=memory)
+    timings['tweets'] = len(chunks)
+    return _changed_count(data['changes']), len(_message(data['changes'])), timings
+
+def stage_split(data, repeat, memory):
+    message = _message(data['changes'])
+    timings, chunks = measure(lambda: app.split_message(message), repeat, memory=memory)
+    timings['tweets'] = len(chunks)
+    return _changed_count(data['changes']), len(message), timings
+
+def stage_split_legacy(data, repeat, memory):
+    # split_message as it was before pack_thread, for comparison with the two above. It counts
+    # plain characters, so tweets with CJK names or URLs can come out over the limit
+    message = _message(data['changes'])
+    timings, chunks = measure(lambda: legacy_split_message(message), repeat, memory=memory)
+    timings['tweets'] = len(chunks)
+    return _changed_count(data['changes']), len(message), timings
+
+def stage_post(data, repeat, memory):
+    # Queue the thread and drain it through the outbox to a Twitter stand-in, without rate limiting
+    chunks = app.pack_thread(_sections(data['changes']))
+    http_clients.use_client('twitter', fakes.FakeTwitterSession())
+
+    def run():
+        outbox.enqueue_posts(app.redis_client, [{'text': chunk, 'reply_to': i - 1 if i else None} for i, chunk in enumerate(chunks)])
+        lease = leader.Lease(app.redis_client, outbox.PUBLISHER_LEASE)
+        lease.acquire()
+        return outbox.drain(app.redis_client, app.post_tweet, outbox.TokenBucket(capacity=len(chunks), interval=0), lease)
+    timings, posted = measure(run, repeat, setup=_fresh_redis, memory=memory)
+    assert posted == len(chunks), (posted, len(chunks))
+    return len(chunks), sum(len(chunk.encode()) for chunk in chunks), timings
+
+def stage_enrich(data, repeat, memory):
+    # Cold-cache Kimi lookups for newly added entities against a simulated-latency stand-in
+    entities = [(name, source) for source, names in data['changes']['added'].items() for name in names][:ENRICH_ENTITIES]
+    http_clients.use_client('kimi', fakes.FakeKimiClient(latency=data['kimi_latency'], latency_sigma=KIMI_LATENCY_SIGMA))
+    timings, contexts = measure(lambda: app.enrich_entities(entities), repeat, setup=_fresh_redis, memory=memory)
+    timings['found'] = sum(1 for context in contexts if context)
+    return len(entities), 0, timings
+
+def stage_check(data, repeat, memory):
+    # One full detection cycle: fetch, parse, diff, queue the thread and follow-ups, save state
+    http_clients.use_client('kimi', fakes.FakeKimiClient(latency=data['kimi_latency'], latency_sigma=KIMI_LATENCY_SIGMA))
+    with fakes.FakeCSLServer(data['previous_body']) as server, _csl_feed(server.url):
+
+        def setup():
+            _fresh_redis()
+            server.set_body(data['previous_body'])
+            with _quiet():
+                app.check_for_updates()
+            server.set_body(data['current_body'])
+        timings, changed = measure(app.check_for_updates, repeat, setup=setup, memory=memory)
+    assert changed
+    return data['records'], len(data['current_body']), timings
+
+STAGES = {
+    'parse': stage_parse,
+    'fetch': stage_fetch,
+    'fetch_unchanged': stage_fetch_unchanged,
+    'diff': stage_diff,
+    'snapshot': stage_snapshot,
+    'diff_compact': stage_diff_compact,
+    'reconcile': stage_reconcile,
+    'screen': stage_screen,
+    'state_blob_save': _state_save('blob'),
+    'state_blob_load': _state_load('blob'),
+    'state_sets_save': _state_save('sets'),
+    'state_sets_load': _state_load('sets'),
+    'state_sets_diff': stage_state_sets_diff,
+    'format': stage_format,
+    'pack': stage_pack,
+    'split': stage_split,
+    'split_legacy': stage_split_legacy,
+    'post': stage_post,
+    'enrich': stage_enrich,
+    'check': stage_check,
+}
+
+def legacy_split_message(message, max_length=280):
+    words = message.split()
+    chunks = []
+    current_chunk = []
+
+    for word in words:
+        if len(" ".join(current_chunk + [word])) <= max_length:
+            current_chunk.append(word)
+        else:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [word]
+
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+
+    return chunks
+
+def prepare(params):
+    start = time.perf_counter()
+    kwargs = {'seed': params['seed'], 'churn': params['churn'], 'source_mix': params['source_mix'], 'name_words': params['name_words']}
+    previous_body = synthetic_payload(params['records'], generation=0, **kwargs)
+    current_body = synthetic_payload(params['records'], generation=1, **kwargs)
+    previous = list(feeds.iter_list_records(_chunks(previous_body)))
+    current = list(feeds.iter_list_records(_chunks(current_body)))
+    changes = app.diff_records(previous, current)
+    print(f"Generated 2 x {params['records']} records ({len(current_body) / 1e6:.1f} MB each, "
+          f"{_changed_count(changes)} changes) in {time.perf_counter() - start:.1f}s")
+    return {
+        'records': params['records'],
+        'previous_body': previous_body,
+        'current_body': current_body,
+        'previous': previous,
+        'current': current,
+        'changes': changes,
+        'kimi_latency': params['kimi_latency'],
+    }
+
+def run(params, stages, repeat=3, memory=True):
+    data = prepare(params)
+    results = {}
+    try:
+        for name in stages:
+            items, size, timings = STAGES[name](data, repeat, memory)
+            timings['items'] = items
+            timings['items_per_s'] = items / timings['best_s'] if timings['best_s'] else None
+            if size:
+                timings['mb_per_s'] = size / 1e6 / timings['best_s'] if timings['best_s'] else None
+            results[name] = timings
+            print_stage(name, timings, timings.get('note', ''))
+    finally:
+        for name in ('twitter', 'kimi', 'csl'):
+            http_clients.use_client(name, None)
+    return results
+
+def print_stage(name, timings, note=''):
+    rate = f"{timings['items_per_s']:,.0f}/s" if timings.get('items_per_s') else '-'
+    throughput = f"{timings['mb_per_s']:.1f}" if timings.get('mb_per_s') else '-'
+    peak = f"{timings['peak_mb']:.1f}" if 'peak_mb' in timings else '-'
+    print(f"{name:<16} {timings['best_s']:>10.4f} {timings['mean_s']:>10.4f} {rate:>14} {throughput:>8} {peak:>9}  {note}")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(results, params, directory=RESULTS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    created = datetime.now(timezone.utc)
+    report = {
+        'created': created.isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'stages': results,
+    }
+    path = os.path.join(directory, f"bench-{created.strftime('%Y%m%dT%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def find_baseline(params, directory=RESULTS_DIR):
+    """The most recent saved report run with the same parameters."""
+    for path in sorted(glob.glob(os.path.join(directory, 'bench-*.json')), reverse=True):
+        with open(path) as f:
+            report = json.load(f)
+        if report.get('params') == params:
+            return path, report
+    return None, None
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Returns {stage: [regression descriptions]} for stages slower or hungrier than the baseline."""
+    regressions = {}
+    for name, timings in results.items():
+        before = baseline['stages'].get(name)
+        if not before:
+            continue
+        found = []
+        if timings['best_s'] > before['best_s'] * threshold and timings['best_s'] - before['best_s'] > REGRESSION_MIN_SECONDS:
+            found.append(f"time {before['best_s']:.4f}s -> {timings['best_s']:.4f}s")
+        if ('peak_mb' in timings and 'peak_mb' in before and timings['peak_mb'] > before['peak_mb'] * threshold
+                and timings['peak_mb'] - before['peak_mb'] > REGRESSION_MIN_MB):
+            found.append(f"peak memory {before['peak_mb']:.1f}MB -> {timings['peak_mb']:.1f}MB")
+        if found:
+            regressions[name] = found
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the OFACtivity pipeline.")
+    parser.add_argument('stages', nargs='*', help=f"stages to run (default: all of {', '.join(STAGES)})")
+    parser.add_argument('--records', type=int, default=20000, help="records in the synthetic list (up to 1M)")
+    parser.add_argument('--churn', type=float, default=0.02, help="fraction of the list that changes between runs")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--source-mix', type=parse_weights, help="'source=weight,...' (default: the real list's mix)")
+    parser.add_argument('--name-words', type=lambda text: parse_weights(text, int), help="'words=weight,...' name length distribution")
+    parser.add_argument('--kimi-latency', type=float, default=KIMI_LATENCY, help="seconds per simulated Kimi request")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage; the best is reported")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc run")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--baseline', help="report to compare against (default: latest with the same parameters)")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--write-payloads', metavar='DIR', help="write generated consolidated.json files and exit")
+    parser.add_argument('--generations', type=int, default=2, help="payloads written by --write-payloads")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    params = {
+        'records': args.records,
+        'churn': args.churn,
+        'seed': args.seed,
+        'source_mix': args.source_mix or SOURCE_MIX,
+        'name_words': {str(k): v for k, v in (args.name_words or NAME_WORDS).items()},
+        'kimi_latency': args.kimi_latency,
+    }
+    name_words = {int(k): v for k, v in params['name_words'].items()}
+
+    if args.write_payloads:
+        os.makedirs(args.write_payloads, exist_ok=True)
+        for generation in range(args.generations):
+            path = os.path.join(args.write_payloads, f"consolidated-{generation:04d}.json")
+            with open(path, 'wb') as f:
+                f.write(synthetic_payload(args.records, args.seed, generation, args.churn, params['source_mix'], name_words))
+            print(f"Wrote {path}")
+        return 0
+
+    print(f"{'stage':<16} {'best (s)':>10} {'mean (s)':>10} {'throughput':>14} {'MB/s':>8} {'peak MB':>9}")
+    results = run(dict(params, name_words=name_words), args.stages or list(STAGES), args.repeat, not args.no_memory)
+
+    if args.baseline:
+        baseline_path = args.baseline
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    else:
+        baseline_path, baseline = find_baseline(params, args.results_dir)
+
+    if not args.no_save:
+        print(f"Saved results to {save_results(results, params, args.results_dir)}")
+
+    if baseline is None:
+        print("No baseline with the same parameters to compare against.")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f"No regressions against {baseline_path}.")
+        return 0
+    print(f"Regressions against {baseline_path}:")
+    for name, found in regressions.items():
+        print(f"  {name}: {'; '.join(found)}")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+from datetime import datetime, timezone
+
+import redis
+
+# Change event stream in Redis, for services that want what the bot detects without
+# reading it back off Twitter:
+#   events:changes    stream of one entry per changed list entry, oldest first
+# Each entry's fields are flat strings: source, name, change (added, removed, modified or
+# renamed), run_id and at (ISO 8601, UTC); modified entries add id and fields (comma
+# separated), renamed ones previous_name and confidence. Subscribers read through their
+# own consumer group, acknowledge what they have handled, and can rewind to any entry
+# id still retained. Delivery is at least once: a run retried after a crash publishes
+# its events again under the same run_id.
+EVENTS_STREAM_KEY = 'events:changes'
+
+EVENTS_MAXLEN = int(os.getenv('EVENTS_MAXLEN', 100000))  # Entries kept, trimmed approximately
+EVENTS_CLAIM_IDLE = int(os.getenv('EVENTS_CLAIM_IDLE', 5 * 60 * 1000))  # Milliseconds before another consumer may take over an unacknowledged event
+
+def change_events(changes, run_id, at=None):
+    """
+    Turns a run's {'added', 'removed', 'modified', 'renamed'} change sets, each keyed by
+    source, into stream entries. `at` defaults to now.
+    """
+    at = (at or datetime.now(timezone.utc)).isoformat(timespec='seconds')
+    events = []
+    for change in ('added', 'removed', 'modified', 'renamed'):
+        for source, entries in (changes.get(change) or {}).items():
+            for entry in entries:
+                event = {'source': source, 'change': change, 'run_id': run_id, 'at': at}
+                if isinstance(entry, dict):
+                    event.update(entry)
+                    if 'fields' in event:
+                        event['fields'] = ','.join(event['fields'])
+                else:
+                    event['name'] = entry
+                events.append({field: str(value) for field, value in event.items() if value is not None})
+    return events
+
+def publish(redis_client, events, maxlen=EVENTS_MAXLEN):
+    """Appends events to the stream in one round trip. Returns their entry ids."""
+    if not events:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for event in events:
+        pipe.xadd(EVENTS_STREAM_KEY, event, maxlen=maxlen, approximate=True)
+    return pipe.execute()
+
+def ensure_group(redis_client, group, start='0'):
+    """
+    Creates a consumer group if it doesn't exist yet. A new group starts at `start`: '0'
+    for everything still retained, '$' for only what is published from now on.
+    """
+    try:
+        redis_client.xgroup_create(EVENTS_STREAM_KEY, group, id=start, mkstream=True)
+        return True
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+        return False
+
+def decode(entry_id, fields):
+    event = {key.decode(): value.decode() for key, value in (fields or {}).items()}
+    event['event_id'] = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+    return event
+
+def read(redis_client, group, consumer, count=100, block_ms=None, pending=False):
+    """
+    Reads up to `count` events for a consumer in a group: new ones, or with pending=True
+    the ones already delivered to this consumer and not yet acknowledged. Waits up to
+    block_ms for new events when there are none.
+    """
+    response = redis_client.xreadgroup(group, consumer, {EVENTS_STREAM_KEY: '0' if pending else '>'},
+                                       count=count, block=None if pending else block_ms)
+    # Pending entries trimmed from the stream since they were delivered come back without fields
+    return [decode(entry_id, fields) for _, entries in response or [] for entry_id, fields in entries if fields]
+
+def ack(redis_client, group, *event_ids):
+    return redis_client.xack(EVENTS_STREAM_KEY, group, *event_ids) if event_ids else 0
+
+def claim_stale(redis_client, group, consumer, min_idle_ms=EVENTS_CLAIM_IDLE, count=100):
+    """Takes over events another consumer was given but hasn't acknowledged for min_idle_ms."""
+    _, entries, _ = redis_client.xautoclaim(EVENTS_STREAM_KEY, group, consumer, min_idle_ms, count=count)
+    return [decode(entry_id, fields) for entry_id, fields in entries]
+
+def replay(redis_client, start='-', end='+', count=None):
+    """Events between two entry ids (inclusive; '-' and '+' for the ends), outside any group."""
+    return [decode(entry_id, fields) for entry_id, fields in redis_client.xrange(EVENTS_STREAM_KEY, start, end, count=count)]
+
+def seek(redis_client, group, offset):
+    """
+    Moves a group so its next read starts after `offset`: an entry id, '0' to re-read
+    everything retained, or '$' to skip to the end. Pending events stay pending.
+    """
+    redis_client.xgroup_setid(EVENTS_STREAM_KEY, group, offset)
+
+def stream_info(redis_client):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.xlen(EVENTS_STREAM_KEY)
+    pipe.exists(EVENTS_STREAM_KEY)
+    length, exists = pipe.execute()
+    groups = redis_client.xinfo_groups(EVENTS_STREAM_KEY) if exists else []
+    return {
+        'length': length,
+        'maxlen': EVENTS_MAXLEN,
+        'groups': [
+            {key: value.decode() if isinstance(value, bytes) else value for key, value in group.items()
+             if key in ('name', 'consumers', 'pending', 'last-delivered-id', 'lag')}
+            for group in groups
+        ],
+    }
@@ -0,0 +1,798 @@
+import json
+import math
+import time
+import random
+import fnmatch
+import threading
+from collections import defaultdict
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+
+# In-process stand-ins for Redis, the CSL endpoint, Twitter and Kimi, used by the
+# benchmarks and the load-test harness so they run offline and repeatably.
+
+HUNG_REQUEST_SECONDS = 60  # How long a hung Kimi request takes to fail when the caller sets no timeout
+
+def _b(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+class FakeRedis:
+    """
+    Thread-safe in-memory implementation of the Redis commands this project uses,
+    with redis-py return types. Counts commands, round trips and payload bytes so
+    benchmarks can report what would have crossed the network. Expiry is honoured lazily.
+    """
+
+    def __init__(self, latency=0.0):
+        self.data = {}
+        self.expires = {}
+        self.latency = latency  # Seconds added per round trip
+        self.lock = threading.RLock()
+        self.stats = defaultdict(int)
+
+    # Bookkeeping
+
+    def _round_trip(self):
+        self.stats['round_trips'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _count(self, args, result):
+        self.stats['commands'] += 1
+        for arg in args:
+            items = arg.items() if isinstance(arg, dict) else [(arg, b'')]
+            self.stats['bytes_sent'] += sum(len(_b(k)) + len(_b(v)) for k, v in items if isinstance(k, (bytes, str, int, float)))
+        if isinstance(result, bytes):
+            self.stats['bytes_received'] += len(result)
+        elif isinstance(result, (list, set)):
+            self.stats['bytes_received'] += sum(len(item) for item in result if isinstance(item, bytes))
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _typed(self, key, kind, create=False):
+        key = _b(key)
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = kind()
+        value = self.data[key]
+        if not isinstance(value, kind):
+            raise TypeError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _call(self, name, *args, **kwargs):
+        with self.lock:
+            result = getattr(self, '_' + name)(*args, **kwargs)
+            self._count(args, result)
+            return result
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not hasattr(type(self), '_' + name):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            self._round_trip()
+            return self._call(name, *args, **kwargs)
+        return command
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def reset_stats(self):
+        self.stats.clear()
+
+    # Keys and strings
+
+    def _ping(self):
+        return True
+
+    def _get(self, key):
+        return self._typed(key, bytes)
+
+    def _set(self, key, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        key = _b(key)
+        exists = self._alive(key)
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.data[key] = _b(value)
+        if ex is not None or px is not None:
+            self.expires[key] = time.time() + (ex if ex is not None else px / 1000)
+        elif not keepttl:
+            self.expires.pop(key, None)
+        return True
+
+    def _mget(self, *keys):
+        if len(keys) == 1 and isinstance(keys[0], (list, tuple)):
+            keys = keys[0]
+        return [self._typed(key, bytes) for key in keys]
+
+    def _delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            key = _b(key)
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    def _exists(self, *keys):
+        return sum(1 for key in keys if self._alive(_b(key)))
+
+    def _incr(self, key, amount=1):
+        value = int(self._typed(key, bytes) or 0) + amount
+        self.data[_b(key)] = _b(value)
+        return value
+
+    def _strlen(self, key):
+        return len(self._typed(key, bytes) or b'')
+
+    def _rename(self, source, destination):
+        source, destination = _b(source), _b(destination)
+        if not self._alive(source):
+            raise KeyError('ERR no such key')
+        self.data[destination] = self.data.pop(source)
+        if source in self.expires:
+            self.expires[destination] = self.expires.pop(source)
+        else:
+            self.expires.pop(destination, None)
+        return True
+
+    def _expire(self, key, seconds):
+        if not self._alive(_b(key)):
+            return False
+        self.expires[_b(key)] = time.time() + seconds
+        return True
+
+    def _pexpire(self, key, milliseconds):
+        return self._expire(key, milliseconds / 1000)
+
+    def _keys(self, pattern='*'):
+        return [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+
+    def _flushall(self):
+        self.data.clear()
+        self.expires.clear()
+        return True
+
+    # Sets
+
+    def _sadd(self, key, *members):
+        target = self._typed(key, set, create=True)
+        before = len(target)
+        target.update(_b(member) for member in members)
+        return len(target) - before
+
+    def _srem(self, key, *members):
+        target = self._typed(key, set) or set()
+        before = len(target)
+        target.difference_update(_b(member) for member in members)
+        return before - len(target)
+
+    def _smembers(self, key):
+        return set(self._typed(key, set) or ())
+
+    def _sdiff(self, key, *others):
+        result = set(self._typed(key, set) or ())
+        for other in others:
+            result -= self._typed(other, set) or set()
+        return result
+
+    # Hashes
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        target = self._typed(key, dict, create=True)
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(1 for f in items if _b(f) not in target)
+        target.update({_b(f): _b(v) for f, v in items.items()})
+        return added
+
+    def _hget(self, key, field):
+        return (self._typed(key, dict) or {}).get(_b(field))
+
+    def _hgetall(self, key):
+        return dict(self._typed(key, dict) or {})
+
+    def _hexists(self, key, field):
+        return _b(field) in (self._typed(key, dict) or {})
+
+    def _hdel(self, key, *fields):
+        target = self._typed(key, dict) or {}
+        return sum(1 for field in fields if target.pop(_b(field), None) is not None)
+
+    def _hincrby(self, key, field, amount=1):
+        target = self._typed(key, dict, create=True)
+        value = int(target.get(_b(field), 0)) + amount
+        target[_b(field)] = _b(value)
+        return value
+
+    def _hlen(self, key):
+        return len(self._typed(key, dict) or {})
+
+    # Lists
+
+    def _rpush(self, key, *values):
+        target = self._typed(key, list, create=True)
+        target.extend(_b(value) for value in values)
+        return len(target)
+
+    def _lpush(self, key, *values):
+        target = self._typed(key, list, create=True)
+        for value in values:
+            target.insert(0, _b(value))
+        return len(target)
+
+    def _lrange(self, key, start, end):
+        target = self._typed(key, list) or []
+        end = len(target) if end == -1 else end + 1
+        return list(target[start:end])
+
+    def _llen(self, key):
+        return len(self._typed(key, list) or [])
+
+    def _lrem(self, key, count, value):
+        target = self._typed(key, list) or []
+        value = _b(value)
+        removed = 0
+        while value in target and (count == 0 or removed < abs(count)):
+            target.remove(value)
+            removed += 1
+        return removed
+
+    def _lmove(self, source, destination, src='LEFT', dest='RIGHT'):
+        items = self._typed(source, list)
+        if not items:
+            return None
+        value = items.pop(0 if src == 'LEFT' else -1)
+        target = self._typed(destination, list, create=True)
+        if dest == 'LEFT':
+            target.insert(0, value)
+        else:
+            target.append(value)
+        return value
+
+    def _blmove(self, source, destination, timeout, src='LEFT', dest='RIGHT'):
+        # No blocking in-process; callers loop, so yield briefly when empty
+        value = self._lmove(source, destination, src, dest)
+        if value is None:
+            time.sleep(min(timeout, 0.01))
+        return value
+
+    # Sorted sets
+
+    def _zadd(self, key, mapping, nx=False):
+        target = self._typed(key, dict, create=True)
+        added = 0
+        for member, score in mapping.items():
+            member = _b(member)
+            if member not in target:
+                added += 1
+            elif nx:
+                continue
+            target[member] = float(score)
+        return added
+
+    def _zrem(self, key, *members):
+        target = self._typed(key, dict) or {}
+        return sum(1 for member in members if target.pop(_b(member), None) is not None)
+
+    def _zcard(self, key):
+        return len(self._typed(key, dict) or {})
+
+    def _zscore(self, key, member):
+        return (self._typed(key, dict) or {}).get(_b(member))
+
+    def _sorted(self, key, reverse=False):
+        target = self._typed(key, dict) or {}
+        return sorted(target.items(), key=lambda item: (item[1], item[0]), reverse=reverse)
+
+    def _zrange(self, key, start, end, withscores=False):
+        items = self._sorted(key)
+        end = len(items) if end == -1 else end + 1
+        items = items[start:end]
+        return items if withscores else [member for member, _ in items]
+
+    @staticmethod
+    def _bound(value):
+        if value in ('-inf', b'-inf'):
+            return float('-inf')
+        if value in ('+inf', 'inf', b'+inf'):
+            return float('inf')
+        return float(value)
+
+    def _zrangebyscore(self, key, low, high, start=None, num=None, withscores=False):
+        low, high = self._bound(low), self._bound(high)
+        items = [item for item in self._sorted(key) if low <= item[1] <= high]
+        if start is not None:
+            items = items[start:start + num]
+        return items if withscores else [member for member, _ in items]
+
+    def _zrevrangebyscore(self, key, high, low, start=None, num=None, withscores=False):
+        low, high = self._bound(low), self._bound(high)
+        items = [item for item in self._sorted(key, reverse=True) if low <= item[1] <= high]
+        if start is not None:
+            items = items[start:start + num]
+        return items if withscores else [member for member, _ in items]
+
+    def _zpopmin(self, key, count=1):
+        items = self._sorted(key)[:count]
+        target = self._typed(key, dict) or {}
+        for member, _ in items:
+            del target[member]
+        return items
+
+    def _zremrangebyscore(self, key, low, high):
+        low, high = self._bound(low), self._bound(high)
+        target = self._typed(key, dict) or {}
+        doomed = [member for member, score in target.items() if low <= score <= high]
+        for member in doomed:
+            del target[member]
+        return len(doomed)
+
+    # Streams
+
+    def _stream(self, key, create=False):
+        return self._typed(key, FakeStream, create=create)
+
+    def _group(self, key, groupname):
+        stream = self._stream(key)
+        group = stream.groups.get(_b(groupname)) if stream is not None else None
+        if group is None:
+            raise redis.ResponseError(f"NOGROUP No such key '{key}' or consumer group '{groupname}'")
+        return stream, group
+
+    def _xadd(self, name, fields, id='*', maxlen=None, approximate=True, nomkstream=False, minid=None, limit=None):
+        stream = self._stream(name, create=not nomkstream)
+        if stream is None:
+            return None
+        entry_id = stream.next_id() if id == '*' else _stream_id(id)
+        if entry_id <= stream.last_id:
+            raise redis.ResponseError('ERR The ID specified in XADD is equal or smaller than the target stream top item')
+        stream.entries.append((entry_id, {_b(field): _b(value) for field, value in fields.items()}))
+        stream.last_id = entry_id
+        stream.added += 1
+        if maxlen is not None and len(stream.entries) > maxlen:
+            del stream.entries[:len(stream.entries) - maxlen]
+        if minid is not None:
+            stream.entries = [entry for entry in stream.entries if entry[0] >= _stream_id(minid)]
+        return _format_id(entry_id)
+
+    def _xlen(self, name):
+        stream = self._stream(name)
+        return len(stream.entries) if stream is not None else 0
+
+    def _xrange(self, name, min='-', max='+', count=None):
+        stream = self._stream(name)
+        if stream is None:
+            return []
+        low, high = _stream_bound(min, False), _stream_bound(max, True)
+        items = [(_format_id(entry_id), dict(fields)) for entry_id, fields in stream.entries if low <= entry_id <= high]
+        return items[:count] if count else items
+
+    def _xrevrange(self, name, max='+', min='-', count=None):
+        items = self._xrange(name, min, max)[::-1]
+        return items[:count] if count else items
+
+    def _xtrim(self, name, maxlen=None, approximate=True, minid=None, limit=None):
+        stream = self._stream(name)
+        if stream is None:
+            return 0
+        before = len(stream.entries)
+        if maxlen is not None:
+            del stream.entries[:max(0, len(stream.entries) - maxlen)]
+        if minid is not None:
+            stream.entries = [entry for entry in stream.entries if entry[0] >= _stream_id(minid)]
+        return before - len(stream.entries)
+
+    def _xgroup_create(self, name, groupname, id='$', mkstream=False, entries_read=None):
+        stream = self._stream(name, create=mkstream)
+        if stream is None:
+            raise redis.ResponseError('ERR The XGROUP subcommand requires the key to exist.')
+        if _b(groupname) in stream.groups:
+            raise redis.ResponseError('BUSYGROUP Consumer Group name already exists')
+        stream.groups[_b(groupname)] = {'last': stream.last_id if id == '$' else _stream_id(id), 'pending': {}, 'consumers': set()}
+        return True
+
+    def _xgroup_setid(self, name, groupname, id, entries_read=None):
+        stream, group = self._group(name, groupname)
+        group['last'] = stream.last_id if id == '$' else _stream_id(id)
+        return True
+
+    def _xgroup_destroy(self, name, groupname):
+        stream = self._stream(name)
+        return 1 if stream is not None and stream.groups.pop(_b(groupname), None) is not None else 0
+
+    def _xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        result = []
+        consumer = _b(consumername)
+        now = int(time.time() * 1000)
+        for key, start in streams.items():
+            stream, group = self._group(key, groupname)
+            group['consumers'].add(consumer)
+            if start in ('>', b'>'):
+                items = [entry for entry in stream.entries if entry[0] > group['last']][:count]
+                if items:
+                    group['last'] = items[-1][0]
+                for entry_id, _ in items:
+                    if not noack:
+                        group['pending'][entry_id] = [consumer, now, 1]
+            else:
+                # The consumer's own history: entries delivered to it and not yet acknowledged
+                after = _stream_id(start)
+                by_id = dict(stream.entries)
+                ids = sorted(entry_id for entry_id, (owner, _, _) in group['pending'].items() if owner == consumer and entry_id > after)
+                items = [(entry_id, by_id.get(entry_id)) for entry_id in ids[:count]]
+            if items or start not in ('>', b'>'):
+                result.append([_b(key), [(_format_id(entry_id), dict(fields) if fields is not None else None) for entry_id, fields in items]])
+        if not any(items for _, items in result) and block is not None:
+            # No blocking in-process; callers loop, so yield briefly when there is nothing new
+            time.sleep(min(block / 1000, 0.01) if block else 0.01)
+        return result
+
+    def _xack(self, name, groupname, *ids):
+        _, group = self._group(name, groupname)
+        return sum(1 for entry_id in ids if group['pending'].pop(_stream_id(entry_id), None) is not None)
+
+    def _xpending(self, name, groupname):
+        _, group = self._group(name, groupname)
+        pending = group['pending']
+        consumers = defaultdict(int)
+        for owner, _, _ in pending.values():
+            consumers[owner] += 1
+        return {
+            'pending': len(pending),
+            'min': _format_id(min(pending)) if pending else None,
+            'max': _format_id(max(pending)) if pending else None,
+            'consumers': [{'name': name, 'pending': count} for name, count in sorted(consumers.items())],
+        }
+
+    def _xautoclaim(self, name, groupname, consumername, min_idle_time, start_id='0-0', count=None, justid=False):
+        stream, group = self._group(name, groupname)
+        now = int(time.time() * 1000)
+        by_id = dict(stream.entries)
+        claimed, deleted = [], []
+        start = _stream_id(start_id)
+        ids = sorted(entry_id for entry_id in group['pending'] if entry_id >= start)
+        count = count or 100
+        for entry_id in ids[:count]:
+            owner, delivered, deliveries = group['pending'][entry_id]
+            if now - delivered < min_idle_time:
+                continue
+            if entry_id not in by_id:
+                del group['pending'][entry_id]
+                deleted.append(_format_id(entry_id))
+                continue
+            group['pending'][entry_id] = [_b(consumername), now, deliveries + (0 if justid else 1)]
+            group['consumers'].add(_b(consumername))
+            claimed.append(entry_id)
+        next_start = _format_id(ids[count]) if len(ids) > count else b'0-0'
+        if justid:
+            return [_format_id(entry_id) for entry_id in claimed]
+        return [next_start, [(_format_id(entry_id), dict(by_id[entry_id])) for entry_id in claimed], deleted]
+
+    def _xinfo_groups(self, name):
+        stream = self._stream(name)
+        if stream is None:
+            raise redis.ResponseError('ERR no such key')
+        groups = []
+        for groupname, group in stream.groups.items():
+            groups.append({
+                'name': groupname,
+                'consumers': len(group['consumers']),
+                'pending': len(group['pending']),
+                'last-delivered-id': _format_id(group['last']),
+                'lag': sum(1 for entry_id, _ in stream.entries if entry_id > group['last']),
+            })
+        return groups
+
+class FakeStream:
+    """A Redis stream: entries as ((ms, seq), fields) in id order, and its consumer groups."""
+
+    def __init__(self):
+        self.entries = []
+        self.groups = {}  # name -> {'last': id, 'pending': {id: [consumer, delivered ms, deliveries]}, 'consumers': set}
+        self.last_id = (0, 0)
+        self.added = 0
+
+    def next_id(self):
+        now = int(time.time() * 1000)
+        if now > self.last_id[0]:
+            return (now, 0)
+        return (self.last_id[0], self.last_id[1] + 1)
+
+def _stream_id(value):
+    value = value.decode() if isinstance(value, bytes) else str(value)
+    ms, _, seq = value.partition('-')
+    return (int(ms), int(seq or 0))
+
+def _stream_bound(value, upper):
+    value = value.decode() if isinstance(value, bytes) else str(value)
+    if value == '-':
+        return (0, 0)
+    if value == '+':
+        return (float('inf'), 0)
+    if value.startswith('('):
+        ms, seq = _stream_id(value[1:])
+        return (ms, seq - 1) if upper else (ms, seq + 1)
+    if '-' not in value and upper:
+        return (int(value), float('inf'))
+    return _stream_id(value)
+
+def _format_id(entry_id):
+    return f"{entry_id[0]}-{entry_id[1]}".encode()
+
+class FakePipeline:
+    """
+    Buffers commands and runs them in one round trip, like a redis-py pipeline. Supports
+    WATCH: after watch() commands run immediately until multi(), and execute() raises
+    WatchError if a watched key changed in between.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.watched = None  # key -> value when watched
+        self.immediate = False
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self.commands = []
+        self.watched = None
+        self.immediate = False
+
+    def _snapshot(self, key):
+        key = _b(key)
+        if not self.redis._alive(key):
+            return None
+        value = self.redis.data[key]
+        return value.copy() if isinstance(value, (set, dict, list)) else value
+
+    def watch(self, *keys):
+        with self.redis.lock:
+            self.redis._round_trip()
+            self.watched = self.watched or {}
+            self.watched.update((_b(key), self._snapshot(key)) for key in keys)
+        self.immediate = True
+        return True
+
+    def unwatch(self):
+        self.watched = None
+        self.immediate = False
+        return True
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not hasattr(FakeRedis, '_' + name):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            if self.immediate:
+                return getattr(self.redis, name)(*args, **kwargs)
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, watched = self.commands, self.watched
+        self.reset()
+        with self.redis.lock:
+            if watched and any(self._snapshot(key) != value for key, value in watched.items()):
+                raise redis.WatchError('Watched variable changed.')
+            if not commands:
+                return []
+            self.redis._round_trip()
+            return [self.redis._call(name, *args, **kwargs) for name, args, kwargs in commands]
+
+class FakeResponse:
+    """The parts of requests.Response the app reads."""
+
+    def __init__(self, status_code=200, payload=None, headers=None, body=b''):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        self.body = body if payload is None else json.dumps(payload).encode()
+        self.text = self.body.decode(errors='replace')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size=65536):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+class FakeCSLServer:
+    """
+    Serves a consolidated.json body on a local port with ETag support, so the real
+    streaming download path (sockets, chunked reads, 304s) can be timed offline.
+    `latency` delays every response by that many seconds.
+    """
+
+    def __init__(self, body=b'{"results": []}', host='127.0.0.1', port=0, latency=0.0):
+        self.set_body(body)
+        self.requests = 0
+        self.latency = latency
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                body, etag = server.body, server.etag
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/consolidated.json"
+
+    def set_body(self, body):
+        self.body = body
+        self.etag = f'"{hash(body) & 0xffffffff:08x}"'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeTwitterSession:
+    """
+    Stand-in for the OAuth1 session used to post tweets. Simulates latency, Twitter's
+    per-window and per-24-hour limits (answering 429 with x-rate-limit-* or
+    x-user-limit-24hour-* headers once one is used up) and a share of 503s.
+    """
+
+    def __init__(self, latency=0.0, window_limit=None, window_seconds=900, jitter=0.0, seed=0,
+                 daily_limit=None, day_seconds=24 * 60 * 60, failure_rate=0.0):
+        self.latency = latency
+        self.window_limit = window_limit
+        self.window_seconds = window_seconds
+        self.daily_limit = daily_limit
+        self.day_seconds = day_seconds
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.window_start = self.day_start = time.time()
+        self.window_count = self.day_count = 0
+        self.posts = []
+        self.rejected = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, **kwargs):
+        if self.latency:
+            time.sleep(max(0.0, self.latency * (1 + self.random.uniform(-self.jitter, self.jitter))))
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window_seconds:
+                self.window_start, self.window_count = now, 0
+            if now - self.day_start >= self.day_seconds:
+                self.day_start, self.day_count = now, 0
+            # Whole epoch seconds, like Twitter's, rounded up so a client waiting for them is never early
+            reset = math.ceil(self.window_start + self.window_seconds)
+            day_reset = math.ceil(self.day_start + self.day_seconds)
+            if self.window_limit is not None and self.window_count >= self.window_limit:
+                self.rejected += 1
+                headers = {'x-rate-limit-limit': str(self.window_limit), 'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(reset)}
+                return FakeResponse(429, {'title': 'Too Many Requests'}, headers)
+            if self.daily_limit is not None and self.day_count >= self.daily_limit:
+                self.rejected += 1
+                headers = {'x-user-limit-24hour-limit': str(self.daily_limit), 'x-user-limit-24hour-remaining': '0',
+                           'x-user-limit-24hour-reset': str(day_reset)}
+                return FakeResponse(429, {'title': 'Too Many Requests'}, headers)
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failed += 1
+                return FakeResponse(503, {'title': 'Service Unavailable'})
+            self.window_count += 1
+            self.day_count += 1
+            tweet_id = str(len(self.posts) + 1)
+            self.posts.append({'id': tweet_id, 'time': now, 'payload': json})
+            headers = {}
+            if self.window_limit is not None:
+                headers.update({'x-rate-limit-remaining': str(self.window_limit - self.window_count), 'x-rate-limit-reset': str(reset)})
+            if self.daily_limit is not None:
+                headers.update({'x-user-limit-24hour-remaining': str(self.daily_limit - self.day_count),
+                                'x-user-limit-24hour-reset': str(day_reset)})
+            return FakeResponse(201, {'data': {'id': tweet_id, 'text': json['text']}}, headers)
+
+class FakeKimiClient:
+    """
+    Stand-in for the OpenAI-compatible Kimi client. Answers with a synthetic summary
+    (or a JSON array for batched prompts) after a latency drawn from a lognormal
+    distribution, and fails, hangs until the caller's timeout or answers NO_INFO at
+    configurable rates.
+    """
+
+    def __init__(self, latency=0.0, latency_sigma=0.0, failure_rate=0.0, no_info_rate=0.0, seed=0, timeout_rate=0.0):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.no_info_rate = no_info_rate
+        self.timeout_rate = timeout_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def with_options(self, **options):
+        # The SDK returns a copy with other retry and timeout settings; the stand-in has neither
+        return self
+
+    def _draw(self):
+        with self.lock:
+            self.calls += 1
+            delay = self.latency * self.random.lognormvariate(0, self.latency_sigma) if self.latency else 0
+            if self.random.random() < self.timeout_rate:
+                delay = float('inf')
+            fails = self.random.random() < self.failure_rate
+            no_info = [self.random.random() < self.no_info_rate for _ in range(64)]
+        return delay, fails, no_info
+
+    def create(self, model=None, messages=None, timeout=None, **kwargs):
+        delay, fails, no_info = self._draw()
+        if delay > (timeout if timeout is not None else HUNG_REQUEST_SECONDS):
+            timeout = timeout if timeout is not None else HUNG_REQUEST_SECONDS
+            time.sleep(timeout)
+            raise TimeoutError(f"Kimi request timed out after {timeout}s")
+        time.sleep(delay)
+        if fails:
+            raise RuntimeError("Simulated Kimi failure")
+
+        prompt = messages[-1]['content']
+        lines = [line for line in prompt.split('\n')[1:] if line[:1].isdigit()]
+        if lines:
+            answers = []
+            for i, line in enumerate(lines):
+                name = line.split("'")[1] if "'" in line else line
+                answers.append({'id': i + 1, 'context': 'NO_INFO' if no_info[i % 64] else f"{name}: Synthetic entity. Sanctioned for testing."})
+            content = json.dumps(answers)
+        else:
+            name = prompt.split("'")[1] if "'" in prompt else 'Entity'
+            content = 'NO_INFO' if no_info[0] else f"{name}: Synthetic entity. Sanctioned for testing."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
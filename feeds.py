@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import codecs
+import hashlib
+import asyncio
+import tempfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from snapshot import CompactSnapshot
+
+# Sanctions lists the tracker can follow. Each feed has a URL, a body format with a
+# parser below, and the source label its records carry (CSL records bring their own).
+# FEEDS picks the enabled ones, e.g. FEEDS=csl,uk,eu
+ENABLED_FEEDS = [name.strip() for name in os.getenv('FEEDS', 'csl').split(',') if name.strip()]
+DEFAULT_FEED = 'csl'  # Keeps the original, un-namespaced Redis keys
+
+STREAM_CHUNK_SIZE = 64 * 1024  # Bytes read from the socket per iteration
+# Record fields whose changes are reported by name; any other change shows up as 'other'
+FINGERPRINT_FIELDS = (
+    'name', 'type', 'programs', 'alt_names', 'addresses', 'ids',
+    'remarks', 'start_date', 'end_date', 'federal_register_notice',
+)
+RESULTS_ARRAY_START = re.compile(r'"results"\s*:\s*\[')
+# Parsing runs in worker processes when several feeds are fetched at once
+FEED_PARSE_WORKERS = int(os.getenv('FEED_PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Per-field hashes from the last parse of each feed in this process, by fingerprint
+_field_hashes = {}
+# One encoder for every hash: json.dumps with options builds a new one per call
+_canonical_json = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode
+
+def _short_hash(value, size):
+    return hashlib.blake2b(_canonical_json(value).encode(), digest_size=size).hexdigest()
+
+def project_record(item, known_fields=None):
+    """
+    Reduces a full CSL record to what the diff needs: source, name, id, a content
+    fingerprint of the whole record ('fp') and a 2-byte hash per FINGERPRINT_FIELDS
+    entry ('fh') so modified records can report which fields changed. known_fields
+    maps fingerprints seen before to their fh: only records whose content changed
+    since have their fields hashed.
+    """
+    fp = _short_hash(item, 8)
+    fh = known_fields.get(fp) if known_fields else None
+    return {
+        'source': item['source'],
+        'name': item['name'],
+        'id': item.get('id'),
+        'fp': fp,
+        'fh': fh or ''.join(_short_hash(item.get(field), 2) for field in FINGERPRINT_FIELDS),
+    }
+
+def reusing_projector(key):
+    """
+    A project_record for one parse of a feed (any hashable `key`) that reuses the
+    per-field hashes from the feed's last parse in this process.
+    """
+    known_fields = _field_hashes.get(key)
+    seen = _field_hashes[key] = {}
+
+    def project(item):
+        record = project_record(item, known_fields)
+        seen[record['fp']] = record['fh']
+        return record
+    return project
+
+def iter_list_records(chunks, project=project_record):
+    """
+    Incrementally parses a consolidated.json body delivered as an iterable of byte chunks.
+    Each entry of the top-level 'results' array is decoded as soon as it is complete and
+    reduced with `project`, so memory stays flat however large the list gets.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    in_results = False
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        pos = 0
+
+        if not in_results:
+            match = RESULTS_ARRAY_START.search(buffer)
+            if not match:
+                # Keep a short tail in case the key straddles two chunks
+                buffer = buffer[-32:]
+                continue
+            in_results = True
+            pos = match.end()
+
+        length = len(buffer)
+        while True:
+            # Skip separators between records
+            while pos < length and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= length:
+                break
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Record is incomplete, wait for the next chunk
+                break
+            if isinstance(item, dict):
+                yield project(item)
+
+        buffer = buffer[pos:]
+
+    if not in_results:
+        raise ValueError("No 'results' array found in consolidated list response")
+    raise ValueError("Consolidated list response ended before the 'results' array was closed")
+
+def iter_file_chunks(file_obj, chunk_size=STREAM_CHUNK_SIZE):
+    return iter(lambda: file_obj.read(chunk_size), b'')
+
+# XML feeds are parsed incrementally as well, one entry element at a time, and mapped
+# onto CSL field names so the same projection, diff and formatting apply
+
+def _local(tag):
+    return tag.rpartition('}')[2]
+
+def _children(elem, name):
+    return [child for child in elem if _local(child.tag) == name]
+
+def _text(elem, name):
+    for child in elem:
+        if _local(child.tag) == name:
+            return (child.text or '').strip() or None
+    return None
+
+def _texts(elem, path):
+    # Texts of the elements at a '/'-separated path of local names
+    nodes = [elem]
+    for name in path.split('/'):
+        nodes = [child for node in nodes for child in _children(node, name)]
+    return [(node.text or '').strip() for node in nodes if (node.text or '').strip()]
+
+def iter_xml_elements(chunks, tag):
+    """Yields each completed element with the given local name, clearing it afterwards."""
+    parser = ET.XMLPullParser(events=('end',))
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            if _local(elem.tag) == tag:
+                yield elem
+                elem.clear()
+    parser.close()
+    for _, elem in parser.read_events():
+        if _local(elem.tag) == tag:
+            yield elem
+
+def _join_name(last, first):
+    return f"{last}, {first}" if last and first else last or first
+
+def sdn_entry_record(entry, source):
+    """Maps an OFAC SDN XML <sdnEntry> to CSL field names."""
+    record = {
+        'id': _text(entry, 'uid'),
+        'source': source,
+        'type': _text(entry, 'sdnType'),
+        'name': _join_name(_text(entry, 'lastName'), _text(entry, 'firstName')),
+        'title': _text(entry, 'title'),
+        'programs': sorted(_texts(entry, 'programList/program')),
+        'alt_names': [
+            _join_name(_text(aka, 'lastName'), _text(aka, 'firstName'))
+            for aka in _children(next(iter(_children(entry, 'akaList')), entry), 'aka')
+        ],
+        'addresses': [
+            {
+                'address': ', '.join(filter(None, (_text(address, 'address1'), _text(address, 'address2'), _text(address, 'address3')))) or None,
+                'city': _text(address, 'city'),
+                'state': _text(address, 'stateOrProvince'),
+                'postal_code': _text(address, 'postalCode'),
+                'country': _text(address, 'country'),
+            }
+            for address_list in _children(entry, 'addressList') for address in _children(address_list, 'address')
+        ],
+        'ids': [
+            {'type': _text(item, 'idType'), 'number': _text(item, 'idNumber'), 'country': _text(item, 'idCountry')}
+            for id_list in _children(entry, 'idList') for item in _children(id_list, 'id')
+        ],
+        'dates_of_birth': _texts(entry, 'dateOfBirthList/dateOfBirthItem/dateOfBirth'),
+        'places_of_birth': _texts(entry, 'placeOfBirthList/placeOfBirthItem/placeOfBirth'),
+        'nationalities': _texts(entry, 'nationalityList/nationality/country'),
+        'citizenships': _texts(entry, 'citizenshipList/citizenship/country'),
+        'remarks': _text(entry, 'remarks'),
+    }
+    for vessel in _children(entry, 'vesselInfo'):
+        record.update(
+            call_sign=_text(vessel, 'callSign'), vessel_type=_text(vessel, 'vesselType'),
+            vessel_flag=_text(vessel, 'vesselFlag'), vessel_owner=_text(vessel, 'vesselOwner'),
+            gross_tonnage=_text(vessel, 'grossRegisteredTonnage'),
+        )
+    return record
+
+def iter_sdn_xml(chunks, project=project_record, source='OFAC SDN List'):
+    for entry in iter_xml_elements(chunks, 'sdnEntry'):
+        yield project(sdn_entry_record(entry, source))
+
+def _uk_name(row):
+    forenames = ' '.join(filter(None, (_text(row, f'Name{i}') for i in range(1, 6))))
+    return _join_name(_text(row, 'Name6'), forenames)
+
+def iter_uk_xml(chunks, project=project_record, source='UK Consolidated List'):
+    """
+    Parses the UK OFSI consolidated list (ConList.xml), which has one row per name and
+    address of a target. Rows are grouped by GroupID into one record per target.
+    """
+    targets = {}
+    for row in iter_xml_elements(chunks, 'FinancialSanctionsTarget'):
+        group = _text(row, 'GroupID')
+        target = targets.setdefault(group, {
+            'id': group, 'source': source, 'name': None, 'type': _text(row, 'GroupTypeDescription'),
+            'programs': set(), 'alt_names': set(), 'addresses': [], 'ids': [], 'remarks': _text(row, 'OtherInformation'),
+            'start_date': _text(row, 'DateDesignated') or _text(row, 'DateListed'),
+            'dates_of_birth': set(), 'nationalities': set(),
+        })
+        name = _uk_name(row)
+        if 'primary' in (_text(row, 'AliasType') or '').lower():
+            target['name'] = name
+        elif name:
+            target['alt_names'].add(name)
+        if _text(row, 'Regime'):
+            target['programs'].add(_text(row, 'Regime'))
+        address = ', '.join(filter(None, (_text(row, f'Address{i}') for i in range(1, 7))))
+        if address or _text(row, 'Country'):
+            entry = {'address': address or None, 'city': None, 'state': None,
+                     'postal_code': _text(row, 'PostCode'), 'country': _text(row, 'Country')}
+            if entry not in target['addresses']:
+                target['addresses'].append(entry)
+        for kind in ('PassportDetails', 'NINumber'):
+            value = _text(row, kind)
+            if value and {'type': kind, 'number': value} not in target['ids']:
+                target['ids'].append({'type': kind, 'number': value})
+        if _text(row, 'DOB'):
+            target['dates_of_birth'].add(_text(row, 'DOB'))
+        if _text(row, 'Nationality'):
+            target['nationalities'].add(_text(row, 'Nationality'))
+
+    for target in targets.values():
+        aliases = sorted(target['alt_names'])
+        target['name'] = target['name'] or (aliases[0] if aliases else target['id'])
+        for field in ('programs', 'alt_names', 'dates_of_birth', 'nationalities'):
+            target[field] = sorted(target[field] - {target['name']})
+        yield project(target)
+
+def eu_entity_record(entity, source):
+    """Maps an EU Financial Sanctions File <sanctionEntity> to CSL field names."""
+    aliases = _children(entity, 'nameAlias')
+    primary = next((alias for alias in aliases if alias.get('strong') == 'true'), aliases[0] if aliases else None)
+    names = [alias.get('wholeName') or _join_name(alias.get('lastName'), alias.get('firstName')) for alias in aliases]
+    name = names[aliases.index(primary)] if primary is not None else entity.get('euReferenceNumber')
+    subject = next(iter(_children(entity, 'subjectType')), None)
+    regulations = _children(entity, 'regulation')
+    return {
+        'id': entity.get('logicalId'),
+        'source': source,
+        'type': subject.get('code') if subject is not None else None,
+        'name': name,
+        'programs': sorted({regulation.get('programme') for regulation in regulations if regulation.get('programme')}),
+        'alt_names': sorted(set(filter(None, names)) - {name}),
+        'addresses': [
+            {'address': address.get('street') or None, 'city': address.get('city') or None, 'state': address.get('region') or None,
+             'postal_code': address.get('zipCode') or None, 'country': address.get('countryIso2Code') or None}
+            for address in _children(entity, 'address')
+        ],
+        'ids': [
+            {'type': item.get('identificationTypeCode'), 'number': item.get('number'), 'country': item.get('countryIso2Code')}
+            for item in _children(entity, 'identification')
+        ],
+        'dates_of_birth': [birth.get('birthdate') for birth in _children(entity, 'birthdate') if birth.get('birthdate')],
+        'citizenships': [item.get('countryIso2Code') for item in _children(entity, 'citizenship') if item.get('countryIso2Code')],
+        'remarks': ' '.join(_texts(entity, 'remark')) or None,
+        'start_date': min((regulation.get('publicationDate') for regulation in regulations if regulation.get('publicationDate')), default=None),
+        'federal_register_notice': entity.get('euReferenceNumber'),
+    }
+
+def iter_eu_xml(chunks, project=project_record, source='EU Financial Sanctions List'):
+    for entity in iter_xml_elements(chunks, 'sanctionEntity'):
+        yield project(eu_entity_record(entity, source))
+
+def _iter_csl(chunks, project=project_record, source=None):
+    return iter_list_records(chunks, project)
+
+# Parsers by body format: parser(chunks, project, source) yields projected records
+FORMATS = {
+    'csl-json': _iter_csl,
+    'ofac-sdn-xml': iter_sdn_xml,
+    'uk-ofsi-xml': iter_uk_xml,
+    'eu-fsf-xml': iter_eu_xml,
+}
+
+class Feed:
+    def __init__(self, name, url, format, source=None):
+        self.name = name
+        self.url = url
+        self.format = format
+        self.source = source  # Source label given to every record; None when the body has its own
+
+    def iter_records(self, chunks, project=project_record):
+        return FORMATS[self.format](chunks, project, self.source)
+
+    def __repr__(self):
+        return f"Feed({self.name!r}, {self.format!r})"
+
+FEEDS = {
+    'csl': Feed('csl', os.getenv(
+        'CSL_URL', "https://data.trade.gov/downloadable_consolidated_screening_list/v1/consolidated.json"), 'csl-json'),
+    'ofac-sdn': Feed('ofac-sdn', os.getenv(
+        'OFAC_SDN_URL', "https://sanctionslistservice.ofac.treas.gov/api/PublicationPreview/exports/SDN.XML"),
+        'ofac-sdn-xml', "OFAC SDN List (XML) - Treasury Department"),
+    'uk': Feed('uk', os.getenv(
+        'UK_LIST_URL', "https://ofsistorage.blob.core.windows.net/publishlive/2022format/ConList.xml"),
+        'uk-ofsi-xml', "UK Consolidated List - OFSI"),
+    'eu': Feed('eu', os.getenv(
+        'EU_LIST_URL', "https://webgate.ec.europa.eu/fsd/fsf/public/files/xmlFullSanctionsList_1_1/content?token=dG9rZW4tMjAxNw"),
+        'eu-fsf-xml', "EU Financial Sanctions List"),
+}
+
+def enabled_feeds():
+    unknown = [name for name in ENABLED_FEEDS if name not in FEEDS]
+    if unknown:
+        raise ValueError(f"Unknown feed(s) in FEEDS: {', '.join(unknown)} (known: {', '.join(FEEDS)})")
+    return [FEEDS[name] for name in ENABLED_FEEDS]
+
+def download(feed, session, etag=None, last_modified=None, digest=None, has_state=False):
+    """
+    Downloads a feed to a temporary file, conditionally on the stored ETag/Last-Modified.
+    Returns (path, validators, short_circuit): path is None when the feed is unchanged,
+    in which case short_circuit names the layer that noticed ('http-304' or 'digest').
+    """
+    headers = {}
+    # Without a saved snapshot there is nothing to short-circuit against
+    if has_state:
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    with metrics.stage(f"{feed.name}_download") as timer, \
+            session.get(feed.url, headers=headers, stream=True) as response:
+        metrics.count('feed_responses', feed=feed.name, status=response.status_code)
+        if response.status_code == 304:
+            return None, None, 'http-304'
+        response.raise_for_status()
+
+        body = tempfile.NamedTemporaryFile(prefix=f"{feed.name}-", delete=False)
+        sha256 = hashlib.sha256()
+        with body:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                sha256.update(chunk)
+                body.write(chunk)
+                timer.add(bytes=len(chunk))
+
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'digest': sha256.hexdigest(),
+        }
+
+    if has_state and digest and digest == validators['digest']:
+        os.unlink(body.name)
+        return None, validators, 'digest'
+    return body.name, validators, None
+
+def parse_file(format, source, path):
+    """
+    Parses a downloaded body into a CompactSnapshot of projected records. Runs in a worker
+    process, and the snapshot's few flat buffers pickle back far faster than record dicts.
+    """
+    with open(path, 'rb') as f:
+        return CompactSnapshot.from_records(FORMATS[format](iter_file_chunks(f), reusing_projector((format, source)), source))
+
+_parse_pool = None
+
+def parse_pool():
+    # One pool for the life of the process; 'spawn' so workers don't inherit the daemon's threads
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(FEED_PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pool
+
+async def _fetch_feed(feed, session, known, pool):
+    result = {'feed': feed, 'path': None, 'records': None, 'validators': None, 'short_circuit': None, 'error': None}
+    try:
+        path, result['validators'], result['short_circuit'] = await asyncio.to_thread(download, feed, session, **known)
+        if path is None:
+            return result
+        result['path'] = path
+        with metrics.stage(f"{feed.name}_parse") as timer:
+            if pool is None:
+                result['records'] = await asyncio.to_thread(parse_file, feed.format, feed.source, path)
+            else:
+                result['records'] = await asyncio.get_running_loop().run_in_executor(pool, parse_file, feed.format, feed.source, path)
+            timer.add(bytes=os.path.getsize(path), records=len(result['records']))
+    except Exception as e:
+        result['error'] = e
+    return result
+
+async def _fetch_all(feeds, session, known, pool):
+    return await asyncio.gather(*(_fetch_feed(feed, session, known[feed.name], pool) for feed in feeds))
+
+def fetch_feeds(feeds, session, known):
+    """
+    Downloads and parses all feeds concurrently, so a run takes about as long as the
+    slowest feed. Downloads run on threads; with more than one feed, parsing runs in a
+    process pool. `known` maps feed names to download() keyword arguments. Returns one
+    result dict per feed, in order, with 'path', 'records', 'validators', 'short_circuit'
+    and 'error' (a failed feed doesn't stop the others). Callers delete 'path' when done.
+    """
+    pool = parse_pool() if len(feeds) > 1 and FEED_PARSE_WORKERS > 0 else None
+    return asyncio.run(_fetch_all(feeds, session, known, pool))
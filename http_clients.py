@@ -0,0 +1,168 @@
+import os
+import json
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1Session
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from openai import OpenAI
+
+# httpx ships with openai; without it the Kimi client still pools connections, just without metrics
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Connection pool and retry settings shared by all outbound clients
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))  # Keep-alive connections per host
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5))  # 0.5s, 1s, 2s...
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 60))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+_clients = {}
+_stats_lock = threading.Lock()
+_host_stats = defaultdict(lambda: {'requests': 0, 'new_connections': 0})
+
+def _count(host, field, amount=1):
+    with _stats_lock:
+        _host_stats[host][field] += amount
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count(self.host, 'new_connections')
+        return super()._new_conn()
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count(self.host, 'new_connections')
+        return super()._new_conn()
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout that records per-host requests and new connections."""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        super().__init__(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        _count(urlsplit(request.url).hostname, 'requests')
+        return super().send(request, **kwargs)
+
+def _mount(session, retry):
+    adapter = PooledHTTPAdapter(max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def use_client(name, client):
+    """Replaces the shared 'csl', 'twitter' or 'kimi' client, e.g. with a local stand-in; None resets it."""
+    with _lock:
+        if client is None:
+            _clients.pop(name, None)
+        else:
+            _clients[name] = client
+
+def get_csl_session():
+    """Long-lived session for downloading the consolidated list, retrying GETs on 429/5xx."""
+    def factory():
+        retry = Retry(
+            total=HTTP_MAX_RETRIES,
+            backoff_factor=HTTP_BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=('GET', 'HEAD'),
+        )
+        return _mount(requests.Session(), retry)
+    return _get_or_create('csl', factory)
+
+def get_twitter_session(consumer_key, consumer_secret, access_token, access_token_secret):
+    """
+    Long-lived OAuth1 session for the Twitter API. Tweets are only retried when they
+    certainly were not created (connection failures and 429), so a retry never double-posts.
+    """
+    def factory():
+        retry = Retry(
+            total=HTTP_MAX_RETRIES,
+            connect=HTTP_MAX_RETRIES,
+            read=0,
+            backoff_factor=HTTP_BACKOFF_FACTOR,
+            status_forcelist=(429,),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        session = OAuth1Session(
+            consumer_key,
+            client_secret=consumer_secret,
+            resource_owner_key=access_token,
+            resource_owner_secret=access_token_secret,
+        )
+        return _mount(session, retry)
+    return _get_or_create('twitter', factory)
+
+def _trace_connections(request):
+    host = request.url.host
+
+    def trace(event, info):
+        if event == 'connection.connect_tcp.complete':
+            _count(host, 'new_connections')
+
+    _count(host, 'requests')
+    request.extensions['trace'] = trace
+
+def get_kimi_client(api_key, base_url):
+    """Shared OpenAI-compatible client for Kimi; the OpenAI SDK retries 429/5xx with backoff."""
+    def factory():
+        http_client = None
+        if httpx is not None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                event_hooks={'request': [_trace_connections]},
+            )
+        return OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=HTTP_MAX_RETRIES,
+            timeout=HTTP_READ_TIMEOUT,
+            http_client=http_client,
+        )
+    return _get_or_create('kimi', factory)
+
+def connection_stats():
+    """Per-host request and new-connection counts since start-up; reuse is the share of requests that needed no handshake."""
+    with _stats_lock:
+        stats = {}
+        for host, counts in _host_stats.items():
+            requests_made = counts['requests']
+            reused = max(requests_made - counts['new_connections'], 0)
+            stats[host] = dict(counts, reuse_rate=round(reused / requests_made, 3) if requests_made else 0.0)
+        return stats
+
+def report_connection_stats():
+    stats = connection_stats()
+    if stats:
+        print(f"Connection reuse: {json.dumps(stats)}")
@@ -0,0 +1,141 @@
+import os
+import uuid
+import socket
+import threading
+
+import redis
+
+# Lease-based leader election. The holder of a lease key runs detection; every new
+# holder gets a fencing token one higher than the last, which state writes carry so a
+# holder that lost its lease (paused, partitioned) cannot overwrite a newer one's state.
+LEASE_TTL = float(os.getenv('LEASE_TTL', 30))  # Seconds a lease survives without renewal
+STANDBY_POLL_INTERVAL = float(os.getenv('STANDBY_POLL_INTERVAL', 5))  # Seconds between a standby's takeover attempts
+LEASE_KEY_PREFIX = 'lease:'
+FENCING_KEY_PREFIX = 'lease_token:'
+
+def default_owner():
+    # Heroku sets DYNO (worker.1, worker.2...); the suffix keeps restarts of one dyno distinct
+    return f"{os.getenv('DYNO') or socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class Lease:
+    """
+    A named lease in Redis. acquire() takes it if it is free and returns the fencing token;
+    keep_alive() renews it in the background until release() or until a renewal finds
+    someone else holding it, after which `held` is False.
+    """
+
+    def __init__(self, redis_client, name, ttl=LEASE_TTL, owner=None):
+        self.redis_client = redis_client
+        self.name = name
+        self.key = LEASE_KEY_PREFIX + name
+        self.fencing_key = FENCING_KEY_PREFIX + name
+        self.ttl = ttl
+        self.owner = owner or default_owner()
+        self.token = None
+        self.held = False
+        self.heartbeat = None
+        self.stop_heartbeat = threading.Event()
+
+    def _parse(self, value):
+        if value is None:
+            return None, None
+        owner, _, token = value.decode().rpartition(' ')
+        return owner, int(token)
+
+    def holder(self):
+        return self._parse(self.redis_client.get(self.key))[0]
+
+    def acquire(self):
+        """Takes the lease if it is free (or already ours). Returns the fencing token, or None."""
+        with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key, self.fencing_key)
+                    owner, token = self._parse(pipe.get(self.key))
+                    if owner is not None and owner != self.owner:
+                        pipe.unwatch()
+                        self.held = False
+                        return None
+                    if owner is None:
+                        token = int(pipe.get(self.fencing_key) or 0) + 1
+                    pipe.multi()
+                    pipe.set(self.fencing_key, token)
+                    pipe.set(self.key, f"{self.owner} {token}", px=int(self.ttl * 1000))
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        if not self.held:
+            print(f"Acquired lease '{self.name}' as {self.owner} with fencing token {token}")
+        self.token = token
+        self.held = True
+        return token
+
+    def renew(self):
+        """Extends the lease if it is still ours. Returns False if it was lost."""
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                owner, token = self._parse(pipe.get(self.key))
+                if owner != self.owner or token != self.token:
+                    pipe.unwatch()
+                    self.held = False
+                    return False
+                pipe.multi()
+                pipe.pexpire(self.key, int(self.ttl * 1000))
+                pipe.execute()
+            except redis.WatchError:
+                # Changed between our read and the extension: someone else has it now
+                self.held = False
+                return False
+        return True
+
+    def release(self):
+        self.stop_heartbeat.set()
+        if self.heartbeat is not None and self.heartbeat is not threading.current_thread():
+            self.heartbeat.join(timeout=5)
+        self.heartbeat = None
+        if not self.held:
+            return
+        self.held = False
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                owner, token = self._parse(pipe.get(self.key))
+                if owner == self.owner and token == self.token:
+                    pipe.multi()
+                    pipe.delete(self.key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+            except redis.WatchError:
+                pass
+        print(f"Released lease '{self.name}'")
+
+    def keep_alive(self):
+        """Renews the lease every third of its TTL on a daemon thread while it is held."""
+        if self.heartbeat is not None and self.heartbeat.is_alive():
+            return
+
+        def beat():
+            while not self.stop_heartbeat.wait(self.ttl / 3):
+                try:
+                    if not self.renew():
+                        print(f"Lost lease '{self.name}' (token {self.token}), standing by")
+                        return
+                except Exception as e:
+                    # Keep trying; the lease only lapses once a whole TTL passes without a renewal
+                    print(f"Could not renew lease '{self.name}': {e}")
+
+        self.stop_heartbeat.clear()
+        self.heartbeat = threading.Thread(target=beat, name=f"lease-{self.name}", daemon=True)
+        self.heartbeat.start()
+
+    def ensure(self):
+        """For a polling loop: True while the lease is ours, trying to take it over otherwise."""
+        if self.held and self.heartbeat is not None and self.heartbeat.is_alive():
+            return True
+        if self.acquire() is None:
+            return False
+        self.keep_alive()
+        return True
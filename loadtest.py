@@ -0,0 +1,351 @@
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import contextlib
+
+import app
+import bench
+import feeds
+import fakes
+import leader
+import outbox
+import metrics
+import http_clients
+
+# End-to-end load test: the real detection loop and outbox publisher, run against the
+# stand-ins in fakes.py while a scripted scenario changes the list underneath them.
+# Reports how long changes took to reach Twitter, as percentiles, to size concurrency
+# caps and rate limits before deploying.
+#
+#   python loadtest.py                                      # the designation-day scenario
+#   python loadtest.py steady --time-scale 600              # ten simulated minutes per second
+#   python loadtest.py scenario.json --tweet-interval 9 --enrichment-concurrency 10
+#   python loadtest.py burst --twitter-tier free --kimi-failure-rate 0.2 --json report.json
+#
+# A scenario is a starting list size and steps applied at times in simulated seconds:
+#   {"records": 5000, "poll_interval": 60,
+#    "steps": [{"at": 30, "added": 3}, {"at": 600, "added": 150, "removed": 20, "modified": 40}]}
+# Every simulated duration (steps, polling, latencies, rate-limit windows, retry backoff)
+# runs --time-scale times faster and measured latencies are scaled back up. CPU work
+# (parsing, diffing) is not sped up, so it is overstated by the same factor; the report
+# shows the real time spent in detection runs so it can be allowed for.
+
+SCENARIOS = {
+    # A quiet morning, then a large designation package and a follow-up correction
+    'designation-day': {'records': 5000, 'poll_interval': 60, 'steps': [
+        {'at': 30, 'added': 3, 'modified': 2},
+        {'at': 900, 'added': 120, 'removed': 10, 'modified': 30},
+        {'at': 2400, 'added': 10, 'removed': 2, 'modified': 5},
+    ]},
+    # Small changes every ten minutes for two hours
+    'steady': {'records': 5000, 'poll_interval': 60, 'steps': [
+        {'at': 30 + 600 * i, 'added': 2, 'removed': 1, 'modified': 2} for i in range(12)
+    ]},
+    # One very large package, far more tweets than a rate-limit window allows
+    'burst': {'records': 5000, 'poll_interval': 60, 'steps': [
+        {'at': 30, 'added': 400, 'removed': 40, 'modified': 60},
+    ]},
+}
+
+# Per-user limits on POST /2/tweets, roughly as published per API tier:
+# (requests per 15-minute window, requests per 24 hours)
+TWITTER_TIERS = {
+    'free': (None, 17),
+    'basic': (100, 100),
+    'pro': (100, 10000),
+}
+
+PERCENTILES = (50, 90, 95, 99)
+DRAIN_TIMEOUT = 4 * 60 * 60  # Simulated seconds after the last step to wait for queued tweets
+
+class ScriptedList:
+    """
+    The synthetic list as a scenario changes it: which entities are on it and at which
+    version, using bench.py's record generator.
+    """
+
+    def __init__(self, records, seed=0):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.sources = bench._table(bench.SOURCE_MIX)
+        self.names = bench._table(bench.NAME_WORDS)
+        self.versions = dict.fromkeys(range(records), 0)  # Entity index -> version, oldest first
+        self.next_index = records
+
+    def record(self, index):
+        return bench.synthetic_record(index, self.seed, self.versions[index], self.sources, self.names)
+
+    def apply(self, step):
+        """Applies one step: drops the oldest entities, amends random ones, adds new ones. Returns the names by kind."""
+        changed = {'added': [], 'removed': [], 'modified': []}
+        for index in list(self.versions)[:step.get('removed', 0)]:
+            changed['removed'].append(self.record(index)['name'])
+            del self.versions[index]
+        for index in self.rng.sample(list(self.versions), min(step.get('modified', 0), len(self.versions))):
+            self.versions[index] += 1
+            changed['modified'].append(self.record(index)['name'])
+        for _ in range(step.get('added', 0)):
+            self.versions[self.next_index] = 0
+            changed['added'].append(self.record(self.next_index)['name'])
+            self.next_index += 1
+        return changed
+
+    def body(self):
+        records = [json.dumps(self.record(index)) for index in self.versions]
+        return ('{"total": %d, "results": [%s]}' % (len(records), ',\n'.join(records))).encode()
+
+def load_scenario(name):
+    if name in SCENARIOS:
+        return SCENARIOS[name]
+    with open(name) as f:
+        return json.load(f)
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    summary = {'count': len(values)}
+    summary.update({f"p{q}": round(percentile(values, q), 1) for q in PERCENTILES})
+    summary['max'] = round(values[-1], 1)
+    return summary
+
+@contextlib.contextmanager
+def _overrides(module, **values):
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+def _mentions(text, name):
+    # The name as a whole entry of a thread tweet: after "<source> <action>: " or ", and ",
+    # before the next entry, the next section, a "(fields)" note or the end
+    return re.search(rf'(?:: |, and ){re.escape(name)}(?=, and | \| | \(| \d+/\d+$|$)', text) is not None
+
+def measure(changes, ticks, posts, sources, scale, started):
+    """
+    Latencies in simulated seconds, from each step's change to: the end of the detection
+    run that saw it (its Kimi lookups included), the first tweet naming each changed entity,
+    the last tweet of that run's thread, and each follow-up tweet. Changed entities no
+    tweet named are counted as unannounced.
+    """
+    simulated = lambda at: (at - started) * scale
+    main = [post for post in posts if post['payload']['text'].startswith(sources)]
+    follow_ups = [post for post in posts if not post['payload']['text'].startswith(sources)]
+    results = {'detection': [], 'announced': [], 'thread': [], 'follow_up': []}
+    unannounced = 0
+
+    for change in changes:
+        # A run that started just before the change may still have downloaded it
+        detected = next((tick for tick in ticks if tick['changed'] and tick['finished'] > change['at']), None)
+        if detected is None:
+            unannounced += sum(len(names) for names in change['names'].values())
+            continue
+        results['detection'].append(simulated(detected['finished']) - simulated(change['at']))
+        thread = [post for post in main if post['time'] >= detected['started']]
+        last = None
+        for kind, names in change['names'].items():
+            for name in names:
+                post = next((post for post in thread if _mentions(post['payload']['text'], name)), None)
+                if post is None:
+                    unannounced += 1
+                    continue
+                results['announced'].append(simulated(post['time']) - simulated(change['at']))
+                last = max(last or 0, post['time'])
+                if kind == 'added':
+                    follow_up = next((post for post in follow_ups if post['time'] >= detected['started']
+                                      and post['payload']['text'].startswith(f"{name}:")), None)
+                    if follow_up is not None:
+                        results['follow_up'].append(simulated(follow_up['time']) - simulated(change['at']))
+        if last is not None:
+            results['thread'].append(simulated(last) - simulated(change['at']))
+    return results, unannounced
+
+def run(scenario, args):
+    scale = args.time_scale
+    window_limit, daily_limit = TWITTER_TIERS[args.twitter_tier]
+    poll_interval = (args.poll_interval or scenario.get('poll_interval', 60)) / scale
+    script = ScriptedList(scenario['records'], args.seed)
+    steps = sorted(scenario['steps'], key=lambda step: step['at'])
+
+    # Every list the scenario goes through, generated before the clock starts
+    bodies = [script.body()]
+    names = []
+    for step in steps:
+        names.append(script.apply(step))
+        bodies.append(script.body())
+    print(f"Generated {len(bodies)} lists of about {scenario['records']} records", file=sys.stderr)
+
+    twitter = fakes.FakeTwitterSession(
+        latency=args.twitter_latency / scale, jitter=0.5, seed=args.seed, window_limit=window_limit,
+        window_seconds=15 * 60 / scale, daily_limit=daily_limit, day_seconds=24 * 60 * 60 / scale,
+        failure_rate=args.twitter_failure_rate,
+    )
+    kimi = fakes.FakeKimiClient(
+        latency=args.kimi_latency / scale, latency_sigma=args.kimi_latency_sigma, failure_rate=args.kimi_failure_rate,
+        no_info_rate=args.kimi_no_info_rate, timeout_rate=args.kimi_timeout_rate, seed=args.seed,
+    )
+    redis_client = fakes.FakeRedis(latency=args.redis_latency / scale)
+    server = fakes.FakeCSLServer(bodies[0], latency=args.csl_latency / scale)
+    feed = feeds.FEEDS[feeds.DEFAULT_FEED]
+
+    changes = []
+    ticks = []
+    stop = threading.Event()
+
+    def apply_steps(started):
+        for step, body, step_names in zip(steps, bodies[1:], names):
+            if stop.wait(max(0.0, started + step['at'] / scale - time.time())):
+                return
+            server.set_body(body)
+            changes.append({'at': time.time(), 'names': step_names})
+            print(f"[{step['at']:>6}s] list changed: {', '.join(f'{len(v)} {k}' for k, v in step_names.items() if v)}", file=sys.stderr)
+
+    log = open(args.log, 'a')
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(server)
+        stack.enter_context(contextlib.redirect_stdout(log))
+        stack.enter_context(_overrides(feed, url=server.url))
+        stack.enter_context(_overrides(feeds, ENABLED_FEEDS=[feed.name]))
+        stack.enter_context(_overrides(metrics, METRICS_LOG=False))
+        stack.enter_context(_overrides(
+            app, PUBLISH_MODE='outbox', ENRICHMENT_TIMEOUT=app.ENRICHMENT_TIMEOUT / scale,
+            ENRICHMENT_CONCURRENCY=args.enrichment_concurrency or app.ENRICHMENT_CONCURRENCY,
+            MAX_FOLLOW_UPS_PER_RUN=args.max_follow_ups if args.max_follow_ups is not None else app.MAX_FOLLOW_UPS_PER_RUN,
+        ))
+        stack.enter_context(_overrides(
+            outbox, OUTBOX_RETRY_BACKOFF=outbox.OUTBOX_RETRY_BACKOFF / scale, OUTBOX_PARENT_WAIT=outbox.OUTBOX_PARENT_WAIT / scale,
+        ))
+        stack.callback(http_clients.use_client, 'twitter', None)
+        stack.callback(http_clients.use_client, 'kimi', None)
+        stack.callback(log.close)
+        http_clients.use_client('twitter', twitter)
+        http_clients.use_client('kimi', kimi)
+        app.use_redis(redis_client)
+        app.memory_state['enabled'] = True  # As in the daemon
+        stack.callback(app.memory_state.update, enabled=False)
+
+        # The first run only saves the starting list
+        app.check_for_updates()
+
+        limiter = outbox.TokenBucket(args.tweet_burst, args.tweet_interval / scale, redis_client)
+        lease = leader.Lease(redis_client, outbox.PUBLISHER_LEASE)
+        lease.acquire()
+        lease.keep_alive()
+        stack.callback(lease.release)
+        publisher = threading.Thread(target=outbox.drain, args=(redis_client, app.post_tweet, limiter, lease),
+                                     kwargs={'block': True, 'stop': stop}, name='publisher', daemon=True)
+        started = time.time()
+        stepper = threading.Thread(target=apply_steps, args=(started,), name='scenario', daemon=True)
+        publisher.start()
+        stepper.start()
+
+        deadline = started + (steps[-1]['at'] + args.drain_timeout) / scale
+        next_check = started
+        try:
+            while time.time() < deadline:
+                if stop.wait(max(0.0, next_check - time.time())):
+                    break
+                next_check += poll_interval
+                tick = {'started': time.time()}
+                try:
+                    tick['changed'] = app.check_for_updates()
+                except Exception as e:
+                    print(f"Detection run failed: {e}", file=sys.stderr)
+                    tick['changed'] = False
+                tick['finished'] = time.time()
+                ticks.append(tick)
+                settled = (not stepper.is_alive() and changes and tick['started'] > changes[-1]['at']
+                           and not outbox.pending_count(redis_client) and not redis_client.zcard(outbox.OUTBOX_RETRY_KEY))
+                if settled:
+                    break
+        finally:
+            stop.set()
+            publisher.join(timeout=5)
+            stepper.join(timeout=5)
+        elapsed = time.time() - started
+
+    sources = tuple(f"{source} " for source in bench.SOURCE_MIX)
+    latencies, unannounced = measure(changes, ticks, twitter.posts, sources, scale, started)
+    return {
+        'scenario': scenario,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('scenario', 'json', 'log')},
+        'latency_s': {kind: summarize(values) for kind, values in latencies.items()},
+        'entities_changed': sum(len(names) for change in changes for names in change['names'].values()),
+        'unannounced': unannounced,
+        'tweets_posted': len(twitter.posts),
+        'twitter_429s': twitter.rejected,
+        'twitter_503s': twitter.failed,
+        'kimi_requests': kimi.calls,
+        'dead_jobs': redis_client.hlen(outbox.OUTBOX_DEAD_KEY),
+        'still_queued': outbox.pending_count(redis_client) + redis_client.zcard(outbox.OUTBOX_RETRY_KEY),
+        'detection_runs': len(ticks),
+        'detection_cpu_s': round(sum(tick['finished'] - tick['started'] for tick in ticks), 2),
+        'simulated_s': round(elapsed * scale),
+        'wall_s': round(elapsed, 1),
+    }
+
+def print_report(report):
+    print(f"\n{'latency (simulated s)':<22} {'count':>6}" + ''.join(f" {f'p{q}':>8}" for q in PERCENTILES) + f" {'max':>8}")
+    for kind, summary in report['latency_s'].items():
+        values = ''.join(f" {summary.get(f'p{q}', '-'):>8}" for q in PERCENTILES) + f" {summary.get('max', '-'):>8}"
+        print(f"{kind:<22} {summary['count']:>6}{values}")
+    print(f"\n{report['entities_changed']} entities changed, {report['unannounced']} never tweeted; "
+          f"{report['tweets_posted']} tweets posted, {report['twitter_429s']} 429s, {report['twitter_503s']} 503s, "
+          f"{report['dead_jobs']} given up, {report['still_queued']} still queued")
+    print(f"{report['kimi_requests']} Kimi requests; {report['detection_runs']} detection runs took "
+          f"{report['detection_cpu_s']}s of real time; {report['simulated_s']}s simulated in {report['wall_s']}s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test of the OFACtivity pipeline against local stand-ins.")
+    parser.add_argument('scenario', nargs='?', default='designation-day',
+                        help=f"built-in scenario ({', '.join(SCENARIOS)}) or a scenario JSON file")
+    parser.add_argument('--time-scale', type=float, default=60, help="simulated seconds per wall-clock second")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--poll-interval', type=float, help="seconds between detection runs (default: the scenario's)")
+    parser.add_argument('--tweet-burst', type=int, default=outbox.TWEET_BURST)
+    parser.add_argument('--tweet-interval', type=float, default=outbox.TWEET_INTERVAL, help="seconds per tweet token")
+    parser.add_argument('--enrichment-concurrency', type=int, help="parallel Kimi requests")
+    parser.add_argument('--max-follow-ups', type=int, help="follow-up tweets per run")
+    parser.add_argument('--twitter-tier', choices=sorted(TWITTER_TIERS), default='basic')
+    parser.add_argument('--twitter-latency', type=float, default=0.4, help="seconds per tweet request")
+    parser.add_argument('--twitter-failure-rate', type=float, default=0.01, help="share of tweet requests answered with 503")
+    parser.add_argument('--kimi-latency', type=float, default=8.0, help="median seconds per Kimi request (web search is slow)")
+    parser.add_argument('--kimi-latency-sigma', type=float, default=0.5, help="lognormal spread of Kimi latency")
+    parser.add_argument('--kimi-failure-rate', type=float, default=0.05)
+    parser.add_argument('--kimi-timeout-rate', type=float, default=0.02, help="share of Kimi requests that hang until the timeout")
+    parser.add_argument('--kimi-no-info-rate', type=float, default=0.2)
+    parser.add_argument('--csl-latency', type=float, default=1.0, help="seconds before the list endpoint answers")
+    parser.add_argument('--redis-latency', type=float, default=0.001, help="seconds per Redis round trip")
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT,
+                        help="simulated seconds after the last step to wait for queued tweets")
+    parser.add_argument('--log', default='loadtest.log', help="where the pipeline's own output goes")
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        scenario = load_scenario(args.scenario)
+    except OSError as e:
+        parser.error(f"unknown scenario {args.scenario!r} ({e.strerror})")
+    report = run(scenario, args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
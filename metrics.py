@@ -0,0 +1,295 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from datetime import datetime, timezone
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-stage timings and counters for each detection run. With METRICS_ENABLED=false
+# every call below returns straight away.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_LOG = os.getenv('METRICS_LOG', 'true').lower() == 'true'  # One JSON line per run on stdout
+METRICS_FILE = os.getenv('METRICS_FILE')  # Prometheus text file rewritten after each run (node_exporter textfile collector)
+METRICS_PORT = os.getenv('METRICS_PORT')  # Serve GET /metrics from the daemon on this port
+PROFILE_MODE = os.getenv('PROFILE_MODE', '')  # 'cprofile' or 'tracemalloc' to profile every run
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_TOP = 25  # Lines printed from each profile
+METRIC_PREFIX = 'ofactivity_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+
+_lock = threading.Lock()
+_stages = defaultdict(lambda: {'calls': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0, 'records': 0, 'buckets': [0] * len(LATENCY_BUCKETS)})
+_counters = defaultdict(int)  # (name, sorted label items) -> count
+_gauges = {}
+_runs = defaultdict(int)  # (name, outcome) -> count
+_last_run = {}
+_current = None  # Totals for the run in progress
+
+class Stage:
+    """A timed section. Use add() to attribute bytes and records to it."""
+
+    __slots__ = ('name', 'bytes', 'records', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.records = 0
+
+    def add(self, bytes=0, records=0):
+        self.bytes += bytes
+        self.records += records
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(self.name, time.perf_counter() - self.started, self.bytes, self.records, exc_type is not None)
+        return False
+
+class _NoopStage:
+    __slots__ = ()
+
+    def add(self, bytes=0, records=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_STAGE = _NoopStage()
+
+def stage(name):
+    """
+    Times a stage: `with metrics.stage('fetch') as s: ...; s.add(bytes=n)`. Stages may nest
+    and may run on several threads at once; external API calls are stages too, so their
+    latencies end up in the histogram.
+    """
+    if not METRICS_ENABLED:
+        return NOOP_STAGE
+    return Stage(name)
+
+def _record(name, seconds, size, records, failed):
+    with _lock:
+        totals = _stages[name]
+        totals['calls'] += 1
+        totals['errors'] += failed
+        totals['seconds'] += seconds
+        totals['bytes'] += size
+        totals['records'] += records
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                totals['buckets'][i] += 1
+                break
+        if _current is not None:
+            run_stage = _current['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'records': 0})
+            run_stage['calls'] += 1
+            run_stage['seconds'] += seconds
+            run_stage['bytes'] += size
+            run_stage['records'] += records
+            if failed:
+                run_stage['errors'] = run_stage.get('errors', 0) + 1
+
+def count(name, amount=1, **labels):
+    """Adds to a counter, e.g. count('kimi_cache', result='hit')."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += amount
+        if _current is not None:
+            label = ','.join(f"{k}={v}" for k, v in key[1])
+            run_key = f"{name}{{{label}}}" if label else name
+            _current['counters'][run_key] = _current['counters'].get(run_key, 0) + amount
+
+def gauge(name, value, **labels):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+@contextlib.contextmanager
+def _profiling(mode, label):
+    if mode not in ('cprofile', 'tracemalloc'):
+        yield
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, f"{label}-{stamp}.prof")
+            profiler.dump_stats(path)
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            print(report.getvalue())
+            print(f"cProfile stats saved to {path} (open with `python -m pstats {path}`)")
+    else:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            path = os.path.join(PROFILE_DIR, f"{label}-{stamp}.tracemalloc")
+            snapshot.dump(path)
+            print(f"tracemalloc: peak {peak / 1e6:.1f} MB, still allocated {current / 1e6:.1f} MB")
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                print(f"  {stat}")
+            print(f"tracemalloc snapshot saved to {path}")
+
+@contextlib.contextmanager
+def run(name, profile=None):
+    """
+    Wraps one run (e.g. a check_for_updates tick). Afterwards logs the run's per-stage
+    totals as one JSON line and rewrites METRICS_FILE. `profile` ('cprofile' or
+    'tracemalloc', default PROFILE_MODE) captures a profile of this run only. Yields a
+    dict; keys set on it are included in the log line.
+    """
+    global _current
+    fields = {}
+    mode = profile or PROFILE_MODE
+    if not METRICS_ENABLED and not mode:
+        yield fields
+        return
+
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    with _lock:
+        _current = {'stages': {}, 'counters': {}}
+    outcome = 'error'
+    try:
+        with _profiling(mode, name):
+            yield fields
+        outcome = 'ok'
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            totals, _current = _current, None
+            _runs[(name, outcome)] += 1
+            _last_run[name] = {'seconds': seconds, 'finished': time.time(), 'ok': outcome == 'ok'}
+        if METRICS_ENABLED:
+            if METRICS_LOG:
+                entry = {'event': 'run', 'run': name, 'started': started_at.isoformat(), 'seconds': round(seconds, 4), 'outcome': outcome}
+                entry.update(fields)
+                entry['stages'] = {
+                    stage_name: dict(values, seconds=round(values['seconds'], 4))
+                    for stage_name, values in totals['stages'].items()
+                }
+                entry['counters'] = totals['counters']
+                print(json.dumps(entry, default=str))
+            if METRICS_FILE:
+                write_textfile(METRICS_FILE)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(items):
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    p = METRIC_PREFIX
+    lines = []
+    with _lock:
+        stages = {name: dict(values, buckets=list(values['buckets'])) for name, values in _stages.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        runs = dict(_runs)
+        last_run = {name: dict(values) for name, values in _last_run.items()}
+
+    lines.append(f"# HELP {p}runs_total Completed runs by outcome.")
+    lines.append(f"# TYPE {p}runs_total counter")
+    for (name, outcome), value in sorted(runs.items()):
+        lines.append(f"{p}runs_total{_labels([('run', name), ('outcome', outcome)])} {value}")
+    lines.append(f"# HELP {p}last_run_seconds Duration of the latest run.")
+    lines.append(f"# TYPE {p}last_run_seconds gauge")
+    for name, values in sorted(last_run.items()):
+        lines.append(f"{p}last_run_seconds{_labels([('run', name)])} {values['seconds']:.6f}")
+    lines.append(f"# HELP {p}last_run_timestamp_seconds When the latest run finished.")
+    lines.append(f"# TYPE {p}last_run_timestamp_seconds gauge")
+    for name, values in sorted(last_run.items()):
+        lines.append(f"{p}last_run_timestamp_seconds{_labels([('run', name)])} {values['finished']:.3f}")
+
+    lines.append(f"# HELP {p}stage_seconds Wall time per stage, including external API calls.")
+    lines.append(f"# TYPE {p}stage_seconds histogram")
+    for name, values in sorted(stages.items()):
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, values['buckets']):
+            cumulative += bucket
+            lines.append(f"{p}stage_seconds_bucket{_labels([('stage', name), ('le', bound)])} {cumulative}")
+        lines.append(f"{p}stage_seconds_bucket{_labels([('stage', name), ('le', '+Inf')])} {values['calls']}")
+        lines.append(f"{p}stage_seconds_sum{_labels([('stage', name)])} {values['seconds']:.6f}")
+        lines.append(f"{p}stage_seconds_count{_labels([('stage', name)])} {values['calls']}")
+    for field, help_text in (('errors', 'Stages that raised.'), ('bytes', 'Bytes transferred per stage.'), ('records', 'Records handled per stage.')):
+        lines.append(f"# HELP {p}stage_{field}_total {help_text}")
+        lines.append(f"# TYPE {p}stage_{field}_total counter")
+        for name, values in sorted(stages.items()):
+            lines.append(f"{p}stage_{field}_total{_labels([('stage', name)])} {values[field]}")
+
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        declared = set()
+        for (name, labels), value in sorted(values.items(), key=lambda item: (item[0][0], item[0][1])):
+            metric = f"{p}{name}_total" if kind == 'counter' else f"{p}{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} {kind}")
+                declared.add(metric)
+            lines.append(f"{metric}{_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(path):
+    # Write then rename so a scraper never reads a half-written file
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        f.write(render_prometheus())
+    os.replace(temporary, path)
+
+def serve(port, host='0.0.0.0'):
+    """Serves GET /metrics on a daemon thread and returns the server."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+def reset():
+    """Clears all collected metrics."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _gauges.clear()
+        _runs.clear()
+        _last_run.clear()
@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# Durable tweet outbox in Redis:
+#   outbox:queue         list of job ids ready to post, in thread order
+#   outbox:processing:<token>  job ids taken by the publisher holding that fencing token and not yet settled
+#   outbox:publishers    set of the tokens that have a processing list
+#   outbox:retry         sorted set of job ids scored by when to retry them
+#   outbox:job:<id>      job JSON: text, reply_to (parent job id), reply_to_tweet, attempts
+#   outbox:posted        hash of job id -> tweet id, the idempotency record
+#   outbox:inflight      hash of job id -> time the post request was sent
+#   outbox:dead          hash of job id -> reason the job was given up on
+OUTBOX_QUEUE_KEY = 'outbox:queue'
+OUTBOX_PROCESSING_KEY = 'outbox:processing'  # Shared by all publishers before they took a lease; only recovered now
+OUTBOX_PROCESSING_PREFIX = 'outbox:processing:'
+OUTBOX_PUBLISHERS_KEY = 'outbox:publishers'
+OUTBOX_RETRY_KEY = 'outbox:retry'
+OUTBOX_JOB_PREFIX = 'outbox:job:'
+OUTBOX_POSTED_KEY = 'outbox:posted'
+OUTBOX_INFLIGHT_KEY = 'outbox:inflight'
+OUTBOX_DEAD_KEY = 'outbox:dead'
+OUTBOX_RATE_LIMITED_UNTIL_KEY = 'outbox:rate_limited_until'
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', 30))  # Seconds, doubled per attempt
+OUTBOX_PARENT_WAIT = 5  # Seconds to wait before checking again for a reply's parent
+JOB_TTL = 14 * 24 * 60 * 60  # Seconds to remember jobs for idempotency
+
+# Publishers drain the outbox while holding this lease (see leader.py), so however many
+# replicas run one, tweets go out one publisher at a time at the limiter's rate
+PUBLISHER_LEASE = 'publisher'
+
+# Token bucket defaults: a burst of a few tweets, then one every TWEET_INTERVAL seconds
+TWEET_BURST = int(os.getenv('TWEET_BURST', 5))
+TWEET_INTERVAL = float(os.getenv('TWEET_INTERVAL', 2))
+
+class TweetError(Exception):
+    """
+    A tweet that was certainly not created: the API refused it (status code and headers
+    attached) or the request never reached it (no status code). Safe to retry.
+    """
+
+    def __init__(self, message, status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class TokenBucket:
+    """
+    Token bucket for tweets. Refills at a steady rate up to `capacity`, and is
+    throttled further by Twitter's x-rate-limit-* / x-user-limit-24hour-* headers:
+    once a window reports nothing remaining, no token is handed out until its reset.
+    """
+
+    def __init__(self, capacity=TWEET_BURST, interval=TWEET_INTERVAL, redis_client=None):
+        self.capacity = capacity
+        self.rate = 1 / interval if interval > 0 else float('inf')
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Epoch seconds
+        self.redis_client = redis_client
+        self.lock = threading.Lock()
+        if redis_client is not None:
+            # Respect a reset time recorded by an earlier publisher
+            self.blocked_until = float(redis_client.get(OUTBOX_RATE_LIMITED_UNTIL_KEY) or 0)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        with self.lock:
+            self._refill()
+            blocked = max(0.0, self.blocked_until - time.time())
+            if self.tokens >= 1:
+                return blocked
+            return max(blocked, (1 - self.tokens) / self.rate)
+
+    def acquire(self, stop=None):
+        """Blocks until a token is available. Returns False if `stop` was set while waiting."""
+        while True:
+            delay = self.wait_time()
+            if delay <= 0:
+                with self.lock:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                continue
+            if stop is not None:
+                if stop.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+    def update_from_headers(self, headers):
+        windows = (
+            ('x-rate-limit-remaining', 'x-rate-limit-reset'),
+            ('x-user-limit-24hour-remaining', 'x-user-limit-24hour-reset'),
+            ('x-app-limit-24hour-remaining', 'x-app-limit-24hour-reset'),
+        )
+        with self.lock:
+            for remaining_header, reset_header in windows:
+                remaining = headers.get(remaining_header)
+                if remaining is None:
+                    continue
+                remaining = int(remaining)
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and headers.get(reset_header):
+                    self.blocked_until = max(self.blocked_until, float(headers[reset_header]))
+            if self.redis_client is not None and self.blocked_until > time.time():
+                self.redis_client.set(OUTBOX_RATE_LIMITED_UNTIL_KEY, self.blocked_until,
+                                      ex=int(self.blocked_until - time.time()) + 1)
+
+def job_id(key, parent):
+    return hashlib.sha1(f"{parent}\x1f{key}".encode()).hexdigest()[:20]
+
+def enqueue_posts(redis_client, posts, run_key='', reply_to_tweet=None):
+    """
+    Enqueues a thread of posts. Each post is a dict with 'text', optionally 'reply_to' (the
+    index of an earlier post in `posts`, or a job id returned by an earlier call) and
+    optionally 'key', which identifies the post instead of its text. Job ids derive from
+    run_key, the parent and the key, so re-running the same detection after a crash
+    queues nothing new. Returns the job ids in order.
+    """
+    ids = []
+    jobs = []
+    for post in posts:
+        parent = post.get('reply_to')
+        if isinstance(parent, int):
+            parent = ids[parent]
+        ids.append(job_id(post.get('key', post['text']), parent or f"{run_key}\x1f{reply_to_tweet or ''}"))
+        jobs.append({'text': post['text'], 'reply_to': parent, 'reply_to_tweet': None if parent else reply_to_tweet, 'attempts': 0})
+
+    pipe = redis_client.pipeline(transaction=False)
+    for jid, job in zip(ids, jobs):
+        pipe.set(OUTBOX_JOB_PREFIX + jid, json.dumps(job), nx=True, ex=JOB_TTL)
+    created = pipe.execute()
+
+    new_ids = [jid for jid, was_created in zip(ids, created) if was_created]
+    if new_ids:
+        redis_client.rpush(OUTBOX_QUEUE_KEY, *new_ids)
+    return ids
+
+def processing_key(token):
+    return f"{OUTBOX_PROCESSING_PREFIX}{token}"
+
+def pending_count(redis_client):
+    # Jobs ready to post or being posted; scheduled retries are not counted
+    tokens = redis_client.smembers(OUTBOX_PUBLISHERS_KEY)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.llen(OUTBOX_QUEUE_KEY)
+    pipe.llen(OUTBOX_PROCESSING_KEY)
+    for token in tokens:
+        pipe.llen(processing_key(token.decode()))
+    return sum(pipe.execute())
+
+def recover(redis_client, token):
+    """
+    Settles jobs that earlier publishers left in processing, for the publisher holding
+    the lease with fencing token `token`: any other token's lease has expired or been
+    taken over, so its jobs are not being worked on any more. Jobs already posted are
+    dropped, jobs whose post request may have gone out are given up rather than risk a
+    double post, and the rest go back to the front of the queue.
+    """
+    stale = [OUTBOX_PROCESSING_KEY] + [processing_key(other.decode()) for other in redis_client.smembers(OUTBOX_PUBLISHERS_KEY)
+                                       if other.decode() != str(token)]
+    for key in stale:
+        for raw_id in reversed(redis_client.lrange(key, 0, -1)):
+            jid = raw_id.decode()
+            if redis_client.hexists(OUTBOX_POSTED_KEY, jid):
+                pass
+            elif redis_client.hexists(OUTBOX_INFLIGHT_KEY, jid):
+                redis_client.hset(OUTBOX_DEAD_KEY, jid, 'uncertain: publisher stopped mid-request')
+                redis_client.hdel(OUTBOX_INFLIGHT_KEY, jid)
+                print(f"Outbox job {jid} may already be posted, not retrying it")
+            else:
+                redis_client.lpush(OUTBOX_QUEUE_KEY, jid)
+            redis_client.lrem(key, 1, raw_id)
+        if key != OUTBOX_PROCESSING_KEY:
+            redis_client.srem(OUTBOX_PUBLISHERS_KEY, key[len(OUTBOX_PROCESSING_PREFIX):])
+
+def _promote_due_retries(redis_client):
+    for raw_id in redis_client.zrangebyscore(OUTBOX_RETRY_KEY, '-inf', time.time()):
+        # ZREM decides which publisher gets to requeue it
+        if redis_client.zrem(OUTBOX_RETRY_KEY, raw_id):
+            redis_client.rpush(OUTBOX_QUEUE_KEY, raw_id)
+
+def _resolve_reply_target(redis_client, job):
+    """Returns (ready, tweet_id) for the tweet a job should reply to, skipping parents that were given up on."""
+    parent = job.get('reply_to')
+    while parent:
+        tweet_id = redis_client.hget(OUTBOX_POSTED_KEY, parent)
+        if tweet_id:
+            return True, tweet_id.decode()
+        if not redis_client.hexists(OUTBOX_DEAD_KEY, parent):
+            return False, None
+        parent_job = redis_client.get(OUTBOX_JOB_PREFIX + parent)
+        if parent_job is None:
+            break
+        parent_job = json.loads(parent_job)
+        if parent_job.get('reply_to_tweet'):
+            return True, parent_job['reply_to_tweet']
+        parent = parent_job.get('reply_to')
+    return True, job.get('reply_to_tweet')
+
+def _settle(redis_client, processing, raw_id, retry_at=None, dead_reason=None, posted_tweet=None, job=None):
+    jid = raw_id.decode()
+    pipe = redis_client.pipeline(transaction=True)
+    if posted_tweet is not None:
+        pipe.hset(OUTBOX_POSTED_KEY, jid, posted_tweet)
+    if dead_reason is not None:
+        pipe.hset(OUTBOX_DEAD_KEY, jid, dead_reason)
+    if retry_at is not None:
+        pipe.zadd(OUTBOX_RETRY_KEY, {jid: retry_at})
+    if job is not None:
+        pipe.set(OUTBOX_JOB_PREFIX + jid, json.dumps(job), keepttl=True)
+    pipe.hdel(OUTBOX_INFLIGHT_KEY, jid)
+    pipe.lrem(processing, 1, raw_id)
+    pipe.execute()
+
+def drain(redis_client, post, limiter, lease, block=False, stop=None, max_jobs=None):
+    """
+    Posts queued jobs in order. `post(text, in_reply_to_id)` returns (tweet_id, headers)
+    and raises TweetError on failure. `lease` is the PUBLISHER_LEASE, already acquired;
+    draining stops once it is lost. With block=True keeps waiting for new jobs until
+    `stop` is set; otherwise returns once nothing is due. Returns the number posted.
+    """
+    processing = processing_key(lease.token)
+    redis_client.sadd(OUTBOX_PUBLISHERS_KEY, lease.token)
+    recover(redis_client, lease.token)
+    posted = 0
+    while lease.held and not (stop is not None and stop.is_set()) and (max_jobs is None or posted < max_jobs):
+        _promote_due_retries(redis_client)
+        if block:
+            raw_id = redis_client.blmove(OUTBOX_QUEUE_KEY, processing, 1, 'LEFT', 'RIGHT')
+        else:
+            raw_id = redis_client.lmove(OUTBOX_QUEUE_KEY, processing, 'LEFT', 'RIGHT')
+        if raw_id is None:
+            if block:
+                continue
+            break
+
+        jid = raw_id.decode()
+        job = redis_client.get(OUTBOX_JOB_PREFIX + jid)
+        if job is None or redis_client.hexists(OUTBOX_POSTED_KEY, jid):
+            _settle(redis_client, processing, raw_id)
+            continue
+        job = json.loads(job)
+
+        ready, in_reply_to = _resolve_reply_target(redis_client, job)
+        if not ready:
+            # The parent is still waiting on a retry; come back once it may have been posted
+            _settle(redis_client, processing, raw_id, retry_at=time.time() + OUTBOX_PARENT_WAIT)
+            continue
+
+        if not limiter.acquire(stop) or not lease.held:
+            redis_client.lpush(OUTBOX_QUEUE_KEY, raw_id)
+            redis_client.lrem(processing, 1, raw_id)
+            break
+        if redis_client.hexists(OUTBOX_POSTED_KEY, jid):
+            # While this publisher waited for a token, one that hadn't yet noticed losing the lease posted it
+            _settle(redis_client, processing, raw_id)
+            continue
+
+        redis_client.hset(OUTBOX_INFLIGHT_KEY, jid, time.time())
+        try:
+            tweet_id, headers = post(job['text'], in_reply_to)
+        except TweetError as e:
+            limiter.update_from_headers(e.headers)
+            job['attempts'] += 1
+            if e.status_code and 400 <= e.status_code < 500 and e.status_code != 429:
+                print(f"Outbox job {jid} was rejected ({e}), not retrying it")
+                _settle(redis_client, processing, raw_id, dead_reason=str(e), job=job)
+            elif job['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                print(f"Giving up on outbox job {jid} after {job['attempts']} attempts: {e}")
+                _settle(redis_client, processing, raw_id, dead_reason=str(e), job=job)
+            else:
+                delay = OUTBOX_RETRY_BACKOFF * 2 ** (job['attempts'] - 1)
+                print(f"Outbox job {jid} failed ({e}), retrying in {delay:.0f}s")
+                _settle(redis_client, processing, raw_id, retry_at=time.time() + delay, job=job)
+            continue
+        except Exception as e:
+            # The request may have reached Twitter, so retrying could post twice
+            print(f"Outbox job {jid} failed with an unknown outcome ({e}), not retrying it")
+            _settle(redis_client, processing, raw_id, dead_reason=f"uncertain: {e}")
+            continue
+
+        limiter.update_from_headers(headers)
+        _settle(redis_client, processing, raw_id, posted_tweet=tweet_id)
+        posted += 1
+    return posted
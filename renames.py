@@ -0,0 +1,190 @@
+import os
+import random
+from itertools import repeat
+from operator import xor
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+from screening import normalize_name, ngrams
+from snapshot import stable_hash
+
+# Pairs removed and added names that are most likely one entry whose spelling changed
+# (transliteration, a corrected typo, a dropped legal form). Candidates come from blocking
+# keys rather than comparing every removed name with every added one: MinHash signatures
+# of the names' character trigrams, banded into LSH buckets, plus each token's consonant
+# skeleton, which survives vowel-level transliteration differences (Mohammed, Muhammad).
+# Skeletons only bring names together; whether a pair is a rename is up to its score, and
+# two records with different CSL ids are never one entry, however alike their names.
+# Records that carry ids (every feed's, today) are renamed when their name changes under
+# the same id: the diff reports those as modified, and split_renamed() takes them out.
+# Pairing removed and added names is for records without ids, such as state saved
+# before ids were kept.
+RENAME_MIN_CONFIDENCE = float(os.getenv('RENAME_MIN_CONFIDENCE', 0.85))  # Below this a pair stays a removal plus an addition
+MINHASH_BANDS = 8
+MINHASH_ROWS = 2  # Rows per band; two rows catch trigram Jaccard around 0.4 and up
+MAX_BUCKET_SIZE = 50  # Blocking keys shared by more names than this are too common to pair on
+SKELETON_MIN_LENGTH = 3
+VOWELS = set('aeiouy')
+
+# One 64-bit hash per trigram, XORed with a fixed random mask per signature position; the
+# masks reorder the hashes differently enough for LSH, at a fraction of the cost of a*h+b mod p
+_rng = random.Random(20240229)
+_MASKS = [_rng.getrandbits(64) for _ in range(MINHASH_BANDS * MINHASH_ROWS)]
+
+def minhash(grams):
+    """MinHash signature of a set of strings, one value per mask."""
+    hashes = list(map(stable_hash, grams))
+    return [min(map(xor, hashes, repeat(mask, len(hashes)))) for mask in _MASKS]
+
+def skeleton(token):
+    # Consonants only, repeats collapsed: "muhammad" and "mohammed" both become "mhmd"
+    letters = [char for char in token if char not in VOWELS]
+    return ''.join(char for i, char in enumerate(letters) if i == 0 or char != letters[i - 1])
+
+def features(name):
+    """(normalized name, its trigrams, its per-token skeletons), what similarity() compares."""
+    normalized = normalize_name(name)
+    return normalized, ngrams(normalized) if normalized else set(), tuple(map(skeleton, normalized.split()))
+
+def blocking_keys(normalized, grams, skeletons):
+    keys = set()
+    if grams:
+        signature = minhash(grams)
+        for band in range(MINHASH_BANDS):
+            keys.add(('lsh', band, tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])))
+    for token_skeleton in skeletons:
+        if len(token_skeleton) >= SKELETON_MIN_LENGTH:
+            keys.add(('skeleton', token_skeleton))
+    return keys
+
+def score(previous, current, minimum=0.0):
+    """
+    Confidence in [0, 1] that two names, as features(), are one entry: the higher of the
+    trigram Dice coefficient and the edit-based ratio. Scores below `minimum` may be
+    underestimated, which saves the edit ratio, by far the slowest part, on pairs that
+    cannot reach it.
+    """
+    (previous_text, previous_grams, _), (current_text, current_grams, _) = previous, current
+    best = 0.0
+    if previous_grams or current_grams:
+        best = 2 * len(previous_grams & current_grams) / (len(previous_grams) + len(current_grams))
+    floor = max(best, minimum)
+    lengths = len(previous_text) + len(current_text)
+    # The ratio can't beat what the shorter name's length allows (SequenceMatcher.real_quick_ratio)
+    if lengths and 2 * min(len(previous_text), len(current_text)) / lengths > floor:
+        matcher = SequenceMatcher(None, previous_text, current_text, autojunk=False)
+        if matcher.quick_ratio() > floor:
+            best = max(best, matcher.ratio())
+    return best
+
+def similarity(previous, current):
+    """score() for two raw names."""
+    return score(features(previous), features(current))
+
+def find_renames(removed, added, min_confidence=RENAME_MIN_CONFIDENCE, removed_ids=None, added_ids=None):
+    """
+    Pairs names from two lists, each name used at most once, best matches first. Returns
+    [(removed name, added name, confidence)] for pairs at or above min_confidence.
+    removed_ids and added_ids map names to CSL ids, where known; names whose ids differ
+    are never paired. Runs in roughly linear time: only names sharing a blocking key are
+    compared.
+    """
+    removed_ids, added_ids = removed_ids or {}, added_ids or {}
+    if not removed or not added:
+        return []
+    buckets = defaultdict(lambda: ([], []))
+    normalized = ({}, {})
+    for side, names in enumerate((removed, added)):
+        for name in names:
+            if name in normalized[side]:
+                continue
+            normalized[side][name] = name_features = features(name)
+            for key in blocking_keys(*name_features):
+                buckets[key][side].append(name)
+
+    scored = {}
+    for previous_names, current_names in buckets.values():
+        if not previous_names or not current_names or len(previous_names) + len(current_names) > MAX_BUCKET_SIZE:
+            continue
+        for previous in previous_names:
+            previous_id = removed_ids.get(previous)
+            for current in current_names:
+                current_id = added_ids.get(current)
+                if previous_id and current_id and previous_id != current_id:
+                    continue
+                if (previous, current) not in scored:
+                    scored[(previous, current)] = score(normalized[0][previous], normalized[1][current], min_confidence)
+
+    pairs = []
+    paired_previous, paired_current = set(), set()
+    for (previous, current), confidence in sorted(scored.items(), key=lambda item: -item[1]):
+        if confidence < min_confidence:
+            break
+        if previous in paired_previous or current in paired_current:
+            continue
+        paired_previous.add(previous)
+        paired_current.add(current)
+        pairs.append((previous, current, round(confidence, 3)))
+    return pairs
+
+def _without(names, paired):
+    # Drops one occurrence of each paired name, keeping the list's order
+    pending = Counter(paired)
+    kept = []
+    for name in names:
+        if pending[name]:
+            pending[name] -= 1
+        else:
+            kept.append(name)
+    return kept
+
+def split_renamed(modified):
+    """
+    Moves records whose name changed under the same id out of a diff's modified set
+    ({source: [entries]}) as renames, scored like reconcile's pairs. Records that moved to
+    another source stay modified. Returns (modified, renamed), renamed entries carrying
+    'name', 'previous_name', 'confidence', 'id' and 'fields'. The input is left untouched.
+    """
+    kept, renamed = {}, {}
+    for source, entries in modified.items():
+        for entry in entries:
+            previous = entry.get('previous_name')
+            if previous is None or previous == entry['name'] or entry.get('previous_source', source) != source:
+                kept.setdefault(source, []).append(entry)
+                continue
+            renamed.setdefault(source, []).append({
+                'name': entry['name'],
+                'previous_name': previous,
+                'confidence': round(score(features(previous), features(entry['name'])), 3),
+                'id': entry.get('id'),
+                'fields': entry['fields'],
+            })
+    return kept, renamed
+
+def reconcile(added, removed, min_confidence=RENAME_MIN_CONFIDENCE, added_ids=None, removed_ids=None):
+    """
+    Moves likely renames out of a diff's {source: [names]} added and removed sets, pairing
+    only within a source. added_ids and removed_ids are the diff's {(source, name): id}
+    maps; records whose ids differ are never paired. Returns (added, removed, renamed),
+    where renamed is {source: [{'name', 'previous_name', 'confidence'}]}. The inputs are
+    left untouched.
+    """
+    added_ids, removed_ids = added_ids or {}, removed_ids or {}
+    added = {source: list(names) for source, names in added.items()}
+    removed = {source: list(names) for source, names in removed.items()}
+    renamed = {}
+    for source in added.keys() & removed.keys():
+        pairs = find_renames(
+            removed[source], added[source], min_confidence,
+            {name: record_id for (id_source, name), record_id in removed_ids.items() if id_source == source},
+            {name: record_id for (id_source, name), record_id in added_ids.items() if id_source == source},
+        )
+        if not pairs:
+            continue
+        renamed[source] = [{'name': current, 'previous_name': previous, 'confidence': confidence}
+                           for previous, current, confidence in pairs]
+        removed[source] = _without(removed[source], [previous for previous, _, _ in pairs])
+        added[source] = _without(added[source], [current for _, current, _ in pairs])
+    added = {source: names for source, names in added.items() if names}
+    removed = {source: names for source, names in removed.items() if names}
+    return added, removed, renamed
@@ -0,0 +1,255 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app
+import feeds
+import renames
+from snapshot import CompactSnapshot
+
+# Offline replay of archived list snapshots into a change history. Adjacent snapshots
+# are diffed with the same diff_records the live check uses, in a process pool, and
+# respelled entries are paired up with renames.reconcile as in the live check.
+#
+#   python replay.py archive/                      # build replay_results/changes.jsonl and history.json
+#   python replay.py archive/                      # again after an interruption: only missing pairs run
+#   python replay.py archive/ --verify             # re-diff everything and compare with the recorded log
+#   python replay.py archive/ --format ofac-sdn-xml --source "OFAC SDN List"
+#
+# Snapshots are ordered by the date in their file name (20240131, 2024-01-31T06:00:00...)
+# and by modification time when there is none. Files may be gzipped.
+
+RESULTS_DIR = 'replay_results'
+CHANGES_FILE = 'changes.jsonl'  # One line per adjacent pair, appended as pairs finish
+HISTORY_FILE = 'history.json'  # Per source and name, when it was added, removed, modified or renamed
+PAIRS_PER_TASK = 16  # Adjacent pairs per worker task; each task parses one extra snapshot
+SNAPSHOT_PATTERN = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})(?:[T_ -]?(\d{2}):?(\d{2})(?::?(\d{2}))?)?')
+SNAPSHOT_SUFFIXES = ('.json', '.json.gz', '.xml', '.xml.gz')
+CHANGE_KINDS = ('added', 'removed', 'modified', 'renamed')
+
+def snapshot_time(path):
+    match = SNAPSHOT_PATTERN.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime(*(int(part or 0) for part in match.groups()), tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+
+def list_snapshots(directory):
+    """Snapshot files in the directory as [{'name', 'path', 'at'}], oldest first."""
+    snapshots = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(SNAPSHOT_SUFFIXES) and os.path.isfile(path):
+            snapshots.append({'name': name, 'path': path, 'at': snapshot_time(path).isoformat()})
+    snapshots.sort(key=lambda snapshot: (snapshot['at'], snapshot['name']))
+    return snapshots
+
+def load_snapshot(path, format, source):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return CompactSnapshot.from_records(feeds.FORMATS[format](feeds.iter_file_chunks(f), feeds.reusing_projector((format, source)), source))
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+def change_entry(previous, current, changes, records):
+    entry = {'from': previous['name'], 'to': current['name'], 'at': current['at'], 'records': records}
+    for kind in CHANGE_KINDS:
+        if changes.get(kind):
+            entry[kind] = {source: sorted(entries, key=str) for source, entries in sorted(changes[kind].items())}
+    return entry
+
+def diff_run(snapshots, format, source):
+    """
+    Worker: walks a run of adjacent snapshots, parsing each once, and returns the change
+    entry for every adjacent pair in it.
+    """
+    entries = []
+    previous_records = None
+    for i, snapshot in enumerate(snapshots):
+        records = load_snapshot(snapshot['path'], format, source)
+        if previous_records is not None:
+            changes = app.diff_records(previous_records, records)
+            if app.RENAME_DETECTION:
+                changes['modified'], changes['renamed'] = renames.split_renamed(changes['modified'])
+            if app.RENAME_DETECTION and changes['added'] and changes['removed']:
+                changes['added'], changes['removed'], paired = renames.reconcile(
+                    changes['added'], changes['removed'], added_ids=changes['added_ids'], removed_ids=changes['removed_ids'])
+                for source, entries in paired.items():
+                    changes['renamed'].setdefault(source, []).extend(entries)
+            entries.append(change_entry(snapshots[i - 1], snapshot, changes, len(records)))
+        previous_records = records
+    return entries
+
+def pair_key(entry):
+    return entry['from'], entry['to']
+
+def read_changes(path):
+    """Recorded entries by (from, to). A line cut short by an interruption is ignored."""
+    recorded = {}
+    if not os.path.exists(path):
+        return recorded
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            recorded[pair_key(entry)] = entry
+    return recorded
+
+def pending_runs(snapshots, done, pairs_per_task=PAIRS_PER_TASK):
+    """Groups the pairs not in `done` into runs of adjacent snapshots, at most pairs_per_task pairs each."""
+    runs = []
+    current = []
+    for previous, snapshot in zip(snapshots, snapshots[1:]):
+        if (previous['name'], snapshot['name']) in done:
+            if current:
+                runs.append(current)
+            current = []
+            continue
+        if not current:
+            current = [previous]
+        current.append(snapshot)
+        if len(current) > pairs_per_task:
+            runs.append(current)
+            current = []
+    if current:
+        runs.append(current)
+    return runs
+
+def replay(snapshots, format, source, workers=None, done=(), on_entries=None):
+    """
+    Diffs every adjacent pair not in `done` and returns the new entries. on_entries is
+    called with each finished task's entries, in completion order.
+    """
+    runs = pending_runs(snapshots, set(done))
+    found = []
+    if not runs:
+        return found
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(diff_run, run, format, source) for run in runs]
+        try:
+            for future in as_completed(futures):
+                entries = future.result()
+                found.extend(entries)
+                if on_entries is not None:
+                    on_entries(entries)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return found
+
+def build_history(entries):
+    """{source: {name: [[at, kind], ...]}} from change entries, oldest first."""
+    history = {}
+    for entry in sorted(entries, key=lambda entry: entry['at']):
+        for kind in CHANGE_KINDS:
+            for source, items in entry.get(kind, {}).items():
+                names = history.setdefault(source, {})
+                for item in items:
+                    name = item if isinstance(item, str) else item['name']
+                    names.setdefault(name, []).append([entry['at'], kind])
+                    if kind == 'renamed':
+                        # The old name's history ends with the rename too
+                        names.setdefault(item['previous_name'], []).append([entry['at'], kind])
+    return history
+
+def compare_entries(expected, actual):
+    """Pairs whose recorded and re-computed changes differ, with a short reason for each."""
+    mismatches = []
+    for key, entry in actual.items():
+        recorded = expected.get(key)
+        if recorded is None:
+            mismatches.append((key, 'not in the recorded log'))
+            continue
+        for kind in CHANGE_KINDS:
+            if recorded.get(kind, {}) != entry.get(kind, {}):
+                count = lambda changes: sum(len(items) for items in changes.get(kind, {}).values())
+                mismatches.append((key, f"{kind}: recorded {count(recorded)}, now {count(entry)}"))
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay archived list snapshots into a change history.")
+    parser.add_argument('directory', help="directory of archived snapshots")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--format', default='csl-json', choices=sorted(feeds.FORMATS))
+    parser.add_argument('--source', help="source label for formats whose entries carry none (the XML feeds)")
+    parser.add_argument('--workers', type=int, help="parser processes (default: one per CPU)")
+    parser.add_argument('--limit', type=int, help="only replay the first N snapshots")
+    parser.add_argument('--verify', action='store_true',
+                        help="re-diff every pair and compare with the recorded log instead of extending it")
+    args = parser.parse_args(argv)
+
+    snapshots = list_snapshots(args.directory)[:args.limit]
+    if len(snapshots) < 2:
+        print(f"Need at least two snapshots in {args.directory}, found {len(snapshots)}.")
+        return 1
+    source = args.source or next((feed.source for feed in feeds.FEEDS.values() if feed.format == args.format), None)
+    changes_path = os.path.join(args.results_dir, CHANGES_FILE)
+    recorded = read_changes(changes_path)
+    started = time.perf_counter()
+
+    if args.verify:
+        actual = {pair_key(entry): entry for entry in replay(snapshots, args.format, source, args.workers)}
+        mismatches = compare_entries(recorded, actual)
+        print(f"Re-diffed {len(actual)} pairs in {time.perf_counter() - started:.1f}s")
+        if not mismatches:
+            print(f"All pairs match {changes_path}.")
+            return 0
+        print(f"{len(mismatches)} pair(s) differ from {changes_path}:")
+        for (previous, current), reason in mismatches:
+            print(f"  {previous} -> {current}: {reason}")
+        return 1
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    pairs = set(zip((snapshot['name'] for snapshot in snapshots), (snapshot['name'] for snapshot in snapshots[1:])))
+    done = pairs & recorded.keys()
+    if done:
+        print(f"Resuming: {len(done)} of {len(pairs)} pairs already in {changes_path}")
+
+    with open(changes_path, 'a') as log:
+        if log.tell() and not _ends_with_newline(changes_path):
+            # The last run was interrupted mid-line
+            log.write('\n')
+
+        def write(entries):
+            for entry in entries:
+                log.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            log.flush()
+            recorded.update((pair_key(entry), entry) for entry in entries)
+
+        try:
+            new = replay(snapshots, args.format, source, args.workers, done, write)
+        except KeyboardInterrupt:
+            print(f"Interrupted; {len(recorded.keys() & pairs)} of {len(pairs)} pairs saved. Run again to resume.")
+            return 130
+
+    # Only pairs that are adjacent in the current set of snapshots make up the history
+    entries = [recorded[key] for key in pairs]
+    history_path = os.path.join(args.results_dir, HISTORY_FILE)
+    with open(history_path, 'w') as f:
+        json.dump(build_history(entries), f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+    totals = {kind: sum(len(items) for entry in entries for items in entry.get(kind, {}).values())
+              for kind in CHANGE_KINDS}
+    elapsed = time.perf_counter() - started
+    print(f"Diffed {len(new)} pairs in {elapsed:.1f}s ({len(pairs) - len(new)} already done); "
+          f"{totals['added']} added, {totals['removed']} removed, {totals['modified']} modified, "
+          f"{totals['renamed']} renamed over {len(snapshots)} snapshots")
+    print(f"Wrote {changes_path} and {history_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import os
+import time
+import random
+import signal
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Adaptive polling: faster during US business hours and right after a change, slower overnight
+BUSINESS_HOURS_INTERVAL = float(os.getenv('BUSINESS_HOURS_INTERVAL', 5 * 60))  # Seconds
+OFF_HOURS_INTERVAL = float(os.getenv('OFF_HOURS_INTERVAL', 30 * 60))
+AFTER_CHANGE_INTERVAL = float(os.getenv('AFTER_CHANGE_INTERVAL', 60))
+AFTER_CHANGE_WINDOW = float(os.getenv('AFTER_CHANGE_WINDOW', 60 * 60))  # Seconds of fast polling after a change
+POLL_JITTER = float(os.getenv('POLL_JITTER', 0.1))  # +/- fraction of the interval
+BUSINESS_TIMEZONE = ZoneInfo('America/New_York')
+BUSINESS_HOURS = (7, 20)  # Local hours, weekdays; Treasury and Commerce publish in this window
+
+def is_business_hours(now=None):
+    now = (now or datetime.now(BUSINESS_TIMEZONE)).astimezone(BUSINESS_TIMEZONE)
+    return now.weekday() < 5 and BUSINESS_HOURS[0] <= now.hour < BUSINESS_HOURS[1]
+
+def poll_interval(last_change_at=None, now=None, rng=random):
+    """Seconds until the next poll, with jitter so replicas and retries don't line up."""
+    now = now or time.time()
+    if last_change_at is not None and now - last_change_at < AFTER_CHANGE_WINDOW:
+        base = AFTER_CHANGE_INTERVAL
+    elif is_business_hours(datetime.fromtimestamp(now, BUSINESS_TIMEZONE)):
+        base = BUSINESS_HOURS_INTERVAL
+    else:
+        base = OFF_HOURS_INTERVAL
+    return base * (1 + rng.uniform(-POLL_JITTER, POLL_JITTER))
+
+def install_signal_handlers(stop):
+    def handle(signum, frame):
+        print(f"Received {signal.Signals(signum).name}, finishing the current tick and shutting down")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+
+def run_forever(tick, stop=None, interval=poll_interval):
+    """
+    Calls tick() until `stop` is set, sleeping poll_interval() between calls. tick returns
+    True when it found a change, which switches to fast polling for AFTER_CHANGE_WINDOW.
+    A failing tick is logged and retried on the normal schedule.
+    """
+    stop = stop or threading.Event()
+    last_change_at = None
+    while not stop.is_set():
+        try:
+            if tick():
+                last_change_at = time.time()
+        except Exception as e:
+            print(f"Scheduled check failed: {e}")
+        delay = interval(last_change_at)
+        print(f"Next check in {delay:.0f}s")
+        stop.wait(delay)
+    return stop
@@ -0,0 +1,300 @@
+import json
+import math
+import time
+import heapq
+import threading
+import unicodedata
+from itertools import chain, compress
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+NGRAM_SIZE = 3
+DEFAULT_LIMIT = 10
+DEFAULT_MIN_SCORE = 0.35
+MAX_LIMIT = 1000
+LANE_FRACTION = 64  # Grams held by this share of entries or more are counted from lanes, not postings
+LANE_MIN_POSTING = 256
+MAX_QUERY_GRAMS = 127  # A count byte holds up to 127 plus the bias
+SCORE_STEPS = (0.5, 0.6, 0.7, 0.8, 0.9, 1.0)  # Bars a query with many matches tries on the way to its best `limit`
+BIAS_CACHE_SIZE = 64
+EMPTY = frozenset()
+
+# Letters that NFKD does not decompose, plus Cyrillic and Greek, mapped to Latin
+TRANSLITERATION = {
+    'ß': 'ss', 'æ': 'ae', 'œ': 'oe', 'ø': 'o', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ı': 'i', 'ħ': 'h',
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya', 'і': 'i', 'ї': 'yi', 'є': 'ye', 'ґ': 'g', 'ў': 'u',
+    'α': 'a', 'β': 'v', 'γ': 'g', 'δ': 'd', 'ε': 'e', 'ζ': 'z', 'η': 'i', 'θ': 'th', 'ι': 'i', 'κ': 'k',
+    'λ': 'l', 'μ': 'm', 'ν': 'n', 'ξ': 'x', 'ο': 'o', 'π': 'p', 'ρ': 'r', 'σ': 's', 'ς': 's', 'τ': 't',
+    'υ': 'y', 'φ': 'f', 'χ': 'ch', 'ψ': 'ps', 'ω': 'o',
+}
+
+# Legal-form words that say nothing about who an entity is
+STOP_TOKENS = {
+    'llc', 'ltd', 'limited', 'inc', 'co', 'corp', 'company', 'jsc', 'ojsc', 'pjsc', 'cjsc', 'ooo', 'oao', 'zao',
+    'gmbh', 'ag', 'sa', 'srl', 'bv', 'fze', 'fzco', 'plc', 'llp', 'the', 'of', 'and',
+}
+
+def normalize_name(name):
+    """Casefolds, transliterates to Latin, strips accents and punctuation, and drops legal-form words."""
+    text = unicodedata.normalize('NFKD', name.casefold())
+    letters = []
+    for char in text:
+        if unicodedata.combining(char):
+            continue
+        char = TRANSLITERATION.get(char, char)
+        letters.append(char if char.isalnum() else ' ')
+    tokens = ''.join(letters).split()
+    meaningful = [token for token in tokens if token not in STOP_TOKENS]
+    return ' '.join(meaningful or tokens)
+
+def ngrams(normalized):
+    padded = f" {normalized} "
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+class ScreeningIndex:
+    """
+    Character n-gram inverted index over (source, name) entries for fuzzy name screening,
+    ranked by the Dice coefficient of gram sets. Exact (normalized) names are looked up
+    directly. Every other entry sharing enough grams with the query to reach min_score is
+    a candidate: rare grams are counted from their postings, and common grams, whose
+    postings would take most of the time, from lanes (see _refresh_lanes). Entries can be
+    added and removed incrementally.
+    """
+
+    def __init__(self):
+        self.entries = {}  # entry id -> (source, name, normalized name, gram count)
+        self.ids = {}  # (source, name) -> entry id
+        self.exact = defaultdict(set)  # normalized name -> entry ids
+        self.postings = defaultdict(set)  # gram -> entry ids
+        self.lanes = {}  # common gram -> int with byte i set to 1 if entry i holds it
+        self.lengths = bytearray()  # entry id -> gram count (capped at 255), 0 for a free id
+        self.stale = set()  # grams whose lane may be out of date
+        self.free_ids = []  # ids of removed entries, reused so lanes stay dense
+        self.bias_cache = {}
+        self.next_id = 0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_records(cls, records):
+        return cls.from_names((item['source'], item['name']) for item in records)
+
+    @classmethod
+    def from_names(cls, pairs):
+        """Builds an index from (source, name) pairs, e.g. CompactSnapshot.iter_names()."""
+        index = cls()
+        for source, name in pairs:
+            index.add(source, name)
+        index._refresh_lanes()
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, source, name):
+        with self.lock:
+            if (source, name) in self.ids:
+                return
+            if self.free_ids:
+                entry_id = self.free_ids.pop()
+            else:
+                entry_id = self.next_id
+                self.next_id += 1
+                self.lengths.append(0)
+            normalized = normalize_name(name)
+            grams = ngrams(normalized)
+            self.entries[entry_id] = (source, name, normalized, len(grams))
+            self.ids[(source, name)] = entry_id
+            self.exact[normalized].add(entry_id)
+            self.lengths[entry_id] = min(len(grams), 255)
+            for gram in grams:
+                self.postings[gram].add(entry_id)
+            self.stale.update(grams)
+            self.bias_cache.clear()
+
+    def remove(self, source, name):
+        with self.lock:
+            entry_id = self.ids.pop((source, name), None)
+            if entry_id is None:
+                return
+            _, _, normalized, _ = self.entries.pop(entry_id)
+            same_name = self.exact[normalized]
+            same_name.discard(entry_id)
+            if not same_name:
+                del self.exact[normalized]
+            grams = ngrams(normalized)
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is not None:
+                    posting.discard(entry_id)
+                    if not posting:
+                        del self.postings[gram]
+            self.lengths[entry_id] = 0
+            self.free_ids.append(entry_id)
+            self.stale.update(grams)
+            self.bias_cache.clear()
+
+    def apply_changes(self, added, removed):
+        """Applies one run's {source: [names]} added and removed sets."""
+        with self.lock:
+            for source, names in removed.items():
+                for name in names:
+                    self.remove(source, name)
+            for source, names in added.items():
+                for name in names:
+                    self.add(source, name)
+            self._refresh_lanes()
+
+    def _refresh_lanes(self):
+        """
+        Rebuilds the lanes of grams touched since the last refresh. A gram held by at least
+        1/LANE_FRACTION of the entries gets a lane: its posting as a big int with one byte per
+        entry id, so a query adds up its common grams' counts for every entry at once
+        instead of walking their postings. It keeps the lane until it drops to half that.
+        """
+        if not self.stale:
+            return
+        threshold = max(LANE_MIN_POSTING, self.next_id // LANE_FRACTION)
+        for gram in self.stale:
+            posting = self.postings.get(gram, EMPTY)
+            if len(posting) < (threshold // 2 if gram in self.lanes else threshold):
+                self.lanes.pop(gram, None)
+                continue
+            lane = bytearray(self.next_id)
+            for entry_id in posting:
+                lane[entry_id] = 1
+            self.lanes[gram] = int.from_bytes(lane, 'little')
+        self.stale.clear()
+
+    def _bias(self, size, min_score):
+        """
+        One byte per entry id holding 128 minus the grams the entry must share with a query
+        of `size` grams to reach min_score (0 if it can't), so adding its overlap sets the
+        byte's top bit exactly when it matches; returned with the mask of those top bits.
+        """
+        key = (size, min_score)
+        bias = self.bias_cache.get(key)
+        if bias is None:
+            if len(self.bias_cache) >= BIAS_CACHE_SIZE:
+                self.bias_cache.clear()
+            table = bytearray(256)
+            for gram_count in range(1, 256):
+                required = max(1, math.ceil(min_score * (size + gram_count) / 2 - 1e-9))
+                if required <= min(size, gram_count):
+                    table[gram_count] = 128 - required
+            high = int.from_bytes(b'\x80' * len(self.lengths), 'little')
+            bias = self.bias_cache[key] = (int.from_bytes(self.lengths.translate(table), 'little'), high)
+        return bias
+
+    def search(self, query, limit=DEFAULT_LIMIT, min_score=DEFAULT_MIN_SCORE):
+        """Returns up to `limit` matches as dicts with source, name and score (0-1), best first."""
+        normalized = normalize_name(query)
+        query_grams = ngrams(normalized)
+        if not normalized:
+            return []
+
+        with self.lock:
+            self._refresh_lanes()
+            size = len(query_grams)
+            scores = {entry_id: 1.0 for entry_id in self.exact.get(normalized, ())}
+            if size > MAX_QUERY_GRAMS:
+                # Too long for a byte per count: count every posting instead
+                overlaps = Counter(chain.from_iterable(self.postings.get(gram, EMPTY) for gram in query_grams))
+                required = math.ceil(min_score * size / (2 - min_score) - 1e-9)
+                for entry_id in compress(overlaps.keys(), map(required.__le__, overlaps.values())):
+                    self._score(scores, entry_id, overlaps[entry_id], size, min_score)
+            else:
+                # Each entry's overlap with the query in its own byte: rare grams counted from
+                # their postings, common ones added from their lanes all at once
+                counts = bytearray(self.next_id)
+                lanes = []
+                for gram in query_grams:
+                    lane = self.lanes.get(gram)
+                    if lane is not None:
+                        lanes.append(lane)
+                    else:
+                        for entry_id in self.postings.get(gram, EMPTY):
+                            counts[entry_id] += 1
+                total = sum(lanes, int.from_bytes(counts, 'little'))
+                bias, high = self._bias(size, min_score)
+                hits = (total + bias) & high
+                # Only the best `limit` are returned: while many more entries match, raise the
+                # bar as long as `limit` still clear it, which costs a bit count per step
+                for floor in SCORE_STEPS:
+                    if hits.bit_count() <= limit * 4:
+                        break
+                    if floor > min_score:
+                        narrower = (total + self._bias(size, floor)[0]) & high
+                        if narrower.bit_count() < limit:
+                            break
+                        hits = narrower
+                overlaps = total.to_bytes(self.next_id, 'little')
+                hits = hits.to_bytes(self.next_id, 'little')
+                entry_id = hits.find(0x80)
+                while entry_id != -1:
+                    self._score(scores, entry_id, overlaps[entry_id], size, min_score)
+                    entry_id = hits.find(0x80, entry_id + 1)
+
+            best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], self.entries[item[0]][1]))
+            return [{'source': self.entries[entry_id][0], 'name': self.entries[entry_id][1], 'score': round(score, 3)}
+                    for entry_id, score in best]
+
+    def _score(self, scores, entry_id, overlap, size, min_score):
+        if entry_id in scores:
+            return
+        score = 2 * overlap / (size + self.entries[entry_id][3])
+        if score >= min_score:
+            scores[entry_id] = score
+
+def make_handler(index):
+    class ScreeningHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = parse_qs(url.query)
+            if url.path == '/health':
+                self._reply(200, {'entries': len(index)})
+                return
+            if url.path != '/screen' or not params.get('q'):
+                self._reply(400, {'error': 'use /screen?q=<name>[&limit=10&min_score=0.35]'})
+                return
+            try:
+                limit = int(params.get('limit', [DEFAULT_LIMIT])[0])
+                min_score = float(params.get('min_score', [DEFAULT_MIN_SCORE])[0])
+            except ValueError:
+                limit = min_score = None
+            if limit is None or not 1 <= limit <= MAX_LIMIT or not 0 <= min_score <= 1:
+                self._reply(400, {'error': f"limit must be an integer from 1 to {MAX_LIMIT} and min_score a number from 0 to 1"})
+                return
+            start = time.perf_counter()
+            matches = index.search(params['q'][0], limit=limit, min_score=min_score)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._reply(200, {'query': params['q'][0], 'matches': matches, 'elapsed_ms': round(elapsed_ms, 3)})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScreeningHandler
+
+def serve(index, host='127.0.0.1', port=8080, background=False):
+    """Serves GET /screen?q=<name> over HTTP. With background=True runs on a daemon thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(index))
+    print(f"Screening {len(index)} entries on http://{host}:{port}/screen?q=<name>")
+    if background:
+        threading.Thread(target=server.serve_forever, name='screening', daemon=True).start()
+        return server
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return server
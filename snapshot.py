@@ -0,0 +1,244 @@
+import hashlib
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import compress
+from operator import not_, xor
+
+# Column-wise storage for list snapshots. A list of projected record dicts costs about
+# 600 bytes per record (the dict, its keys and five strings); these columns take about
+# a fifth of that, and can be pickled between processes as a handful of buffers.
+IDENTITY_SEPARATOR = '\x1f'
+
+def stable_hash(text):
+    # 64 bits, stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+class CompactSnapshot:
+    """
+    Projected records held in columns: sources interned to small ids, names and ids
+    UTF-8 encoded into one buffer each with an offset array, fingerprints as 64-bit ints,
+    per-field hashes packed into one buffer, and a 64-bit hash of each record's identity.
+    The fingerprint is kept folded into that hash ('digests': identity hash XOR
+    fingerprint), so one column tells both whether a record is there and whether it
+    changed. Iterating yields the usual record dicts; iter_names(), find() and diff() work on the
+    columns without building them.
+    """
+
+    __slots__ = ('sources', 'source_ids', 'names', 'name_offsets', 'ids', 'id_offsets',
+                 'digests', 'fhs', 'fh_size', 'keys', 'keyed_by_id', '_sorted', '_unique')
+
+    def __init__(self):
+        self.sources = []
+        self.source_ids = array('H')
+        self.names = b''
+        self.name_offsets = array('I', [0])
+        self.ids = b''
+        self.id_offsets = array('I', [0])
+        self.fhs = b''
+        self.fh_size = 0
+        self.keys = array('Q')
+        self.digests = array('Q')
+        self.keyed_by_id = False  # Identity is the id when every record has one, else source and name
+        self._sorted = None
+        self._unique = None
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds a snapshot from projected record dicts; `records` may be a generator."""
+        snapshot = cls()
+        source_index = {}
+        names = bytearray()
+        ids = bytearray()
+        fhs = []
+        record_ids = []
+        fps = array('Q')  # 0 for records saved before fingerprints existed
+        for item in records:
+            source = item['source']
+            source_id = source_index.get(source)
+            if source_id is None:
+                source_id = source_index[source] = len(snapshot.sources)
+                snapshot.sources.append(source)
+            snapshot.source_ids.append(source_id)
+            names += item['name'].encode()
+            snapshot.name_offsets.append(len(names))
+            record_id = item.get('id') or ''
+            record_ids.append(record_id)
+            ids += record_id.encode()
+            snapshot.id_offsets.append(len(ids))
+            fh = bytes.fromhex(item['fh']) if item.get('fp') else None
+            fps.append(int(item['fp'], 16) if fh else 0)
+            fhs.append(fh)
+        snapshot.names = bytes(names)
+        snapshot.ids = bytes(ids)
+        snapshot.fh_size = next((len(fh) for fh in fhs if fh), 0)
+        padding = bytes(snapshot.fh_size)
+        snapshot.fhs = b''.join(fh or padding for fh in fhs)
+
+        snapshot.keyed_by_id = all(record_ids)
+        if snapshot.keyed_by_id:
+            snapshot.keys = array('Q', map(stable_hash, record_ids))
+        else:
+            snapshot.keys = array('Q', (stable_hash(f"{source}{IDENTITY_SEPARATOR}{name}") for source, name in snapshot.iter_names()))
+        snapshot.digests = array('Q', map(xor, snapshot.keys, fps))
+        return snapshot
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def source(self, i):
+        return self.sources[self.source_ids[i]]
+
+    def name(self, i):
+        return self.names[self.name_offsets[i]:self.name_offsets[i + 1]].decode()
+
+    def record_id(self, i):
+        return self.ids[self.id_offsets[i]:self.id_offsets[i + 1]].decode() or None
+
+    def fh(self, i):
+        return self.fhs[i * self.fh_size:(i + 1) * self.fh_size]
+
+    def fp(self, i):
+        return self.keys[i] ^ self.digests[i]
+
+    def identity(self, i):
+        # Same as app.record_identity, under this snapshot's keying
+        if self.keyed_by_id:
+            return self.record_id(i)
+        return (self.source(i), self.name(i))
+
+    def record(self, i):
+        record = {'source': self.source(i), 'name': self.name(i), 'id': self.record_id(i)}
+        fp = self.fp(i)
+        if fp:
+            record['fp'] = f"{fp:016x}"
+            record['fh'] = self.fh(i).hex()
+        return record
+
+    def __iter__(self):
+        return map(self.record, range(len(self)))
+
+    def iter_names(self):
+        """(source, name) of every record, in order."""
+        sources, source_ids, names, offsets = self.sources, self.source_ids, self.names, self.name_offsets
+        for i in range(len(source_ids)):
+            yield sources[source_ids[i]], names[offsets[i]:offsets[i + 1]].decode()
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the columns."""
+        columns = (self.source_ids, self.name_offsets, self.id_offsets, self.keys, self.digests)
+        return (sum(column.itemsize * len(column) for column in columns)
+                + len(self.names) + len(self.ids) + len(self.fhs) + sum(len(source) for source in self.sources))
+
+    def keyed_by_name(self):
+        """This snapshot with identity keyed on source and name, sharing the other columns."""
+        if not self.keyed_by_id:
+            return self
+        snapshot = CompactSnapshot()
+        for slot in ('sources', 'source_ids', 'names', 'name_offsets', 'ids', 'id_offsets', 'fhs', 'fh_size'):
+            setattr(snapshot, slot, getattr(self, slot))
+        snapshot.keys = array('Q', (stable_hash(f"{source}{IDENTITY_SEPARATOR}{name}") for source, name in self.iter_names()))
+        snapshot.digests = array('Q', map(xor, snapshot.keys, map(xor, self.keys, self.digests)))
+        return snapshot
+
+    def find(self, identity):
+        """Position of the record with this identity (an id, or a (source, name) pair), or None."""
+        if self._sorted is None:
+            # Built on first use: identity hashes in order, and where each one came from
+            order = array('I', sorted(range(len(self.keys)), key=self.keys.__getitem__))
+            self._sorted = (array('Q', (self.keys[i] for i in order)), order)
+        sorted_keys, order = self._sorted
+        if isinstance(identity, tuple):
+            if self.keyed_by_id:
+                return next((i for i in range(len(self)) if (self.source(i), self.name(i)) == identity), None)
+            key = stable_hash(IDENTITY_SEPARATOR.join(identity))
+        else:
+            key = stable_hash(identity)
+        position = bisect_left(sorted_keys, key)
+        while position < len(sorted_keys) and sorted_keys[position] == key:
+            if self.identity(order[position]) == identity:
+                return order[position]
+            position += 1
+        return None
+
+    def get(self, identity):
+        i = self.find(identity)
+        return None if i is None else self.record(i)
+
+    def has_unique_identities(self):
+        if self._unique is None:
+            self._unique = len(set(self.keys)) == len(self.keys)
+        return self._unique
+
+    def diff(self, current, fields):
+        """
+        Diffs this (previous) snapshot against `current`, with the same result as
+        app.diff_records on the record dicts. Records whose identity hash and fingerprint
+        both match are dropped with set operations on the columns, so only changed records
+        are ever decoded. `fields` names the per-field hashes, for modified records.
+        Requires unique identities on both sides (see has_unique_identities).
+        """
+        previous = self
+        if previous.keyed_by_id != current.keyed_by_id:
+            previous, current = previous.keyed_by_name(), current.keyed_by_name()
+        added = defaultdict(list)
+        removed = defaultdict(list)
+        modified = defaultdict(list)
+        added_ids, removed_ids = {}, {}
+        changes = {'added': added, 'removed': removed, 'modified': modified, 'added_ids': added_ids, 'removed_ids': removed_ids}
+        if previous.digests == current.digests:
+            return changes
+
+        # Positions of the records that are not in the other snapshot unchanged
+        unchanged = set(previous.digests).intersection(current.digests)
+        previous_positions = compress(range(len(previous)), map(not_, map(unchanged.__contains__, previous.digests)))
+        current_positions = compress(range(len(current)), map(not_, map(unchanged.__contains__, current.digests)))
+        del unchanged
+
+        previous_keys, current_keys = previous.keys, current.keys
+        candidates = {previous_keys[i]: i for i in previous_positions}
+        for j in current_positions:
+            i = candidates.pop(current_keys[j], None)
+            if i is not None and previous.identity(i) != current.identity(j):
+                # Two identities sharing a 64-bit hash: unrelated records
+                candidates[previous_keys[i]] = i
+                i = None
+            source, name = current.source(j), current.name(j)
+            if i is None:
+                added[source].append(name)
+                record_id = current.record_id(j)
+                if record_id:
+                    added_ids[(source, name)] = record_id
+                continue
+            old_fp, new_fp = previous.fp(i), current.fp(j)
+            if old_fp and new_fp and old_fp != new_fp:
+                entry = {'name': name, 'id': current.record_id(j), 'fields': changed_fields(previous.fh(i), current.fh(j), fields)}
+                if (previous.source(i), previous.name(i)) != (source, name):
+                    entry['previous_source'] = previous.source(i)
+                    entry['previous_name'] = previous.name(i)
+                modified[source].append(entry)
+
+        for i in candidates.values():
+            source, name = previous.source(i), previous.name(i)
+            removed[source].append(name)
+            record_id = previous.record_id(i)
+            if record_id:
+                removed_ids[(source, name)] = record_id
+        return changes
+
+def changed_fields(previous_fh, current_fh, fields):
+    """
+    Names of the fields whose hashes differ between two packed fh values, either the
+    hex strings of record dicts or a snapshot's bytes: one equal-width slot per field.
+    """
+    width = len(current_fh) // len(fields)
+    changed = [field for i, field in enumerate(fields)
+               if previous_fh[width * i:width * (i + 1)] != current_fh[width * i:width * (i + 1)]]
+    return changed or ['other']
+
+def iter_names(records):
+    """(source, name) pairs from a CompactSnapshot or any iterable of record dicts."""
+    if isinstance(records, CompactSnapshot):
+        return records.iter_names()
+    return ((item['source'], item['name']) for item in records)